@@ -15,8 +15,15 @@ sc.camera.position = [0.45, 0.44, 0.43]
 
 ds = (sc.camera.focus - sc.camera.position) / N
 
-for _ in range(N):
-    sc.components[0].cmap_min = sc.components[0].cmap_max = None
-    sc.camera.position = sc.camera.position + ds
-    sc.camera._update_matrices()
-    rc.snap()
+
+def fly_through():
+    for i in range(N):
+        sc.components[0].cmap_min = sc.components[0].cmap_max = None
+        sc.camera.position = sc.camera.position + ds
+        sc.camera._update_matrices()
+        yield i
+
+
+# each frame is read back while the next one renders
+for i, image in rc.iter_frames(fly_through()):
+    yt.write_bitmap(image[:, :, :3], f"snap_{i:04d}.png")
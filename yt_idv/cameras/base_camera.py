@@ -56,6 +56,10 @@ class BaseCamera(traitlets.HasTraits):
 
     held = traitlets.Bool(False)
 
+    # reused between frames, see _set_uniforms and inverse_pmvm
+    _viewport = None
+    _inverse_pmvm = None
+
     @contextlib.contextmanager
     def hold_traits(self, func):
         # for some reason, hold_trait_notifications doesn't seem to work here.
@@ -107,17 +111,78 @@ class BaseCamera(traitlets.HasTraits):
         """
         pass
 
+    @traitlets.observe("projection_matrix", "view_matrix")
+    def _reset_inverse_pmvm(self, change):
+        self._inverse_pmvm = None
+
+    @property
+    def inverse_pmvm(self):
+        """The inverse of the combined projection and view matrices."""
+        if self._inverse_pmvm is None:
+            self._inverse_pmvm = np.linalg.inv(
+                self.projection_matrix @ self.view_matrix
+            )
+        return self._inverse_pmvm
+
     def _set_uniforms(self, scene, shader_program):
         GL.glDepthRange(0.0, 1.0)  # Not the same as near/far plane
         shader_program._set_uniform("projection", self.projection_matrix)
         shader_program._set_uniform("modelview", self.view_matrix)
-        shader_program._set_uniform(
-            "viewport", np.array(GL.glGetIntegerv(GL.GL_VIEWPORT), dtype="f4")
-        )
+        if self._viewport is None:
+            self._viewport = np.zeros(4, dtype="i4"), np.zeros(4, dtype="f4")
+        viewport, viewport_f4 = self._viewport
+        GL.glGetIntegerv(GL.GL_VIEWPORT, viewport)
+        viewport_f4[:] = viewport
+        shader_program._set_uniform("viewport", viewport_f4)
         shader_program._set_uniform("near_plane", self.near_plane)
         shader_program._set_uniform("far_plane", self.far_plane)
         shader_program._set_uniform("camera_pos", self.position)
 
+    @property
+    def frustum_planes(self):
+        """The six planes bounding the view frustum, as a (6, 4) array of
+        ``(a, b, c, d)`` with ``a * x + b * y + c * z + d >= 0`` inside."""
+        # Gribb & Hartmann: the rows of the combined matrix give the planes
+        m = self.projection_matrix @ self.view_matrix
+        return np.array(
+            [
+                m[3] + m[0],
+                m[3] - m[0],
+                m[3] + m[1],
+                m[3] - m[1],
+                m[3] + m[2],
+                m[3] - m[2],
+            ]
+        )
+
+    def boxes_in_frustum(self, left_edges, right_edges):
+        """
+        Test axis-aligned boxes against the view frustum.
+
+        Parameters
+        ----------
+
+        left_edges : (N, 3) array
+            The lower corners of the boxes.
+        right_edges : (N, 3) array
+            The upper corners of the boxes.
+
+        Returns
+        -------
+
+        (N,) bool array, False for the boxes that are entirely outside of
+        the frustum. This is conservative: some boxes near the corners of
+        the frustum may be kept although they are outside of it.
+        """
+        planes = self.frustum_planes
+        normals, offsets = planes[:, :3], planes[:, 3]
+        centers = (left_edges + right_edges) * 0.5
+        half_widths = (right_edges - left_edges) * 0.5
+        # the signed distance of the corner of each box furthest along each
+        # plane's normal
+        dist = centers @ normals.T + half_widths @ np.abs(normals).T + offsets
+        return np.all(dist >= 0.0, axis=1)
+
     def dict(self):
         # array attributes
         array_attrs = [
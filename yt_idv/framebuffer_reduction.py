@@ -0,0 +1,108 @@
+import numpy as np
+import traitlets
+from OpenGL import GL
+
+from yt_idv.opengl_support import Framebuffer
+from yt_idv.shader_objects import ShaderProgram, ShaderTrait
+
+# the factor each level of the reduction shrinks the previous one by, along
+# each axis, which must match REDUCE_FACTOR in minmax_reduce.frag.glsl
+REDUCE_FACTOR = 4
+
+
+class MinMaxReduction(traitlets.HasTraits):
+    """
+    Finds the min and max over the covered pixels of a framebuffer on the GPU.
+
+    The framebuffer is reduced over a chain of levels, each a quarter of the
+    size of the previous one along each axis, down to a single pixel holding
+    the min and max of the values and the number of covered pixels, so that
+    only those are read back rather than the whole framebuffer.
+
+    Pixels are covered where their alpha is above zero, and their value is
+    either their red channel or, for ``depth=True``, their depth.
+
+    Examples
+    --------
+
+    >>> reduction = MinMaxReduction()
+    >>> vmin, vmax, n_covered = reduction.reduce(fb, base_quad.vertex_array)
+    """
+
+    vertex_shader = ShaderTrait(allow_none=True).tag(shader_type="vertex")
+    fragment_shader = ShaderTrait(allow_none=True).tag(shader_type="fragment")
+    _program = traitlets.Instance(ShaderProgram, allow_none=True)
+    _levels = traitlets.List()
+    _size = None
+
+    @traitlets.default("vertex_shader")
+    def _vertex_shader_default(self):
+        return "passthrough"
+
+    @traitlets.default("fragment_shader")
+    def _fragment_shader_default(self):
+        return "minmax_reduce"
+
+    @traitlets.default("_program")
+    def _default_program(self):
+        return ShaderProgram(self.vertex_shader, self.fragment_shader)
+
+    @staticmethod
+    def level_sizes(width, height):
+        """The sizes of the levels reducing a width x height framebuffer."""
+        sizes = []
+        while not sizes or sizes[-1] != (1, 1):
+            width = -(-width // REDUCE_FACTOR)
+            height = -(-height // REDUCE_FACTOR)
+            sizes.append((width, height))
+        return sizes
+
+    def _framebuffers(self, width, height):
+        # the framebuffers of the levels are kept until the input size changes
+        if (width, height) != self._size:
+            levels = []
+            for level_width, level_height in self.level_sizes(width, height):
+                GL.glViewport(0, 0, level_width, level_height)
+                levels.append(Framebuffer())
+            self._levels = levels
+            self._size = (width, height)
+        return self._levels
+
+    def reduce(self, fb, vertex_array, depth=False):
+        """
+        The (min, max, number of covered pixels) of ``fb``, drawing the
+        fullscreen quad in ``vertex_array`` for each level, with a min and max
+        of inf and -inf if no pixels are covered.
+        """
+        width, height = fb.viewport[2:]
+        viewport = GL.glGetIntegerv(GL.GL_VIEWPORT)
+        size = np.array([width, height], dtype="int32")
+        previous = None
+        with fb.input_bind(1, 2), self._program.enable() as p:
+            p._set_uniform("fb_tex", 1)
+            p._set_uniform("db_tex", 2)
+            p._set_uniform("reduce_tex", 3)
+            p._set_uniform("reduce_depth", int(depth))
+            with vertex_array.bind(p):
+                for level, level_fb in zip(
+                    self.level_sizes(width, height),
+                    self._framebuffers(width, height),
+                ):
+                    GL.glViewport(0, 0, *level)
+                    p._set_uniform("reduce_first", int(previous is None))
+                    p._set_uniform("reduce_size", size)
+                    with level_fb.bind(clear=False):
+                        if previous is None:
+                            GL.glDrawArrays(GL.GL_TRIANGLES, 0, 6)
+                        else:
+                            with previous.fb_tex.bind(3):
+                                GL.glDrawArrays(GL.GL_TRIANGLES, 0, 6)
+                        if level == (1, 1):
+                            result = GL.glReadPixels(
+                                0, 0, 1, 1, GL.GL_RGBA, GL.GL_FLOAT
+                            )
+                    previous = level_fb
+                    size[:] = level
+        GL.glViewport(*viewport)
+        vmin, vmax, n_covered = np.asarray(result).reshape(4)[:3].tolist()
+        return vmin, vmax, int(n_covered)
@@ -13,7 +13,9 @@ in Interactive Data Visualization
 
 # This is a part of the experimental Interactive Data Visualization
 
-from contextlib import ExitStack, contextmanager
+import ctypes
+from collections import deque
+from contextlib import contextmanager
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -92,6 +94,18 @@ TEX_CHANNELS = {
         3: (GL.GL_UNSIGNED_BYTE, GL.GL_RGB8, GL.GL_RGB),
         4: (GL.GL_UNSIGNED_BYTE, GL.GL_RGBA8, GL.GL_RGBA),
     },
+    "float16": {
+        1: (GL.GL_HALF_FLOAT, GL.GL_R16F, GL.GL_RED),
+        2: (GL.GL_HALF_FLOAT, GL.GL_RG16F, GL.GL_RG),
+        3: (GL.GL_HALF_FLOAT, GL.GL_RGB16F, GL.GL_RGB),
+        4: (GL.GL_HALF_FLOAT, GL.GL_RGBA16F, GL.GL_RGBA),
+    },
+    "uint16": {
+        1: (GL.GL_UNSIGNED_SHORT, GL.GL_R16, GL.GL_RED),
+        2: (GL.GL_UNSIGNED_SHORT, GL.GL_RG16, GL.GL_RG),
+        3: (GL.GL_UNSIGNED_SHORT, GL.GL_RGB16, GL.GL_RGB),
+        4: (GL.GL_UNSIGNED_SHORT, GL.GL_RGBA16, GL.GL_RGBA),
+    },
     "uint32": {
         1: (GL.GL_UNSIGNED_INT, GL.GL_R32UI, GL.GL_RED),
         2: (GL.GL_UNSIGNED_INT, GL.GL_RG32UI, GL.GL_RG),
@@ -101,6 +115,65 @@ TEX_CHANNELS = {
 }
 
 
+# The formats data normalized to [0, 1] can be stored in on the GPU, and the
+# dtypes they are uploaded as. The unorm formats are normalized integers,
+# sampled back as floats in [0, 1].
+STORAGE_FORMATS = {
+    "float32": "float32",
+    "float16": "float16",
+    "unorm16": "uint16",
+    "unorm8": "uint8",
+}
+
+
+def encode_normalized_data(data, storage_format, log_ratio=0.0):
+    """
+    Convert ``data``, normalized to [0, 1], to ``storage_format``.
+
+    If ``log_ratio`` is larger than one, values are log-scaled first, and are
+    decoded as ``(log_ratio**v - 1) / (log_ratio - 1)``. For data normalized
+    from a range of (min, max), ``log_ratio`` should be ``max / min``. For
+    data with several channels along its last axis, ``log_ratio`` may hold a
+    value for each channel.
+    """
+    dtype = np.dtype(STORAGE_FORMATS[storage_format])
+    if np.ndim(log_ratio) > 0:
+        # channels with a ratio of at most one are stored linearly
+        is_log = np.asarray(log_ratio) > 1.0
+        if is_log.any():
+            ratio = np.where(is_log, log_ratio, np.e)
+            scaled = np.log1p(data * (ratio - 1.0)) / np.log(ratio)
+            data = np.where(is_log, scaled, data)
+    elif log_ratio > 1.0:
+        data = np.log1p(data * (log_ratio - 1.0)) / np.log(log_ratio)
+    if dtype.kind == "f":
+        return data.astype(dtype, copy=False)
+    codes = np.clip(data, 0.0, 1.0)
+    codes *= np.iinfo(dtype).max
+    np.rint(codes, out=codes)
+    # keep non-zero values distinguishable from zero
+    codes[(codes == 0) & (data > 0)] = 1
+    return codes.astype(dtype)
+
+
+def decode_normalized_data(data, storage_format, log_ratio=0.0):
+    """
+    The inverse of :func:`encode_normalized_data`: the values, in [0, 1],
+    that the shaders sample from ``data`` stored as ``storage_format``.
+    """
+    dtype = np.dtype(STORAGE_FORMATS[storage_format])
+    data = np.asarray(data, dtype="float32")
+    if dtype.kind == "u":
+        data = data / np.iinfo(dtype).max
+    log_ratio = np.asarray(log_ratio, dtype="float32")
+    if np.any(log_ratio > 1.0):
+        # channels with a ratio of at most one are stored linearly
+        ratio = np.where(log_ratio > 1.0, log_ratio, np.e)
+        scaled = (ratio**data - 1.0) / (ratio - 1.0)
+        data = np.where(log_ratio > 1.0, scaled, data)
+    return data
+
+
 def coerce_uniform_type(val, gl_type):
     # gl_type here must be in const_types
     if not isinstance(gl_type, const_types):
@@ -159,12 +232,28 @@ class GLValue(traitlets.TraitType):
         return value
 
 
+class TextureData(traittypes.Array):
+    """
+    A numpy array trait that, unlike ``traittypes.Array``, does not compare
+    an array with itself element by element when it is set again, as
+    ``HasTraits`` does with the values passed to its constructor, which
+    allocates a mask as large as the data.
+    """
+
+    def set(self, obj, value):
+        new_value = self._validate(obj, value)
+        old_value = obj._trait_values.get(self.name, self.default_value)
+        if new_value is old_value:
+            return
+        super().set(obj, new_value)
+
+
 TEX_TARGETS = {i: getattr(GL, f"GL_TEXTURE{i}") for i in range(10)}
 
 
 class Texture(traitlets.HasTraits):
     texture_name = traitlets.CInt(-1)
-    data = traittypes.Array(None, allow_none=True)
+    data = TextureData(None, allow_none=True)
     channels = GLValue("r32f")
     min_filter = GLValue("linear")
     mag_filter = GLValue("linear")
@@ -181,6 +270,11 @@ class Texture(traitlets.HasTraits):
         _ = GL.glActiveTexture(TEX_TARGETS[target])
         GL.glBindTexture(self.dim_enum, 0)
 
+    def delete(self):
+        """Release the storage of this texture on the GPU."""
+        GL.glDeleteTextures([self.texture_name])
+        self.texture_name = 0
+
 
 class Texture1D(Texture):
     boundary_x = TextureBoundary()
@@ -200,7 +294,8 @@ class Texture1D(Texture):
             GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
             if not isinstance(change["old"], np.ndarray):
                 GL.glTexStorage1D(GL.GL_TEXTURE_1D, 6, type1, dx)
-            GL.glTexSubImage1D(GL.GL_TEXTURE_1D, 0, 0, dx, type2, gl_type, data)
+            with _unpack_layout(data, 1) as pixels:
+                GL.glTexSubImage1D(GL.GL_TEXTURE_1D, 0, 0, dx, type2, gl_type, pixels)
             GL.glTexParameterf(GL.GL_TEXTURE_1D, GL.GL_TEXTURE_WRAP_S, self.boundary_x)
             GL.glTexParameteri(
                 GL.GL_TEXTURE_1D, GL.GL_TEXTURE_MIN_FILTER, self.min_filter
@@ -256,10 +351,13 @@ class Texture2D(Texture):
             gl_type, type1, type2 = TEX_CHANNELS[data.dtype.name][channels]
             GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
             if not isinstance(change["old"], np.ndarray):
-                GL.glTexStorage2D(GL.GL_TEXTURE_2D, 2, type1, dx, dy)
-            GL.glTexSubImage2D(
-                GL.GL_TEXTURE_2D, 0, 0, 0, dx, dy, type2, gl_type, data.swapaxes(0, 1)
-            )
+                # a 1x1 texture has no room for a second level
+                n_levels = 1 if max(dx, dy) == 1 else 2
+                GL.glTexStorage2D(GL.GL_TEXTURE_2D, n_levels, type1, dx, dy)
+            with _unpack_layout(data, 2) as pixels:
+                GL.glTexSubImage2D(
+                    GL.GL_TEXTURE_2D, 0, 0, 0, dx, dy, type2, gl_type, pixels
+                )
             GL.glTexParameterf(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, self.boundary_x)
             GL.glTexParameterf(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, self.boundary_y)
             GL.glTexParameteri(
@@ -303,6 +401,10 @@ class Texture3D(Texture):
     boundary_z = TextureBoundary()
     dims = 3
     dim_enum = GLValue("texture 3d")
+    # downsampled copies of data for mipmap levels 1 and up, each half the
+    # size of the previous level along each axis (rounding down, to at least
+    # 1), which need a mipmapped min_filter to be sampled
+    mipmaps = traitlets.List()
 
     @traitlets.observe("data")
     def _set_data(self, change):
@@ -319,26 +421,147 @@ class Texture3D(Texture):
             GL.glTexParameterf(GL.GL_TEXTURE_3D, GL.GL_TEXTURE_WRAP_T, self.boundary_y)
             GL.glTexParameterf(GL.GL_TEXTURE_3D, GL.GL_TEXTURE_WRAP_R, self.boundary_z)
             if not isinstance(change["old"], np.ndarray):
-                GL.glTexStorage3D(GL.GL_TEXTURE_3D, 1, type1, dx, dy, dz)
-            GL.glTexSubImage3D(
-                GL.GL_TEXTURE_3D, 0, 0, 0, 0, dx, dy, dz, type2, gl_type, data.T
-            )
+                n_levels = len(self.mipmaps) + 1
+                GL.glTexStorage3D(GL.GL_TEXTURE_3D, n_levels, type1, dx, dy, dz)
+                GL.glTexParameteri(
+                    GL.GL_TEXTURE_3D, GL.GL_TEXTURE_MAX_LEVEL, n_levels - 1
+                )
+            for level, level_data in enumerate([data] + self.mipmaps):
+                _upload_region_3d(level, (0, 0, 0), level_data, type2, gl_type)
             GL.glTexParameteri(
                 GL.GL_TEXTURE_3D, GL.GL_TEXTURE_MIN_FILTER, self.min_filter
             )
             GL.glTexParameteri(
                 GL.GL_TEXTURE_3D, GL.GL_TEXTURE_MAG_FILTER, self.mag_filter
             )
-            GL.glGenerateMipmap(GL.GL_TEXTURE_3D)
+
+    def update_region(self, data, offset=(0, 0, 0), mipmaps=None):
+        """Replace the subvolume of the texture starting at ``offset`` with
+        ``data``, keeping the host-side copy in sync. When replacing all of
+        the data, ``mipmaps`` replaces the mipmap levels as well."""
+        ox, oy, oz = offset
+        dx, dy, dz = data.shape[:3]
+        channels = data.shape[-1] if len(data.shape) == 4 else 1
+        if self.data is not None:
+            self.data[ox : ox + dx, oy : oy + dy, oz : oz + dz] = data
+        gl_type, _, type2 = TEX_CHANNELS[data.dtype.name][channels]
+        with self.bind():
+            GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+            _upload_region_3d(0, offset, data, type2, gl_type)
+            if mipmaps is None:
+                return
+            self.mipmaps = list(mipmaps)
+            for level, level_data in enumerate(self.mipmaps, 1):
+                _upload_region_3d(level, (0, 0, 0), level_data, type2, gl_type)
+
+
+def _upload_region_3d(level, offset, data, type2, gl_type):
+    # uploads data into the bound 3D texture, at offset within level
+    dx, dy, dz = data.shape[:3]
+    with _unpack_layout(data, 3) as pixels:
+        GL.glTexSubImage3D(
+            GL.GL_TEXTURE_3D, level, *offset, dx, dy, dz, type2, gl_type, pixels
+        )
+
+
+def _gl_order(data, dims):
+    # The view of data, with dims spatial axes followed by any channels, with
+    # its spatial axes reversed: OpenGL expects x to vary fastest, with the
+    # channels of each texel stored together, which is the C order of this
+    # view.
+    spatial = tuple(range(dims))[::-1]
+    return data.transpose(spatial + tuple(range(dims, data.ndim)))
+
+
+def empty_texture_data(shape, dtype, dims=3):
+    """
+    An uninitialized array of ``shape``, with ``dims`` spatial axes followed
+    by any channels, laid out in memory the way OpenGL reads textures: x
+    varying fastest, with the channels of each texel stored together.
+
+    Textures upload arrays laid out this way, like single channel
+    Fortran-ordered arrays, without copying them.
+    """
+    shape = tuple(shape)
+    reversed_shape = shape[:dims][::-1] + shape[dims:]
+    return _gl_order(np.empty(reversed_shape, dtype=dtype), dims)
+
+
+@contextmanager
+def _unpack_layout(data, dims):
+    # Yields the pixels to pass to glTexSubImage*D for data, with dims
+    # spatial axes followed by any channels. Data with texels stored
+    # contiguously along x, and rows and images at regular strides, such as
+    # Fortran-ordered arrays and slices of them, is passed in place with the
+    # GL_UNPACK_ROW_LENGTH and GL_UNPACK_IMAGE_HEIGHT describing its strides;
+    # anything else is copied once into the order OpenGL expects.
+    shape, strides = data.shape[:dims], data.strides[:dims]
+    texel = data.itemsize * int(np.prod(data.shape[dims:], dtype="i8"))
+    texel_contiguous = data[(0,) * dims].flags.c_contiguous if data.size else False
+    # the length of rows and height of images in texels, from the strides
+    # along y and z, which are free for axes of length 1
+    row_length = strides[1] // texel if dims > 1 and shape[1] > 1 else shape[0]
+    image_height = 1
+    if dims > 2:
+        row_nbytes = row_length * texel
+        image_height = strides[2] // row_nbytes if shape[2] > 1 else shape[1]
+    expected = (texel, row_length * texel, image_height * row_length * texel)
+    in_place = (
+        texel_contiguous
+        and all(
+            n == 1 or stride == expect
+            for n, stride, expect in zip(shape, strides, expected)
+        )
+        and row_length >= shape[0]
+        and (dims < 3 or image_height >= shape[1])
+    )
+    if not in_place:
+        yield np.ascontiguousarray(_gl_order(data, dims))
+        return
+    GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, row_length)
+    GL.glPixelStorei(GL.GL_UNPACK_IMAGE_HEIGHT, image_height)
+    try:
+        yield ctypes.c_void_p(data.ctypes.data)
+    finally:
+        GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, 0)
+        GL.glPixelStorei(GL.GL_UNPACK_IMAGE_HEIGHT, 0)
 
 
 class VertexAttribute(traitlets.HasTraits):
+    """
+    An array of per-vertex (or, with a ``divisor``, per-instance) values held
+    in a buffer on the GPU.
+
+    Setting ``data`` to an array of the same size as the buffer updates it in
+    place, and reallocates it otherwise. The array is copied, so that later
+    changes to it, or to ``data`` through ``set_range``, do not affect the
+    other. ``usage`` is the hint passed to the driver when allocating, one of
+    "static draw" for data set once, "dynamic draw" for data updated now and
+    then and "stream draw" for data updated every frame; changing it
+    reallocates the buffer. For streaming, ``orphan`` has each update allocate
+    fresh storage, so that it does not wait on draws still using the old
+    contents. ``set_range`` updates part of the data.
+
+    Examples
+    --------
+
+    >>> positions = VertexAttribute(name="position", usage="stream draw")
+    >>> positions.data = particle_positions
+    >>> positions.set_range(10, particle_positions[10:20] + velocities * dt)
+    """
+
     name = traitlets.CUnicode("attr")
     id = traitlets.CInt(-1)
     data = traittypes.Array(None, allow_none=True)
     each = traitlets.CInt(-1)
     opengl_type = traitlets.CInt(GL.GL_FLOAT)
     divisor = traitlets.CInt(0)
+    usage = GLValue("static draw")
+    orphan = traitlets.Bool(False)
+    # the size of the storage allocated for the buffer, in bytes, and the
+    # usage it was allocated with
+    _buffer_nbytes = None
+    _buffer_usage = None
 
     @traitlets.default("id")
     def _id_default(self):
@@ -360,42 +583,152 @@ class VertexAttribute(traitlets.HasTraits):
             GL.glDisableVertexAttribArray(loc)
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
 
+    @traitlets.validate("data")
+    def _validate_data(self, proposal):
+        if proposal["value"] is None:
+            return None
+        return np.array(proposal["value"], order="C")
+
     @traitlets.observe("data")
     def _set_data(self, change):
-        arr = change["new"]
+        self._upload_data()
+
+    @traitlets.observe("usage")
+    def _set_usage(self, change):
+        if self._buffer_usage not in (None, self.usage) and self.data is not None:
+            self._upload_data()
+
+    def _upload_data(self):
+        arr = self.data
         self.each = arr.shape[-1]
         self.opengl_type = np_to_gl[arr.dtype.name]
         with self.bind():
-            GL.glBufferData(GL.GL_ARRAY_BUFFER, arr.nbytes, arr, GL.GL_STATIC_DRAW)
+            if arr.nbytes != self._buffer_nbytes or self.usage != self._buffer_usage:
+                GL.glBufferData(GL.GL_ARRAY_BUFFER, arr.nbytes, arr, self.usage)
+                self._buffer_nbytes = arr.nbytes
+                self._buffer_usage = self.usage
+                return
+            if self.orphan:
+                GL.glBufferData(GL.GL_ARRAY_BUFFER, arr.nbytes, None, self.usage)
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, 0, arr.nbytes, arr)
+
+    def set_range(self, offset, values):
+        """
+        Replace the values of ``data`` starting at index ``offset`` along its
+        first axis with ``values``, uploading only those to the GPU.
+        """
+        if self.data is None:
+            raise RuntimeError("No data has been set to update a range of.")
+        values = np.ascontiguousarray(values, dtype=self.data.dtype)
+        if values.shape[1:] != self.data.shape[1:]:
+            raise ValueError(
+                f"Values of shape {values.shape} do not match data of shape "
+                f"{self.data.shape}."
+            )
+        if offset < 0 or offset + values.shape[0] > self.data.shape[0]:
+            raise IndexError(
+                f"Range [{offset}, {offset + values.shape[0]}) is out of bounds "
+                f"for data of length {self.data.shape[0]}."
+            )
+        # edited in place, which does not notify _set_data; data is a copy of
+        # the array it was set to, which is left as is
+        self.data[offset : offset + values.shape[0]] = values
+        row_nbytes = self.data[:1].nbytes
+        with self.bind():
+            GL.glBufferSubData(
+                GL.GL_ARRAY_BUFFER, offset * row_nbytes, values.nbytes, values
+            )
+
+
+# the traits of vertex attributes recorded in the layouts of vertex arrays
+_LAYOUT_TRAITS = ["id", "each", "opengl_type", "divisor"]
 
 
 class VertexArray(traitlets.HasTraits):
+    """
+    A set of vertex attributes drawn together, and their indices if any.
+
+    The layout of the attributes for each program the array is drawn with is
+    recorded once in a vertex array object of its own, which is then bound
+    for every draw. The recorded layouts are dropped whenever they would
+    change: when attributes are added or removed, the type or shape of their
+    data changes, or a program is relinked or deleted.
+    """
+
     name = traitlets.CUnicode("vertex")
     id = traitlets.CInt(-1)
     indices = traittypes.Array(None, allow_none=True)
     index_id = traitlets.CInt(-1)
     attributes = traitlets.List(trait=traitlets.Instance(VertexAttribute))
     each = traitlets.CInt(-1)
+    # the vertex array object recorded for each program, and the attributes
+    # recorded in them
+    _program_vaos = traitlets.Dict()
+    _recorded_attributes = None
 
     @traitlets.default("id")
     def _id_default(self):
         return GL.glGenVertexArrays(1)
 
-    @contextmanager
-    def bind(self, program=None):
-        GL.glBindVertexArray(self.id)
+    def _watch_attributes(self):
+        # the attributes list is edited in place, which does not notify, so
+        # it is compared with the attributes recorded instead
+        for attr in self._recorded_attributes or ():
+            attr.unobserve(self._release_vaos, names=_LAYOUT_TRAITS)
+        self._recorded_attributes = list(self.attributes)
+        for attr in self._recorded_attributes:
+            attr.observe(self._release_vaos, names=_LAYOUT_TRAITS)
+        self._release_vaos()
+
+    @traitlets.observe("index_id")
+    def _release_vaos(self, change=None):
+        for vao in self._program_vaos.values():
+            GL.glDeleteVertexArrays(1, [vao])
+        self._program_vaos = {}
+
+    def _release_program(self, program_id):
+        # called by programs being relinked or deleted
+        vao = self._program_vaos.pop(program_id, None)
+        if vao is not None:
+            GL.glDeleteVertexArrays(1, [vao])
+
+    def _record_layout(self, program):
+        vao = GL.glGenVertexArrays(1)
+        GL.glBindVertexArray(vao)
         if self.index_id != -1:
             GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.index_id)
+        for attr in self.attributes:
+            loc = program._attribute_location(attr.name)
+            if loc < 0:
+                continue
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, attr.id)
+            GL.glVertexAttribDivisor(loc, attr.divisor)
+            GL.glEnableVertexAttribArray(loc)
+            GL.glVertexAttribPointer(loc, attr.each, attr.opengl_type, False, 0, None)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        program._vertex_arrays.add(self)
+        return vao
+
+    @contextmanager
+    def bind(self, program=None):
         # We only bind the attributes if we have a program too
         if program is None:
-            attrs = []
-        else:
-            attrs = self.attributes
-        with ExitStack() as stack:
-            _ = [stack.enter_context(_.bind(program)) for _ in attrs]
+            GL.glBindVertexArray(self.id)
+            if self.index_id != -1:
+                GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.index_id)
             yield
-        if self.index_id != -1:
-            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
+            if self.index_id != -1:
+                GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
+            GL.glBindVertexArray(0)
+            return
+        if self._recorded_attributes != self.attributes:
+            self._watch_attributes()
+        vao = self._program_vaos.get(program.program)
+        if vao is None:
+            vao = self._record_layout(program)
+            self._program_vaos[program.program] = vao
+        GL.glBindVertexArray(vao)
+        yield
         GL.glBindVertexArray(0)
 
     @traitlets.observe("indices")
@@ -452,7 +785,8 @@ class Framebuffer(traitlets.HasTraits):
 
     @traitlets.default("fb_tex")
     def _fb_tex_default(self):
-        data = np.zeros((self.viewport[2], self.viewport[3], 4), "f4")
+        data = empty_texture_data((self.viewport[2], self.viewport[3], 4), "f4", 2)
+        data.fill(0.0)
         return Texture2D(data=data, boundary_x="repeat", boundary_y="repeat")
 
     @traitlets.default("db_tex")
@@ -511,6 +845,105 @@ class Framebuffer(traitlets.HasTraits):
                 yield
 
 
+class PixelReadback(traitlets.HasTraits):
+    """
+    Reads pixels back from the GPU asynchronously, through a ring of
+    ``n_buffers`` pixel buffer objects.
+
+    ``start`` queues a read of a region of the bound framebuffer into the next
+    free buffer and returns right away, while ``finish`` waits for the oldest
+    queued read and returns its pixels as ``glReadPixels`` would, so that
+    reading one frame back overlaps with rendering the next.
+
+    Examples
+    --------
+
+    >>> readback = PixelReadback(n_buffers=2)
+    >>> readback.start(0, 0, width, height, tag=frame)
+    >>> # render the next frame
+    >>> frame, pixels = readback.finish()
+    """
+
+    n_buffers = traitlets.CInt(2)
+    format = GLValue("rgba")
+
+    _buffer_ids = None
+    _buffer_nbytes = None
+    _pending = None
+    _next = 0
+
+    @property
+    def pending(self):
+        """The number of reads queued and not finished yet."""
+        return 0 if self._pending is None else len(self._pending)
+
+    @property
+    def full(self):
+        """Whether every buffer holds a read that has yet to be finished."""
+        return self.pending >= self.n_buffers
+
+    def start(self, x, y, width, height, tag=None):
+        """Queue a read of the region of the bound framebuffer starting at
+        (x, y), returning ``tag`` along with the pixels from ``finish``."""
+        if self.full:
+            raise RuntimeError("All pixel buffers are in use, call finish first.")
+        if self._buffer_ids is None:
+            self._buffer_ids = np.atleast_1d(GL.glGenBuffers(self.n_buffers))
+            self._buffer_nbytes = [0] * self.n_buffers
+            self._pending = deque()
+        channels = 1 if self.format == GL.GL_DEPTH_COMPONENT else 4
+        # as returned by glReadPixels
+        shape = (width, height, channels) if channels > 1 else (width, height)
+        nbytes = width * height * channels * 4
+        slot = self._next
+        self._next = (slot + 1) % self.n_buffers
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self._buffer_ids[slot])
+        if self._buffer_nbytes[slot] != nbytes:
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, nbytes, None, GL.GL_STREAM_READ)
+            self._buffer_nbytes[slot] = nbytes
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 4)
+        # with a pack buffer bound, the last argument is an offset into it
+        GL.glReadPixels(
+            x, y, width, height, self.format, GL.GL_FLOAT, ctypes.c_void_p(0)
+        )
+        fence = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self._pending.append((slot, fence, shape, tag))
+
+    def finish(self):
+        """Wait for the oldest queued read, returning its tag and pixels."""
+        if not self.pending:
+            raise RuntimeError("No pixel reads are queued.")
+        slot, fence, shape, tag = self._pending.popleft()
+        result = GL.GL_TIMEOUT_EXPIRED
+        while result == GL.GL_TIMEOUT_EXPIRED:
+            result = GL.glClientWaitSync(
+                fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, 1_000_000_000
+            )
+        GL.glDeleteSync(fence)
+        if result == GL.GL_WAIT_FAILED:
+            raise RuntimeError("Waiting for a pixel read failed.")
+        pixels = np.empty(shape, dtype="f4")
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self._buffer_ids[slot])
+        ptr = GL.glMapBufferRange(
+            GL.GL_PIXEL_PACK_BUFFER, 0, pixels.nbytes, GL.GL_MAP_READ_BIT
+        )
+        ctypes.memmove(pixels.ctypes.data, ptr, pixels.nbytes)
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        return tag, pixels
+
+    def delete(self):
+        """Free the buffers, dropping any reads that were not finished."""
+        if self._buffer_ids is None:
+            return
+        for _, fence, _, _ in self._pending:
+            GL.glDeleteSync(fence)
+        GL.glDeleteBuffers(self.n_buffers, self._buffer_ids)
+        self._buffer_ids = self._buffer_nbytes = self._pending = None
+        self._next = 0
+
+
 class Texture3DIterator(traitlets.HasTraits):
     items = traitlets.Any()
 
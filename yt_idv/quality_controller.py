@@ -0,0 +1,169 @@
+import time
+
+import numpy as np
+import traitlets
+from OpenGL import GL
+
+
+class QualityController(traitlets.HasTraits):
+    """
+    Trades image quality for frame rate while the camera is moving.
+
+    Each frame rendered while the user is interacting with the camera is
+    rendered at a reduced ``quality`` between ``min_quality`` and 1, chosen so
+    that the frame takes about ``target_frame_ms``. The cost of a frame at full
+    quality is estimated from the timings of the frames actually rendered,
+    measured on the GPU and read back once available rather than waiting for
+    each frame to finish, so that they arrive a frame or two late.
+    Once no interaction has been reported for ``idle_delay`` seconds, the
+    quality is multiplied by ``refine_factor`` with every frame until the
+    scene is back at full quality.
+
+    The quality sets the fraction of the full resolution that components
+    render at, ``render_scale``, the factor their sampling rate is scaled
+    by, ``sample_scale``, and the number of AMR levels dropped from the
+    finest rendered, ``level_drop``, such that the cost of a frame is roughly
+    proportional to the quality.
+
+    Parameters
+    ----------
+    target_frame_ms : float
+        The time to aim for when rendering while interacting, in milliseconds.
+    min_quality : float
+        The lowest quality to render at.
+    refine_factor : float
+        The factor the quality is multiplied by with each frame once idle.
+    idle_delay : float
+        The time since the last interaction after which the quality is
+        refined, in seconds.
+    max_level_drop : int
+        The number of AMR levels dropped at ``min_quality``.
+
+    Examples
+    --------
+
+    >>> rc.scene.quality_controller = QualityController(target_frame_ms=50)
+    >>> rc.scene.quality_controller.interact()
+    >>> preview = rc.run()
+    """
+
+    target_frame_ms = traitlets.CFloat(33.0)
+    min_quality = traitlets.CFloat(0.05)
+    refine_factor = traitlets.CFloat(2.0)
+    idle_delay = traitlets.CFloat(0.25)
+    max_level_drop = traitlets.CInt(2)
+    quality = traitlets.CFloat(1.0)
+    frame_ms = traitlets.CFloat(None, allow_none=True)
+
+    # an estimate of the time taken by a frame at full quality
+    _full_frame_ms = None
+    _last_interaction = -np.inf
+    _frame_cost = 1.0
+    # the GL_TIME_ELAPSED query of the frame being drawn, the queries of the
+    # frames whose timings are still to be read, with their costs, oldest
+    # first, and the queries free for reuse
+    _query = None
+    _pending_queries = None
+    _free_queries = None
+
+    def interact(self):
+        """Report an interaction, such as the camera moving."""
+        self._last_interaction = time.perf_counter()
+
+    def end_interaction(self):
+        """Report the end of an interaction, to start refining right away."""
+        self._last_interaction = -np.inf
+
+    @property
+    def interacting(self):
+        elapsed = time.perf_counter() - self._last_interaction
+        return elapsed < self.idle_delay
+
+    @property
+    def refining(self):
+        """Whether rendering again would improve the image."""
+        return self.interacting or self.quality < 1.0
+
+    @property
+    def render_scale(self):
+        # in steps of 1/8, so that framebuffers are only reallocated for a
+        # handful of sizes
+        return max(np.floor(self.quality**0.25 * 8) / 8, 0.125)
+
+    @property
+    def sample_scale(self):
+        return self.quality**0.5
+
+    @property
+    def level_drop(self):
+        return int(round(self.max_level_drop * (1.0 - self.quality)))
+
+    def _interactive_quality(self):
+        if self._full_frame_ms is None:
+            return 1.0
+        quality = self.target_frame_ms / self._full_frame_ms
+        return float(np.clip(quality, self.min_quality, 1.0))
+
+    def start_frame(self):
+        """Choose the quality of the next frame."""
+        if self.interacting:
+            self.quality = self._interactive_quality()
+        else:
+            self.quality = min(self.quality * self.refine_factor, 1.0)
+        # the fraction of the full cost of a frame: the pixels rendered times
+        # the samples taken along each ray
+        self._frame_cost = self.render_scale**2 * self.sample_scale
+
+    def begin_timing(self):
+        """Start timing the current frame on the GPU, once it is known to
+        need drawing."""
+        if self._free_queries:
+            query = self._free_queries.pop()
+        else:
+            query = int(GL.glGenQueries(1)[0])
+        GL.glBeginQuery(GL.GL_TIME_ELAPSED, query)
+        self._query = query
+
+    def end_frame(self):
+        """Finish timing the current frame, recording the timings of the
+        frames that the GPU has finished without waiting for the others."""
+        if self._query is not None:
+            GL.glEndQuery(GL.GL_TIME_ELAPSED)
+            if self._pending_queries is None:
+                self._pending_queries = []
+            self._pending_queries.append((self._query, self._frame_cost))
+            self._query = None
+        self._read_timings()
+
+    def cancel_frame(self):
+        """Skip the current frame, which turned out not to need drawing,
+        still recording the timings of earlier frames."""
+        self._read_timings()
+
+    def _read_timings(self):
+        # queries complete in the order they were issued
+        while self._pending_queries:
+            query, frame_cost = self._pending_queries[0]
+            if not GL.glGetQueryObjectiv(query, GL.GL_QUERY_RESULT_AVAILABLE):
+                break
+            # in nanoseconds, which 32 bits hold for frames of up to 4 seconds
+            elapsed = GL.glGetQueryObjectuiv(query, GL.GL_QUERY_RESULT)
+            self._pending_queries.pop(0)
+            if self._free_queries is None:
+                self._free_queries = []
+            self._free_queries.append(query)
+            self.record_frame(elapsed / 1e6, frame_cost)
+
+    def record_frame(self, frame_ms, frame_cost=None):
+        """Update the estimated cost of a full quality frame from the time
+        taken by a frame, in milliseconds, of the given fraction of the full
+        cost, by default that of the current frame."""
+        if frame_cost is None:
+            frame_cost = self._frame_cost
+        self.frame_ms = frame_ms
+        full_frame_ms = frame_ms / frame_cost
+        if self._full_frame_ms is None:
+            self._full_frame_ms = full_frame_ms
+        else:
+            # smooth over the noise in the timings of single frames
+            self._full_frame_ms = 0.5 * (self._full_frame_ms + full_frame_ms)
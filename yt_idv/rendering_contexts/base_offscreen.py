@@ -1,5 +1,8 @@
+from OpenGL import GL
 from yt import write_bitmap
 
+from yt_idv.opengl_support import PixelReadback
+
 from .base_context import BaseContext
 
 
@@ -15,6 +18,56 @@ class OffscreenRenderingContext(BaseContext):
             return
         return self.scene.image
 
+    def iter_frames(self, frames, n_buffers=2):
+        """
+        Render a frame for each item of ``frames``, yielding ``(item, image)``
+        pairs in order, where ``image`` is what ``scene.image`` holds just
+        after that frame is rendered.
+
+        Items are taken from ``frames`` right before their frame is rendered,
+        so a generator can update the scene between frames. Images are read
+        back asynchronously while up to ``n_buffers - 1`` later frames render,
+        rather than stalling the GPU on every frame.
+
+        Parameters
+        ----------
+        frames : iterable
+            One item per frame to render.
+        n_buffers : int, optional
+            The number of frames read back at once.
+
+        Examples
+        --------
+
+        >>> def fly_through():
+        ...     for i in range(100):
+        ...         rc.scene.camera.offset_position(0.01)
+        ...         yield i
+        >>> for i, image in rc.iter_frames(fly_through()):
+        ...     yt.write_bitmap(image[:, :, :3], f"frame_{i:04d}.png")
+        """
+        if self.scene is None:
+            return
+        readback = PixelReadback(n_buffers=n_buffers)
+        try:
+            for item in frames:
+                if readback.full:
+                    yield self._finish_readback(readback)
+                self.scene.render()
+                with self.scene.bind_buffer():
+                    _, _, width, height = GL.glGetIntegerv(GL.GL_VIEWPORT)
+                    readback.start(0, 0, width, height, tag=item)
+            while readback.pending:
+                yield self._finish_readback(readback)
+        finally:
+            readback.delete()
+
+    @staticmethod
+    def _finish_readback(readback):
+        item, image = readback.finish()
+        # flipped as in SceneGraph.image
+        return item, image[::-1, :, :]
+
     def snap(self, *args, **kwargs):
         if self.scene is None:
             return
@@ -68,9 +68,17 @@ class PygletRenderingContext(pyglet.window.Window, BaseContext):
             self._do_update = False
             self.clear()
             if self.scene is not None:
-                # This should check if the scene is actually dirty, and only
-                # redraw the FB if it's not; this might need another flag
-                self.scene.render()
+                # components only render their first pass again once it has
+                # changed, but the window was just cleared, so their
+                # framebuffers are always composited
+                self.scene.render(redraw=True)
+                # keep drawing while data is streamed in, or while the
+                # quality is refined after an interaction
+                if self.scene.has_pending_uploads:
+                    self._do_update = True
+                controller = self.scene.quality_controller
+                if controller is not None and controller.refining:
+                    self._do_update = True
                 if self.image_widget is not None:
                     self.image_widget.value = write_bitmap(
                         self.scene.image[:, :, :3], None
@@ -112,8 +120,15 @@ class PygletRenderingContext(pyglet.window.Window, BaseContext):
 
     def on_mouse_release(self, x, y, button, modifiers):
         self._currently_clicked = False
+        if self.scene.quality_controller is not None:
+            self.scene.quality_controller.end_interaction()
         self._do_update = True
 
+    def _interact(self):
+        # the camera is moving, so render quickly rather than well
+        if self.scene.quality_controller is not None:
+            self.scene.quality_controller.interact()
+
     def on_mouse_drag(self, x, y, dx, dy, buttons, modifiers):
         if self.gui and self.gui.mouse_event_handled:
             self._do_update = True
@@ -124,6 +139,7 @@ class PygletRenderingContext(pyglet.window.Window, BaseContext):
         end_y = -1.0 + 2.0 * (y + dy) / self.height
 
         self.scene.camera.update_orientation(start_x, start_y, end_x, end_y)
+        self._interact()
         self._do_update = True
 
     def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
@@ -144,6 +160,7 @@ class PygletRenderingContext(pyglet.window.Window, BaseContext):
         # flip it so scrolling "down" zooms out:
         zoom_inout = -1 * scroll_y
         self.scene.camera.offset_position(zoom_inout * dpos)
+        self._interact()
         self._do_update = True
 
     def on_key_press(self, symbol, modifiers):
@@ -1,4 +1,3 @@
-import numpy as np
 import traitlets
 from OpenGL import GL
 
@@ -37,4 +36,6 @@ class BoxAnnotation(SceneAnnotation):
     def _set_uniforms(self, scene, shader_program):
         shader_program._set_uniform("box_width", self.box_width)
         shader_program._set_uniform("box_alpha", self.box_alpha)
-        shader_program._set_uniform("box_color", np.array(self.box_color))
+        box_color = self._uniform_buffer("box_color", 3)
+        box_color[:] = self.box_color
+        shader_program._set_uniform("box_color", box_color)
@@ -4,6 +4,7 @@ from OpenGL import GL
 
 from yt_idv._cmyt_utilities import cmyt_names
 from yt_idv.constants import FULLSCREEN_QUAD
+from yt_idv.framebuffer_reduction import MinMaxReduction
 from yt_idv.gui_support import add_popup_help
 from yt_idv.opengl_support import (
     ColormapTexture,
@@ -30,14 +31,20 @@ _buffers = ["frame", "depth"]
 
 _geom_directives = {"spherical": "SPHERICAL_GEOM"}
 
+# the texture units of the ds_tex samplers, of which only the first is used
+_DS_TEX_UNITS = np.zeros(6, dtype="int32")
+
 
 class SceneComponent(traitlets.HasTraits):
+    # Traits tagged with second_pass only affect how the first pass is
+    # composited onto the scene, or nothing drawn at all, so changing them
+    # never requires the first pass to be rendered again.
     data = traitlets.Instance(SceneData)
     base_quad = traitlets.Instance(SceneData)
     name = "undefined"
-    priority = traitlets.CInt(0)
-    visible = traitlets.Bool(True)
-    use_db = traitlets.Bool(False)  # use depth buffer
+    priority = traitlets.CInt(0).tag(second_pass=True)
+    visible = traitlets.Bool(True).tag(second_pass=True)
+    use_db = traitlets.Bool(False).tag(second_pass=True)  # use depth buffer
     iso_tolerance = traitlets.CFloat(-1)  # the tolerance for finding isocontours
     iso_tol_is_pct = traitlets.Bool(False)  # if True, the tolerance is a fraction
     iso_log = traitlets.Bool(True)  # if True, iso values are base 10 exponents
@@ -49,43 +56,65 @@ class SceneComponent(traitlets.HasTraits):
         traitlets.CFloat(),
         traitlets.CFloat(),
         default_value=(0.0, 1.0, 0.0, 1.0),
-    )
-    clear_region = traitlets.Bool(False)
+    ).tag(second_pass=True)
+    clear_region = traitlets.Bool(False).tag(second_pass=True)
 
     render_method = traitlets.Unicode(allow_none=True)
     fragment_shader = ShaderTrait(allow_none=True).tag(shader_type="fragment")
     geometry_shader = ShaderTrait(allow_none=True).tag(shader_type="geometry")
     vertex_shader = ShaderTrait(allow_none=True).tag(shader_type="vertex")
     fb = traitlets.Instance(Framebuffer)
-    colormap_fragment = ShaderTrait(allow_none=True).tag(shader_type="fragment")
-    colormap_vertex = ShaderTrait(allow_none=True).tag(shader_type="vertex")
-    colormap = traitlets.Instance(ColormapTexture)
+    _scaled_fbs = traitlets.Dict()
+    colormap_fragment = ShaderTrait(allow_none=True).tag(
+        shader_type="fragment", second_pass=True
+    )
+    colormap_vertex = ShaderTrait(allow_none=True).tag(
+        shader_type="vertex", second_pass=True
+    )
+    colormap = traitlets.Instance(ColormapTexture).tag(second_pass=True)
     _program1 = traitlets.Instance(ShaderProgram, allow_none=True)
-    _program2 = traitlets.Instance(ShaderProgram, allow_none=True)
+    _program2 = traitlets.Instance(ShaderProgram, allow_none=True).tag(second_pass=True)
     _program1_pp_defs = traitlets.Instance(PreprocessorDefinitionState, allow_none=True)
-    _program2_pp_defs = traitlets.Instance(PreprocessorDefinitionState, allow_none=True)
+    _program2_pp_defs = traitlets.Instance(
+        PreprocessorDefinitionState, allow_none=True
+    ).tag(second_pass=True)
     _program1_invalid = True
     _program2_invalid = True
     _cmap_bounds_invalid = True
+    # The first pass is only rendered again once something it depends on has
+    # changed: one of the component's own traits, its data, or the state
+    # returned by _first_pass_state, such as the camera. _composite_dirty
+    # flags changes to anything drawn, for scenes skipping whole frames.
+    _first_pass_dirty = True
+    _first_pass_key = None
+    _composite_dirty = True
+    _uniform_buffers = None
     _data_geometry = traitlets.Unicode(default_value="cartesian")
 
-    display_name = traitlets.Unicode(allow_none=True)
+    display_name = traitlets.Unicode(allow_none=True).tag(second_pass=True)
 
-    final_pass_vertex = ShaderTrait(allow_none=True).tag(shader_type="vertex")
-    final_pass_fragment = ShaderTrait(allow_none=True).tag(shader_type="fragment")
-    _final_pass = traitlets.Instance(ShaderProgram, allow_none=True)
+    final_pass_vertex = ShaderTrait(allow_none=True).tag(
+        shader_type="vertex", second_pass=True
+    )
+    final_pass_fragment = ShaderTrait(allow_none=True).tag(
+        shader_type="fragment", second_pass=True
+    )
+    _final_pass = traitlets.Instance(ShaderProgram, allow_none=True).tag(
+        second_pass=True
+    )
     _final_pass_invalid = True
+    _cmap_reduction = traitlets.Instance(MinMaxReduction).tag(second_pass=True)
 
     # These attributes are just for colormap application
-    fixed_cmap_min = traitlets.CFloat(None, allow_none=True)
-    fixed_cmap_max = traitlets.CFloat(None, allow_none=True)
-    cmap_min = traitlets.CFloat(None, allow_none=True)
-    cmap_max = traitlets.CFloat(None, allow_none=True)
-    cmap_log = traitlets.Bool(True)
+    fixed_cmap_min = traitlets.CFloat(None, allow_none=True).tag(second_pass=True)
+    fixed_cmap_max = traitlets.CFloat(None, allow_none=True).tag(second_pass=True)
+    cmap_min = traitlets.CFloat(None, allow_none=True).tag(second_pass=True)
+    cmap_max = traitlets.CFloat(None, allow_none=True).tag(second_pass=True)
+    cmap_log = traitlets.Bool(True).tag(second_pass=True)
     scale = traitlets.CFloat(1.0)
 
     # This attribute determines whether or not this component is "active"
-    active = traitlets.Bool(True)
+    active = traitlets.Bool(True).tag(second_pass=True)
 
     @traitlets.observe("_data_geometry")
     def _update_geometry_pp_directives(self, change):
@@ -120,6 +149,98 @@ class SceneComponent(traitlets.HasTraits):
         ):
             self._data_geometry = change["new"]._yt_geom_str
 
+    @traitlets.observe("data")
+    def _observe_data_field(self, change):
+        # colormap bounds follow the data when it switches fields
+        old, new = change["old"], change["new"]
+        if isinstance(old, traitlets.HasTraits) and old.has_trait("field"):
+            old.unobserve(self._invalidate_cmap_bounds, names="field")
+        if isinstance(new, traitlets.HasTraits) and new.has_trait("field"):
+            new.observe(self._invalidate_cmap_bounds, names="field")
+
+    def _invalidate_cmap_bounds(self, change=None):
+        self._cmap_bounds_invalid = True
+
+    @traitlets.observe(traitlets.All)
+    def _invalidate_passes(self, change):
+        self._composite_dirty = True
+        if not self.trait_metadata(change["name"], "second_pass"):
+            self._first_pass_dirty = True
+
+    def _invalidate_first_pass(self, change=None):
+        self._first_pass_dirty = self._composite_dirty = True
+
+    def _invalidate_composite(self, change=None):
+        self._composite_dirty = True
+
+    @traitlets.observe("data")
+    def _observe_data_changes(self, change):
+        # anything about the data may change what the first pass draws, other
+        # than the statistics it keeps about drawing
+        old, new = change["old"], change["new"]
+        if isinstance(old, SceneData):
+            old.unobserve(self._invalidate_first_pass_data)
+        if isinstance(new, SceneData):
+            new.observe(self._invalidate_first_pass_data)
+
+    def _invalidate_first_pass_data(self, change):
+        if change["name"] not in change["owner"]._drawing_stats:
+            self._invalidate_first_pass()
+
+    @traitlets.observe("colormap")
+    def _observe_colormap(self, change):
+        old, new = change["old"], change["new"]
+        if isinstance(old, traitlets.HasTraits):
+            old.unobserve(self._invalidate_composite)
+        if isinstance(new, traitlets.HasTraits):
+            new.observe(self._invalidate_composite)
+
+    def _first_pass_state(self, scene):
+        # The state from outside of the component that its first pass
+        # depends on, other than its viewport, compared between frames.
+        camera = scene.camera
+        return (
+            camera.projection_matrix.tobytes(),
+            camera.view_matrix.tobytes(),
+            np.asarray(camera.position, dtype="f8").tobytes(),
+            np.asarray(camera.focus, dtype="f8").tobytes(),
+            camera.near_plane,
+            camera.far_plane,
+            scene.render_scale,
+            scene.sample_scale,
+            # edited in place
+            tuple(self.iso_layers),
+            tuple(self.iso_layers_alpha),
+        )
+
+    @staticmethod
+    def _first_pass_viewport(width, height, render_scale):
+        # the first pass may render at a fraction of the resolution, to be
+        # scaled up by the second
+        return (
+            0,
+            0,
+            max(int(width * render_scale), 1),
+            max(int(height * render_scale), 1),
+        )
+
+    def _first_pass_key_for(self, scene, width, height):
+        # what the first pass is compared by between frames, when drawn into
+        # a viewport of width x height
+        viewport = self._first_pass_viewport(width, height, scene.render_scale)
+        return self._first_pass_state(scene), viewport
+
+    def _needs_render(self, scene, viewport):
+        # whether drawing this component into viewport, as set from its
+        # display_bounds, would change the scene's image
+        if self._composite_dirty or self._cmap_bounds_invalid:
+            return True
+        if not self.visible:
+            return False
+        if self._first_pass_dirty:
+            return True
+        return self._first_pass_key_for(scene, *viewport[2:]) != self._first_pass_key
+
     @traitlets.observe("display_bounds")
     def _change_display_bounds(self, change):
         # We need to update the framebuffer if the width or height has changed
@@ -235,6 +356,20 @@ class SceneComponent(traitlets.HasTraits):
             self.iso_layers.append(0.0)
             self.iso_layers_alpha.append(1.0)
 
+    def _scaled_framebuffer(self, render_scale):
+        # frames rendered at a fraction of the full resolution go into
+        # framebuffers of their own for each fraction, so that switching
+        # between them does not reallocate the full resolution one
+        if render_scale >= 1.0:
+            return self.fb
+        if render_scale not in self._scaled_fbs:
+            self._scaled_fbs[render_scale] = Framebuffer()
+        return self._scaled_fbs[render_scale]
+
+    @traitlets.observe("fb")
+    def _reset_scaled_framebuffers(self, change):
+        self._scaled_fbs = {}
+
     @traitlets.default("fb")
     def _fb_default(self):
         return Framebuffer()
@@ -285,6 +420,8 @@ class SceneComponent(traitlets.HasTraits):
     def _default_colormap(self):
         cm = ColormapTexture()
         cm.colormap_name = "arbre"
+        # defaults do not notify _observe_colormap
+        cm.observe(self._invalidate_composite)
         return cm
 
     @traitlets.default("vertex_shader")
@@ -316,6 +453,10 @@ class SceneComponent(traitlets.HasTraits):
     def _final_pass_fragment_default(self):
         return "display_border"
 
+    @traitlets.default("_cmap_reduction")
+    def _default_cmap_reduction(self):
+        return MinMaxReduction()
+
     @traitlets.default("base_quad")
     def _default_base_quad(self):
         bq = SceneData(
@@ -367,17 +508,34 @@ class SceneComponent(traitlets.HasTraits):
             )
         return self._final_pass
 
+    def _uniform_buffer(self, name, size):
+        # A float32 array of size values kept for the uniform name, which is
+        # filled in place rather than allocated every frame.
+        if self._uniform_buffers is None:
+            self._uniform_buffers = {}
+        if name not in self._uniform_buffers:
+            self._uniform_buffers[name] = np.zeros(size, dtype="float32")
+        return self._uniform_buffers[name]
+
     def _set_iso_uniforms(self, p):
         # these could be handled better by watching traits.
         p._set_uniform("iso_num_layers", int(len(self.iso_layers)))
         isolayervals = self._get_sanitized_iso_layers()
         p._set_uniform("iso_layers", isolayervals)
         p._set_uniform("iso_layer_tol", self._get_sanitized_iso_tol())
-        avals = np.zeros((32,), dtype="float32")
-        avals[: len(self.iso_layers)] = np.array(self.iso_layers_alpha)
+        avals = self._uniform_buffer("iso_alphas", 32)
+        avals[:] = 0.0
+        avals[: len(self.iso_layers)] = self.iso_layers_alpha
         p._set_uniform("iso_alphas", avals)
-        p._set_uniform("iso_min", float(self.data.min_val))
-        p._set_uniform("iso_max", float(self.data.max_val))
+        iso_min, iso_max = self._iso_range
+        p._set_uniform("iso_min", iso_min)
+        p._set_uniform("iso_max", iso_max)
+
+    @property
+    def _iso_range(self):
+        # the (min, max) of the data drawn, that the data and isocontours are
+        # normalized by
+        return float(self.data.min_val), float(self.data.max_val)
 
     def run_program(self, scene):
         # Store this info, because we need to render into a framebuffer that is the
@@ -387,23 +545,37 @@ class SceneComponent(traitlets.HasTraits):
         else:
             draw_boundary = 0.0
         x0, y0, w, h = GL.glGetIntegerv(GL.GL_VIEWPORT)
-        GL.glViewport(0, 0, w, h)
+        render_scale = scene.render_scale
+        GL.glViewport(*self._first_pass_viewport(w, h, render_scale))
         if not self.visible:
+            self._composite_dirty = False
             return
-        with self.fb.bind(True):
-            with self.program1.enable() as p:
-                scene.camera._set_uniforms(scene, p)
-                self._set_uniforms(scene, p)
-                if self.render_method == "isocontours":
-                    self._set_iso_uniforms(p)
-                with self.data.vertex_array.bind(p):
-                    self.draw(scene, p)
+        fb = self._scaled_framebuffer(render_scale)
+        key = self._first_pass_key_for(scene, w, h)
+        if self._first_pass_dirty or key != self._first_pass_key:
+            with fb.bind(True):
+                with self.program1.enable() as p:
+                    scene.camera._set_uniforms(scene, p)
+                    self._set_uniforms(scene, p)
+                    if self.render_method == "isocontours":
+                        self._set_iso_uniforms(p)
+                    with self.data.vertex_array.bind(p):
+                        self.draw(scene, p)
+            self._first_pass_key = key
+            self._first_pass_dirty = False
 
         if self._cmap_bounds_invalid:
-            self._reset_cmap_bounds()
+            # only report the bounds once all of the data is in, at full
+            # resolution
+            full = fb is self.fb
+            self._reset_cmap_bounds(
+                print_new_bounds=full and not self.data.has_pending_uploads, fb=fb
+            )
+            # and recompute them from the first full resolution frame
+            self._cmap_bounds_invalid = not full
 
         with self.colormap.bind(0):
-            with self.fb.input_bind(1, 2):
+            with fb.input_bind(1, 2):
                 with self.program2.enable() as p2:
                     with scene.bind_buffer():
                         p2._set_uniform("cmap", 0)
@@ -431,6 +603,7 @@ class SceneComponent(traitlets.HasTraits):
                 with self.base_quad.vertex_array.bind(p3):
                     GL.glViewport(x0, y0, w, h)
                     GL.glDrawArrays(GL.GL_TRIANGLES, 0, 6)
+        self._composite_dirty = False
 
     def draw(self, scene, program):
         raise NotImplementedError
@@ -443,9 +616,11 @@ class SceneComponent(traitlets.HasTraits):
             iso_vals = 10**iso_vals
 
         if normalize:
-            iso_vals = self.data._normalize_by_min_max(iso_vals)
+            iso_min, iso_max = self._iso_range
+            iso_vals = np.clip((iso_vals - iso_min) / (iso_max - iso_min), 0.0, 1.0)
 
-        full_array = np.zeros(32, dtype="float32")
+        full_array = self._uniform_buffer(f"iso_layers_{normalize}", 32)
+        full_array[:] = 0.0
         full_array[: len(self.iso_layers)] = iso_vals
         return full_array
 
@@ -483,7 +658,8 @@ class SceneComponent(traitlets.HasTraits):
         else:
             tol = float(self.iso_tolerance)
         # always normalize tolerance
-        tol = tol / self.data.val_range
+        iso_min, iso_max = self._iso_range
+        tol = tol / (iso_max - iso_min)
 
         if self.iso_tol_is_pct:
             # tolerance depends on the layer value
@@ -491,7 +667,8 @@ class SceneComponent(traitlets.HasTraits):
             raw_layers = self._get_sanitized_iso_layers(normalize=False)
             final_tol = raw_layers * tol
         else:
-            final_tol = np.full((32,), tol, dtype="float32")
+            final_tol = self._uniform_buffer("iso_layer_tol", 32)
+            final_tol[:] = tol
         return final_tol
 
     def _recompile_shader(self) -> bool:
@@ -512,6 +689,7 @@ class SceneComponent(traitlets.HasTraits):
         self._program1_invalid = self._program2_invalid = self._final_pass_invalid = (
             True
         )
+        self._invalidate_first_pass()
         return True
 
     def _render_isolayer_inputs(self, imgui) -> bool:
@@ -585,17 +763,17 @@ class SceneComponent(traitlets.HasTraits):
 
         return changed
 
-    def _reset_cmap_bounds(self, print_new_bounds=True):
-
-        data = self.fb.data
-        if self.use_db:
-            data[:, :, :3] = self.fb.depth_data[:, :, None]
-        data = data[data[:, :, 3] > 0][:, 0]
-        if data.size > 0:
-            self.cmap_min = data.min()
-            self.cmap_max = data.max()
+    def _reset_cmap_bounds(self, print_new_bounds=True, fb=None):
+        fb = self.fb if fb is None else fb
+        # reduced on the GPU, so only the bounds are read back
+        vmin, vmax, n_covered = self._cmap_reduction.reduce(
+            fb, self.base_quad.vertex_array, depth=self.use_db
+        )
+        if n_covered > 0:
+            self.cmap_min = vmin
+            self.cmap_max = vmax
 
-        if data.size == 0:
+        if n_covered == 0:
             self.cmap_min = 0.0
             self.cmap_max = 1.0
 
@@ -6,10 +6,14 @@ from OpenGL import GL
 
 from yt_idv.gui_support import add_popup_help
 from yt_idv.opengl_support import TransferFunctionTexture
-from yt_idv.scene_components.base_component import SceneComponent
+from yt_idv.scene_components.base_component import _DS_TEX_UNITS, SceneComponent
 from yt_idv.scene_data.block_collection import BlockCollection
 from yt_idv.shader_objects import component_shaders, get_shader_combos
 
+_FLOAT32_MAX = float(np.finfo(np.float32).max)
+_TRANSFER_FUNCTION_METHODS = ("transfer_function", "transfer_function_front_to_back")
+_RAY_METHODS = ("max_intensity", "projection") + _TRANSFER_FUNCTION_METHODS
+
 
 class BlockRendering(SceneComponent):
     """
@@ -29,6 +33,29 @@ class BlockRendering(SceneComponent):
     tf_log = traitlets.Bool(True)
     slice_position = traitlets.Tuple((0.5, 0.5, 0.5)).tag(trait=traitlets.CFloat())
     slice_normal = traitlets.Tuple((1.0, 0.0, 0.0)).tag(trait=traitlets.CFloat())
+    # which of the data's fields is drawn, for multi-field block collections
+    field_index = traitlets.CInt(0)
+    # Blocks whose values all lie outside of what the render method can show,
+    # such as outside the visible part of the transfer function, are skipped
+    # when drawing and discarded by the geometry shader. Values below
+    # skip_threshold, if set, are treated as empty by the ray-casting methods.
+    skip_empty_blocks = traitlets.Bool(True)
+    skip_threshold = traitlets.CFloat(None, allow_none=True)
+    # With the transfer_function_front_to_back render method, blocks are drawn
+    # and rays are composited front to back, and rays stop once their alpha
+    # reaches early_termination_alpha; None marches every ray to the end.
+    early_termination_alpha = traitlets.CFloat(0.99, allow_none=True)
+    # The finest AMR level drawn, below the finest of the data only for block
+    # collections with lod set; None draws every level. With lod_distance set,
+    # one more level is left out every time the distance from the camera to
+    # its focus grows by the dataset's refine_by beyond lod_distance.
+    max_level = traitlets.CInt(None, allow_none=True)
+    lod_distance = traitlets.CFloat(None, allow_none=True)
+    # With the block collection's mipmap_levels set, rays sample each block
+    # from the level of its pyramid matching its projected size on screen;
+    # mipmap_bias shifts that choice by a number of levels, positive values
+    # sampling coarser.
+    mipmap_bias = traitlets.CFloat(0.0)
 
     priority = 10
 
@@ -43,6 +70,29 @@ class BlockRendering(SceneComponent):
         )
         if _:
             self.sample_factor = sample_factor
+        if self.data.lod:
+            coarsest, finest = self.data.level_range
+            level = finest if self.max_level is None else self.max_level
+            _, level = imgui.slider_int("Max Level", level, coarsest, finest)
+            if _:
+                self.max_level = level
+            changed = changed or _
+        if self.data._use_mipmaps:
+            _, self.mipmap_bias = imgui.slider_float(
+                "Mipmap Bias", self.mipmap_bias, -2.0, 4.0
+            )
+            changed = changed or _
+            _ = add_popup_help(
+                imgui,
+                "Levels coarser than the size of blocks on screen to sample from.",
+            )
+            changed = changed or _
+        fields = self.data.fields
+        if len(fields) > 1:
+            _, self.field_index = imgui.listbox(
+                "Field", self.field_index, [str(field) for field in fields]
+            )
+            changed = changed or _
         # Now, shaders
         valid_shaders = get_shader_combos(
             self.name, coord_system=self.data._yt_geom_str
@@ -87,7 +137,7 @@ class BlockRendering(SceneComponent):
                 scene.data_objects.append(cc)
                 scene.components.append(cc_render)
 
-        if self.render_method == "transfer_function":
+        if self.render_method in _TRANSFER_FUNCTION_METHODS:
             # Now for the transfer function stuff
             imgui.image_button(
                 self.transfer_function.texture_name, 256, 32, frame_padding=0
@@ -148,20 +198,149 @@ class BlockRendering(SceneComponent):
 
         return changed
 
+    @traitlets.validate("field_index")
+    def _validate_field_index(self, proposal):
+        # only checked once the data has been populated
+        n_fields = len(self.data.fields) if self.data is not None else 0
+        if n_fields and not 0 <= proposal["value"] < n_fields:
+            raise traitlets.TraitError(
+                f"field_index must be in [0, {n_fields}), got {proposal['value']}."
+            )
+        return proposal["value"]
+
+    @traitlets.observe("field_index")
+    def _switch_field(self, change):
+        self._cmap_bounds_invalid = True
+
+    @property
+    def _iso_range(self):
+        # each field is normalized by its own range
+        data = self.data
+        return (
+            float(data.field_min_vals[self.field_index]),
+            float(data.field_max_vals[self.field_index]),
+        )
+
+    @traitlets.observe("transfer_function")
+    def _observe_transfer_function(self, change):
+        old, new = change["old"], change["new"]
+        if isinstance(old, traitlets.HasTraits):
+            old.unobserve(self._invalidate_first_pass, names="data")
+        if isinstance(new, traitlets.HasTraits):
+            new.observe(self._invalidate_first_pass, names="data")
+
+    def _first_pass_state(self, scene):
+        # the finest level drawn also follows the quality controller
+        return super()._first_pass_state(scene) + (self._max_level(scene),)
+
     @traitlets.default("transfer_function")
     def _default_transfer_function(self):
         tf = TransferFunctionTexture(data=np.ones((256, 1, 4), dtype="u1") * 255)
+        # defaults do not notify _observe_transfer_function
+        tf.observe(self._invalidate_first_pass, names="data")
         return tf
 
+    @property
+    def _front_to_back(self):
+        return self.render_method == "transfer_function_front_to_back"
+
+    def _visible_range(self):
+        # The range of sampled values that can show up in the image, or None
+        # if there is no empty space to skip.
+        if not self.skip_empty_blocks:
+            return None
+        low, high = -np.inf, np.inf
+        if self.render_method in _TRANSFER_FUNCTION_METHODS:
+            low, high = self._transfer_function_range()
+        if self.skip_threshold is not None and self.render_method in _RAY_METHODS:
+            low = max(low, self.skip_threshold)
+        if low == -np.inf and high == np.inf:
+            return None
+        return low, high
+
+    def _transfer_function_range(self):
+        # Samples outside of (tf_min, tf_max) are discarded by the shader, as
+        # are those mapping to the entries of the transfer function that are
+        # all zero, which add nothing to the image.
+        tm, tp = self.tf_min, self.tf_max
+        if self.tf_log and tm <= 0.0:
+            return tm, tp
+        rgba = self.transfer_function.data[:, 0, :]
+        used = np.flatnonzero(rgba.any(axis=-1))
+        if used.size == 0:
+            return np.inf, -np.inf
+        # with linear filtering, an entry reaches half an entry beyond its
+        # center, so widen by a full entry on either side
+        n = rgba.shape[0]
+        lo_frac = max(used[0] - 1, 0) / n
+        hi_frac = min(used[-1] + 2, n) / n
+        if self.tf_log:
+            tm, tp = np.log(tm), np.log(tp)
+            return tuple(np.exp(tm + f * (tp - tm)) for f in (lo_frac, hi_frac))
+        return tuple(tm + f * (tp - tm) for f in (lo_frac, hi_frac))
+
+    def _nonempty_blocks(self):
+        # flags the blocks with values within the visible range, or None if
+        # every block is drawn
+        visible_range = self._visible_range()
+        if visible_range is None:
+            return None
+        low, high = visible_range
+        sample_min = self.data.block_sample_min[:, self.field_index]
+        sample_max = self.data.block_sample_max[:, self.field_index]
+        return (sample_max >= low) & (sample_min <= high)
+
+    def _max_level(self, scene):
+        # the finest level to draw this frame, or None for every level
+        if not self.data.lod:
+            return self.max_level
+        coarsest, finest = self.data.level_range
+        level = finest if self.max_level is None else min(self.max_level, finest)
+        if self.lod_distance is not None:
+            camera = scene.camera
+            distance = np.linalg.norm(camera.position - camera.focus)
+            if distance > self.lod_distance:
+                refine_by = self.data.data_source.ds.refine_by
+                level -= ceil(np.log(distance / self.lod_distance) / np.log(refine_by))
+        if scene.quality_controller is not None:
+            level -= scene.quality_controller.level_drop
+        return max(level, coarsest)
+
     def draw(self, scene, program):
         each = self.data.vertex_array.each
+        nonempty = self._nonempty_blocks()
+        front_to_back = self._front_to_back
+        max_level = self._max_level(scene)
         GL.glEnable(GL.GL_CULL_FACE)
         GL.glCullFace(GL.GL_BACK)
         with self.transfer_function.bind(target=2):
-            for tex_ind, tex, bitmap_tex in self.data.viewpoint_iter(scene.camera):
+            if self.data.use_atlas:
+                # one draw call for each run of blocks sharing an atlas page
+                batches = self.data.viewpoint_batches(
+                    scene.camera, nonempty, front_to_back, max_level
+                )
+                for tex, bitmap_tex, tex_inds in batches:
+                    with tex.bind(target=0):
+                        with bitmap_tex.bind(target=1):
+                            GL.glMultiDrawArrays(
+                                GL.GL_POINTS,
+                                (tex_inds * each).astype("i4"),
+                                np.full(tex_inds.size, each, dtype="i4"),
+                                tex_inds.size,
+                            )
+                return
+            macrocells = self.data.macrocell_objects
+            for tex_ind, tex, bitmap_tex in self.data.viewpoint_iter(
+                scene.camera, nonempty, front_to_back, max_level
+            ):
+                macrocell_tex = macrocells.get(tex_ind)
                 with tex.bind(target=0):
                     with bitmap_tex.bind(target=1):
-                        GL.glDrawArrays(GL.GL_POINTS, tex_ind * each, each)
+                        if macrocell_tex is None:
+                            GL.glDrawArrays(GL.GL_POINTS, tex_ind * each, each)
+                            continue
+                        with macrocell_tex.bind(target=3):
+                            GL.glDrawArrays(GL.GL_POINTS, tex_ind * each, each)
 
     def _set_uniforms(self, scene, shader_program):
         if self.data._yt_geom_str == "spherical":
@@ -171,15 +350,42 @@ class BlockRendering(SceneComponent):
             shader_program._set_uniform("id_phi", axis_id["phi"])
 
         shader_program._set_uniform("box_width", self.box_width)
-        shader_program._set_uniform("sample_factor", self.sample_factor)
-        shader_program._set_uniform("ds_tex", np.array([0, 0, 0, 0, 0, 0]))
+        shader_program._set_uniform(
+            "sample_factor", self.sample_factor * scene.sample_scale
+        )
+        termination_alpha = 0.0
+        if self._front_to_back and self.early_termination_alpha is not None:
+            termination_alpha = self.early_termination_alpha
+        shader_program._set_uniform("termination_alpha", termination_alpha)
+        shader_program._set_uniform("ds_tex", _DS_TEX_UNITS)
         shader_program._set_uniform("bitmap_tex", 1)
         shader_program._set_uniform("tf_tex", 2)
+        shader_program._set_uniform("macrocell_tex", 3)
+        macrocell_size = self.data.macrocell_size if self.data._use_macrocells else 0
+        shader_program._set_uniform("macrocell_size", macrocell_size)
+        mipmap_levels = self.data.mipmap_levels if self.data._use_mipmaps else 0
+        shader_program._set_uniform("mipmap_levels", mipmap_levels)
+        shader_program._set_uniform("mipmap_bias", self.mipmap_bias)
         shader_program._set_uniform("tf_min", self.tf_min)
         shader_program._set_uniform("tf_max", self.tf_max)
         shader_program._set_uniform("tf_log", float(self.tf_log))
-        shader_program._set_uniform("slice_normal", np.array(self.slice_normal))
-        shader_program._set_uniform("slice_position", np.array(self.slice_position))
+        shader_program._set_uniform("field_index", self.field_index)
+        shader_program._set_uniform(
+            "ds_log_ratio", self.data.field_log_ratios[self.field_index]
+        )
+        visible_range = self._visible_range()
+        shader_program._set_uniform("skip_empty", int(visible_range is not None))
+        if visible_range is not None:
+            # infinite bounds are clamped to the largest float32
+            low, high = np.clip(visible_range, -_FLOAT32_MAX, _FLOAT32_MAX)
+            shader_program._set_uniform("visible_min", low)
+            shader_program._set_uniform("visible_max", high)
+        slice_normal = self._uniform_buffer("slice_normal", 3)
+        slice_normal[:] = self.slice_normal
+        shader_program._set_uniform("slice_normal", slice_normal)
+        slice_position = self._uniform_buffer("slice_position", 3)
+        slice_position[:] = self.slice_position
+        shader_program._set_uniform("slice_position", slice_position)
 
     @property
     def _yt_geom_str(self):
@@ -5,7 +5,7 @@ import traitlets
 from OpenGL import GL
 
 from yt_idv.opengl_support import TransferFunctionTexture
-from yt_idv.scene_components.base_component import SceneComponent
+from yt_idv.scene_components.base_component import _DS_TEX_UNITS, SceneComponent
 from yt_idv.scene_data.octree_block_collection import OctreeBlockCollection
 from yt_idv.shader_objects import component_shaders, get_shader_combos
 
@@ -115,21 +115,42 @@ class OctreeBlockRendering(SceneComponent):
         GL.glEnable(GL.GL_CULL_FACE)
         GL.glCullFace(GL.GL_BACK)
         start = 0
+        visible = self.data._visible_blocks(scene.camera)
         with self.transfer_function.bind(target=2):
             for i, shape in enumerate(self.data.shapes[:-1]):
-                with self.data.data_textures[i].bind(target=0):
-                    with self.data.bitmap_textures[i].bind(target=1):
-                        GL.glDrawArraysInstancedBaseInstance(
-                            GL.GL_TRIANGLE_STRIP, 0, each, shape, start
-                        )
-                        start += shape
+                if visible is None:
+                    runs = [(0, shape)]
+                else:
+                    runs = _visible_runs(visible[start : start + shape])
+                if runs:
+                    with self.data.data_textures[i].bind(target=0):
+                        with self.data.bitmap_textures[i].bind(target=1):
+                            for offset, count in runs:
+                                # instances are offset into the texture by
+                                # instance_offset + gl_InstanceID
+                                program._set_uniform("instance_offset", offset)
+                                GL.glDrawArraysInstancedBaseInstance(
+                                    GL.GL_TRIANGLE_STRIP, 0, each, count, start + offset
+                                )
+                start += shape
 
     def _set_uniforms(self, scene, shader_program):
         shader_program._set_uniform("box_width", self.box_width)
-        shader_program._set_uniform("sample_factor", self.sample_factor)
-        shader_program._set_uniform("ds_tex", np.array([0, 0, 0, 0, 0, 0]))
+        shader_program._set_uniform(
+            "sample_factor", self.sample_factor * scene.sample_scale
+        )
+        shader_program._set_uniform("ds_tex", _DS_TEX_UNITS)
         shader_program._set_uniform("bitmap_tex", 1)
         shader_program._set_uniform("tf_tex", 2)
         shader_program._set_uniform("tf_min", self.tf_min)
         shader_program._set_uniform("tf_max", self.tf_max)
         shader_program._set_uniform("tf_log", float(self.tf_log))
+        shader_program._set_uniform("ds_log_ratio", self.data.data_log_ratio)
+
+
+def _visible_runs(visible):
+    # (start, length) of each run of consecutive visible instances
+    edges = np.diff(np.concatenate([[False], visible, [False]]).astype("i1"))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    return list(zip(starts.tolist(), (stops - starts).tolist()))
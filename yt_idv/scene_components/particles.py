@@ -1,6 +1,5 @@
 import math
 
-import numpy as np
 import traitlets
 from OpenGL import GL
 
@@ -42,6 +41,4 @@ class ParticleRendering(SceneComponent):
         shader_program._set_uniform("projection", cam.projection_matrix)
         shader_program._set_uniform("modelview", cam.view_matrix)
         shader_program._set_uniform("max_particle_size", self.max_particle_size)
-        shader_program._set_uniform(
-            "inv_pmvm", np.linalg.inv(cam.projection_matrix @ cam.view_matrix)
-        )
+        shader_program._set_uniform("inv_pmvm", cam.inverse_pmvm)
@@ -1,6 +1,13 @@
+import time
+
 import traitlets
 
-from yt_idv.opengl_support import Texture, VertexArray
+from yt_idv.opengl_support import (
+    STORAGE_FORMATS,
+    Texture,
+    VertexArray,
+    encode_normalized_data,
+)
 
 
 class SceneData(traitlets.HasTraits):
@@ -19,6 +26,19 @@ class SceneData(traitlets.HasTraits):
 
     min_val = traitlets.CFloat(0.0)
     max_val = traitlets.CFloat(1.0)
+    # the format normalized data textures are stored in on the GPU, see
+    # opengl_support.STORAGE_FORMATS. unorm8 data is log-scaled when possible.
+    storage_format = traitlets.Enum(list(STORAGE_FORMATS), default_value="float32")
+    # whether blocks outside of the camera's view frustum are skipped when
+    # drawing, for data with per-block bounding boxes (_cull_boxes).
+    # cull_stats holds the number of visible and culled blocks, and the time
+    # spent culling them, for the most recent draw.
+    frustum_culling = traitlets.Bool(True)
+    cull_stats = traitlets.Dict()
+    _cull_boxes = None
+    # traits updated while drawing that do not change what is drawn, see
+    # SceneComponent._first_pass_dirty
+    _drawing_stats = ("cull_stats",)
 
     def _normalize_by_min_max(self, data):
         # linear normalization of data across full data range
@@ -28,6 +48,48 @@ class SceneData(traitlets.HasTraits):
         n_data[n_data > 1] = 1.0
         return n_data
 
+    @property
+    def has_pending_uploads(self):
+        # whether some of this data has yet to be uploaded to the GPU
+        return False
+
+    def upload_pending(self, camera):
+        # upload some of the data that has yet to be uploaded, called once
+        # per frame before rendering
+        pass
+
+    def _visible_blocks(self, camera):
+        # a mask of the blocks in view of camera, or None if every block is
+        # to be drawn
+        if not self.frustum_culling or self._cull_boxes is None:
+            return None
+        t0 = time.perf_counter()
+        visible = camera.boxes_in_frustum(*self._cull_boxes)
+        n_visible = int(visible.sum())
+        self.cull_stats = {
+            "blocks": visible.size,
+            "visible": n_visible,
+            "culled": visible.size - n_visible,
+            "cull_ms": (time.perf_counter() - t0) * 1000.0,
+        }
+        return visible
+
+    @property
+    def data_log_ratio(self):
+        # unorm8 textures are stored log-scaled between min_val and max_val,
+        # which needs a positive range; 0.0 means linear storage.
+        if self.storage_format != "unorm8" or self.min_val <= 0.0:
+            return 0.0
+        if self.max_val <= self.min_val:
+            return 0.0
+        return self.max_val / self.min_val
+
+    def _encode_data(self, n_data):
+        # convert normalized data to the storage format
+        return encode_normalized_data(
+            n_data, self.storage_format, log_ratio=self.data_log_ratio
+        )
+
     @property
     def val_range(self):
         # the data range (max - min) across all data.
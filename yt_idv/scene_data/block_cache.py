@@ -0,0 +1,162 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import traitlets
+
+
+def _default_cache_directory():
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join("~", ".cache"))
+    return os.path.join(os.path.expanduser(base), "yt_idv", "blocks")
+
+
+class BlockCache(traitlets.HasTraits):
+    """
+    An on-disk cache of the processed blocks of a :class:`BlockCollection`.
+
+    Each entry holds the vertex-centered data, bitmaps, edges and value
+    ranges of every block in a collection, keyed by the dataset, field,
+    data source and ghost zone setting that produced them. Block data are
+    memory-mapped when an entry is loaded, so reopening a collection only
+    reads what is uploaded to the GPU.
+
+    Entries are evicted, least recently used first, once the cache holds
+    more than ``max_bytes``.
+
+    Parameters
+    ----------
+    directory : str
+        The directory holding the cache entries. Defaults to
+        ``$XDG_CACHE_HOME/yt_idv/blocks``.
+    max_bytes : int
+        The maximum size of the cache on disk, 4GB by default.
+
+    Examples
+    --------
+
+    >>> cache = BlockCache(directory="/scratch/yt_idv_cache")
+    >>> sg.add_volume(ds.all_data(), "density", no_ghost=False, cache=cache)
+    """
+
+    directory = traitlets.Unicode()
+    max_bytes = traitlets.CInt(4 * 1024**3)
+
+    # the per-block arrays stored alongside the block data in every entry
+    index_arrays = (
+        "node_ids",
+        "left_edges",
+        "right_edges",
+        "grids_by_block",
+        "block_slices",
+        "block_dims",
+        "block_levels",
+        "block_min_vals",
+        "block_max_vals",
+    )
+
+    @traitlets.default("directory")
+    def _default_directory(self):
+        return _default_cache_directory()
+
+    def key(self, data_source, field, no_ghost):
+        """The key of the entry for ``field``, or a list of fields, of
+        ``data_source``."""
+        fields = field if isinstance(field, list) else [field]
+        fields = data_source._determine_fields(fields)
+        ident = f"{data_source.ds._hash()};{data_source!r};{fields};{no_ghost}"
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+    def load(self, key):
+        """
+        Return the entry stored under ``key``, or None if there is none.
+
+        The entry is a dict of the per-block index arrays along with lists of
+        read-only, memory-mapped ``data`` and ``masks`` for each block.
+        """
+        path = os.path.join(self.directory, key)
+        try:
+            with np.load(os.path.join(path, "index.npz")) as index:
+                entry = {name: index[name] for name in index.files}
+            data = np.load(os.path.join(path, "data.npy"), mmap_mode="r")
+            masks = np.load(os.path.join(path, "masks.npy"), mmap_mode="r")
+        except OSError:
+            return None
+        # mark as recently used for eviction
+        os.utime(path)
+        entry["data"] = _split_blocks(data, entry.pop("data_shapes"))
+        entry["masks"] = _split_blocks(masks, entry.pop("mask_shapes"))
+        return entry
+
+    def store(self, key, data, masks, **index):
+        """
+        Store the per-block ``data`` and ``masks`` arrays along with the
+        per-block index arrays under ``key``, then evict old entries.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key)
+        # write to a temporary directory first, so that concurrent readers
+        # never see a partial entry
+        tmp_path = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            _write_blocks(os.path.join(tmp_path, "data.npy"), data)
+            _write_blocks(os.path.join(tmp_path, "masks.npy"), masks)
+            np.savez(
+                os.path.join(tmp_path, "index.npz"),
+                data_shapes=np.array([d.shape for d in data], dtype="i8"),
+                mask_shapes=np.array([m.shape for m in masks], dtype="i8"),
+                **{name: index[name] for name in self.index_arrays},
+            )
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.rename(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries, other than ``keep``, until
+        the cache fits within ``max_bytes``."""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(path))
+            entries.append((os.stat(path).st_mtime, size, name, path))
+        total = sum(size for _, size, _, _ in entries)
+        for _, size, name, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove every entry in the cache."""
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+
+
+def _write_blocks(filename, blocks):
+    # concatenates the flattened blocks into a single .npy file, block by
+    # block, without holding the concatenation in memory
+    size = sum(block.size for block in blocks)
+    dtype = np.result_type(*blocks) if blocks else np.float64
+    out = np.lib.format.open_memmap(filename, mode="w+", dtype=dtype, shape=(size,))
+    start = 0
+    for block in blocks:
+        out[start : start + block.size] = block.ravel()
+        start += block.size
+    out.flush()
+    del out
+
+
+def _split_blocks(flat, shapes):
+    # views of each block into a flat array of concatenated blocks
+    ends = np.cumsum(np.prod(shapes, axis=1))
+    starts = ends - np.prod(shapes, axis=1)
+    return [flat[s:e].reshape(shape) for s, e, shape in zip(starts, ends, shapes)]
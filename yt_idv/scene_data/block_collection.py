@@ -1,11 +1,28 @@
-from collections import defaultdict
+import itertools
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import traitlets
+import traittypes
+from OpenGL import GL
 from yt.data_objects.data_containers import YTDataContainer
 
-from yt_idv.opengl_support import Texture3D, VertexArray, VertexAttribute
+from yt_idv.opengl_support import (
+    STORAGE_FORMATS,
+    Texture3D,
+    VertexArray,
+    VertexAttribute,
+    decode_normalized_data,
+    empty_texture_data,
+    encode_normalized_data,
+)
 from yt_idv.scene_data.base_data import SceneData
+from yt_idv.scene_data.block_cache import BlockCache
+from yt_idv.scene_data.brick_hierarchy import BrickHierarchy
+from yt_idv.utilities.block_utilities import abs_nan_range
 
 
 class BlockCollection(SceneData):
@@ -13,13 +30,92 @@ class BlockCollection(SceneData):
     data_source = traitlets.Instance(YTDataContainer)
     texture_objects = traitlets.Dict(value_trait=traitlets.Instance(Texture3D))
     bitmap_objects = traitlets.Dict(value_trait=traitlets.Instance(Texture3D))
-    blocks = traitlets.Dict(default_value=())
+    # Each block is also split into macro-cells of macrocell_size cells along
+    # each axis, and the range of values that can be sampled within each
+    # macro-cell is stored in a small texture, so that rays can leap over
+    # macro-cells with nothing to show. 0 turns this off; macro-cells are not
+    # used in atlas mode.
+    macrocell_size = traitlets.CInt(8)
+    macrocell_objects = traitlets.Dict(value_trait=traitlets.Instance(Texture3D))
+    # The number of downsampled levels of each block uploaded below its full
+    # resolution data, each a box-filtered copy of the level above with half
+    # as many vertices along each axis, so that blocks covering few pixels
+    # on screen can be sampled coarsely. Blocks get as many levels as their
+    # size allows, up to mipmap_levels; 0 turns this off. Pyramids are not
+    # used in atlas mode.
+    mipmap_levels = traitlets.CInt(0)
     scale = traitlets.Bool(False)
-    blocks_by_grid = traitlets.Instance(defaultdict, (list,))
-    grids_by_block = traitlets.Dict(default_value=())
+    # Per-block arrays, indexed by the position of the block in the vertex
+    # array: the 0-indexed id of the grid each block came from, the slices of
+    # the block into that grid as (start, stop) pairs, the cell dimensions,
+    # refinement level and the range of absolute values of each field of
+    # each block, as (n_blocks, n_fields) arrays.
+    # blocks_by_grid holds the block indices sorted by grid id, and
+    # block_unmasked flags the blocks whose mask is all ones: these share a
+    # single bitmap texture, and the shaders skip their bitmap lookups.
+    grids_by_block = traittypes.Array(None, allow_none=True)
+    blocks_by_grid = traittypes.Array(None, allow_none=True)
+    block_slices = traittypes.Array(None, allow_none=True)
+    block_dims = traittypes.Array(None, allow_none=True)
+    block_levels = traittypes.Array(None, allow_none=True)
+    block_min_vals = traittypes.Array(None, allow_none=True)
+    block_max_vals = traittypes.Array(None, allow_none=True)
+    block_unmasked = traittypes.Array(None, allow_none=True)
+    # the range of each field across all blocks, which each field is
+    # normalized by; min_val and max_val hold the range of the first field
+    field_min_vals = traittypes.Array(None, allow_none=True)
+    field_max_vals = traittypes.Array(None, allow_none=True)
+    # the range of values the shaders can sample from each field of each
+    # block, after normalization and storage, as (n_blocks, n_fields) arrays.
+    # Blocks whose range lies outside of what a renderer displays are empty
+    # space that can be skipped.
+    block_sample_min = traittypes.Array(None, allow_none=True)
+    block_sample_max = traittypes.Array(None, allow_none=True)
     _yt_geom_str = traitlets.Unicode("cartesian")
     compute_min_max = traitlets.Bool(True)
     always_normalize = traitlets.Bool(False)
+    # number of worker threads used to prepare block data on the host; None
+    # uses all available cores, 1 prepares every block on the calling thread.
+    n_workers = traitlets.CInt(None, allow_none=True)
+    # In atlas mode, blocks and their bitmaps are packed into a few large
+    # textures (pages) of atlas_width x atlas_width texels in x and y, so that
+    # the whole collection can be drawn with a handful of calls.
+    use_atlas = traitlets.Bool(False)
+    atlas_width = traitlets.CInt(256)
+    atlas_textures = traitlets.List(trait=traitlets.Instance(Texture3D))
+    atlas_bitmaps = traitlets.List(trait=traitlets.Instance(Texture3D))
+    block_atlas_pages = traittypes.Array(None, allow_none=True)
+    block_atlas_offsets = traittypes.Array(None, allow_none=True)
+    # an optional on-disk cache of the processed blocks
+    cache = traitlets.Instance(BlockCache, allow_none=True)
+    # In progressive mode textures are uploaded over several frames, coarse
+    # levels first and, within a level, nearest to the camera first. Each
+    # frame uploads at most upload_budget_mb megabytes or spends at most
+    # upload_budget_ms milliseconds uploading, and only the blocks flagged in
+    # block_resident are drawn.
+    progressive = traitlets.Bool(False)
+    upload_budget_mb = traitlets.CFloat(64.0)
+    upload_budget_ms = traitlets.CFloat(10.0)
+    block_resident = traittypes.Array(None, allow_none=True)
+    # The budget, in megabytes, for the per-block textures kept on the GPU.
+    # Once it is reached, the blocks drawn least recently are evicted to make
+    # room for the blocks waiting to be uploaded, and re-uploaded from their
+    # host (or disk cache) copies when they are needed again. Blocks drawn in
+    # the most recent traversal are never evicted. This does not apply to
+    # atlas pages, which are allocated up front. resident_bytes is the size
+    # of the textures currently on the GPU.
+    gpu_budget_mb = traitlets.CFloat(None, allow_none=True)
+    resident_bytes = traitlets.CInt(0)
+    # the field the blocks were last populated from, see add_data and
+    # set_field
+    field = traitlets.Any(None, allow_none=True)
+    # With lod set, every level but the finest gets blocks of its own that
+    # stand in for the largest subtrees of the kd-tree holding only finer
+    # blocks, with data restricted from those blocks like the parents of AMR
+    # cells. They are uploaded along with the other blocks, so that the
+    # finest level drawn, the max_level of viewpoint_iter, can change from
+    # frame to frame without any uploads.
+    lod = traitlets.Bool(False)
 
     @traitlets.default("vertex_array")
     def _default_vertex_array(self):
@@ -35,63 +131,67 @@ class BlockCollection(SceneData):
         ----------
         data_source : YTRegion
             A YTRegion object to use as a data source.
-        field : string
-            A field to populate from.
+        field : string or list of strings
+            A field to populate from, or a list of up to four fields. Several
+            fields are packed into the channels of each block's texture, and
+            the field that is drawn is picked by a component's
+            ``field_index``.
         no_ghost : bool (False)
             Should we speed things up by skipping ghost zone generation?
+
+        If the collection has a ``cache``, blocks are read from it when
+        available and stored in it otherwise. To switch an existing
+        collection to another field, use `set_field` instead.
         """
-        self.data_source.tiles.set_fields([field], [False], no_ghost=no_ghost)
+        fields = _field_list(field)
+        tiles = self.data_source.tiles
 
         self._yt_geom_str = str(self.data_source.ds.geometry)
         # note: casting to string for compatibility with new and old geometry
         # attributes (now an enum member in latest yt),
         # see https://github.com/yt-project/yt/pull/4244
 
+        cache_key = entry = None
+        if self.cache is not None:
+            cache_key = self.cache.key(self.data_source, field, no_ghost)
+            entry = self.cache.load(cache_key)
+
         # Every time we change our data source, we wipe all existing ones.
         # We now set up our vertices into our current data source.
-        vert, dx, le, re = [], [], [], []
+        if entry is None:
+            tiles.set_fields(fields, [False] * len(fields), no_ghost=no_ghost)
+            le, re = self._build_block_index(tiles)
+            self._node_edges = (le.copy(), re.copy())
+            if self.cache is not None:
+                self._store_blocks(cache_key, *self._block_data)
+        else:
+            le, re = self._restore_block_index(entry)
+            self._node_edges = (le.copy(), re.copy())
+        self._no_ghost = no_ghost
+        self._hierarchy = BrickHierarchy.from_kd_tree(
+            tiles.tree.trunk, self._node_blocks
+        )
+        masks = self._block_data[1]
+        self.block_unmasked = np.fromiter(
+            (mask.all() for mask in masks), dtype="bool", count=len(masks)
+        )
+        self._n_leaf_blocks = len(masks)
+        self._lod_hierarchies = None
+        if self.lod:
+            le, re = self._add_lod_blocks(le, re)
 
-        min_val = +np.inf
-        max_val = -np.inf
         if self.scale and self._yt_geom_str == "cartesian":
-            left_min = np.ones(3, "f8") * np.inf
-            right_max = np.ones(3, "f8") * -np.inf
-            for block in self.data_source.tiles.traverse():
-                np.minimum(left_min, block.LeftEdge, left_min)
-                np.maximum(right_max, block.LeftEdge, right_max)
+            left_min = le.min(axis=0)
+            right_max = le.max(axis=0)
             scale = right_max.max() - left_min.min()
-            for block in self.data_source.tiles.traverse():
-                block.LeftEdge -= left_min
-                block.LeftEdge /= scale
-                block.RightEdge -= left_min
-                block.RightEdge /= scale
-        for i, block in enumerate(self.data_source.tiles.traverse()):
-            min_val = min(min_val, np.nanmin(np.abs(block.my_data[0])).min())
-            max_val = max(max_val, np.nanmax(np.abs(block.my_data[0])).max())
-            self.blocks[id(block)] = (i, block)
-            vert.append([1.0, 1.0, 1.0, 1.0])
-            dds = (block.RightEdge - block.LeftEdge) / block.source_mask.shape
-            dx.append(dds.tolist())
-            le.append(block.LeftEdge.tolist())
-            re.append(block.RightEdge.tolist())
-        for g, node, (sl, _, gi) in self.data_source.tiles.slice_traverse():
-            block = node.data
-            self.blocks_by_grid[g.id - g._id_offset].append((id(block), gi))
-            self.grids_by_block[id(node.data)] = (g.id - g._id_offset, sl)
+            le = (le - left_min) / scale
+            re = (re - left_min) / scale
 
-        if self.compute_min_max:
-            if hasattr(min_val, "in_units"):
-                min_val = min_val.d
-            if hasattr(max_val, "in_units"):
-                max_val = max_val.d
-            self.min_val = min_val
-            self.max_val = max_val
+        self._set_field_ranges()
 
         # Now we set up our buffer
-        vert = np.array(vert, dtype="f4")
-        dx = np.array(dx, dtype="f4")
-        le = np.array(le)
-        re = np.array(re)
+        vert = np.ones((le.shape[0], 4), dtype="f4")
+        dx = ((re - le) / self.block_dims).astype("f4")
         if self._yt_geom_str == "cartesian":
             # Note: the block LeftEdge and RightEdge arrays are plain np arrays in
             # units of code_length, so need to convert to unitary units (in range 0,1)
@@ -101,8 +201,8 @@ class BlockCollection(SceneData):
             dx = dx * ratio
             le = le * ratio
             re = re * ratio
-            LE = np.array([b.LeftEdge for i, b in self.blocks.values()]).min(axis=0)
-            RE = np.array([b.RightEdge for i, b in self.blocks.values()]).max(axis=0)
+            LE = le.min(axis=0) / ratio
+            RE = re.max(axis=0) / ratio
             self.diagonal = np.sqrt(((RE - LE) ** 2).sum())
         elif self._yt_geom_str == "spherical":
             rad_index = self.data_source.ds.coordinates.axis_id["r"]
@@ -111,6 +211,9 @@ class BlockCollection(SceneData):
             re[:, rad_index] = re[:, rad_index] / max_r
             dx[:, rad_index] = dx[:, rad_index] / max_r
 
+        self._block_centers = (le + re) / 2.0
+        if self._yt_geom_str == "cartesian":
+            self._cull_boxes = (le, re)
         self._set_geometry_attributes(le, re, dx)
         self.vertex_array.attributes.append(
             VertexAttribute(name="model_vertex", data=vert)
@@ -123,8 +226,348 @@ class BlockCollection(SceneData):
             VertexAttribute(name="in_right_edge", data=re.astype("f4"))
         )
 
+        # the position of each block's data within its texture
+        tex_dims = self.block_dims + 1
+        if self.use_atlas:
+            max_depth = GL.glGetInteger(GL.GL_MAX_3D_TEXTURE_SIZE)
+            pages, offsets, self._atlas_shapes = _pack_blocks(
+                tex_dims, self.atlas_width, max_depth
+            )
+            self.block_atlas_pages = pages
+            self.block_atlas_offsets = offsets
+        else:
+            offsets = np.zeros_like(tex_dims)
+        self.vertex_array.attributes.append(
+            VertexAttribute(name="in_texture_offset", data=offsets.astype("f4"))
+        )
+        self.vertex_array.attributes.append(
+            VertexAttribute(name="in_texture_dims", data=tex_dims.astype("f4"))
+        )
+        # updated with filters and normalization, in place
+        self._unmasked_attribute = VertexAttribute(
+            name="in_unmasked",
+            data=self.block_unmasked.astype("f4")[:, None],
+            usage="dynamic draw",
+        )
+        self.vertex_array.attributes.append(self._unmasked_attribute)
+        self._sample_range_attributes = (
+            VertexAttribute(name="in_sample_min", usage="dynamic draw"),
+            VertexAttribute(name="in_sample_max", usage="dynamic draw"),
+        )
+        self.vertex_array.attributes.extend(self._sample_range_attributes)
+        self._set_sample_ranges()
+
         # Now we set up our textures
         self._load_textures()
+        self.field = field
+
+    def set_field(self, field):
+        r"""Switches the block collection to another field.
+
+        Unlike `add_data`, this keeps the block decomposition, vertex
+        attributes and bitmaps of the collection: only the field data are
+        read, after which the value ranges are recomputed and the textures
+        are updated in place.
+
+        Parameters
+        ----------
+        field : string or list of strings
+            The field to switch to, from the same data source, or a list of
+            as many fields as the collection was populated with.
+        """
+        if self._block_data is None:
+            raise RuntimeError("add_data must be called before set_field.")
+        fields = _field_list(field)
+        if len(fields) != len(self.fields):
+            raise ValueError(
+                f"Expected {len(self.fields)} field(s), got {len(fields)}; use "
+                "add_data to change the number of fields."
+            )
+        cache_key = entry = None
+        if self.cache is not None:
+            cache_key = self.cache.key(self.data_source, field, self._no_ghost)
+            entry = self.cache.load(cache_key)
+
+        if entry is None:
+            tiles = self.data_source.tiles
+            tiles.set_fields(fields, [False] * len(fields), no_ghost=self._no_ghost)
+            # the decomposition is unchanged, but the bricks are regenerated
+            bricks = [
+                tiles.get_brick_data(node) for node in tiles.tree.trunk.kd_traverse()
+            ]
+            data = [_field_data(block) for block in bricks]
+            self._set_block_ranges(bricks)
+            if self.cache is not None:
+                masks = [block.source_mask for block in bricks]
+                self._store_blocks(cache_key, data, masks)
+        else:
+            data = entry["data"]
+            self.block_min_vals = entry["block_min_vals"]
+            self.block_max_vals = entry["block_max_vals"]
+        # masks are kept as they are, including any from filter_callback
+        self._block_data = (data, self._block_data[1])
+        if self._lod_hierarchies is not None:
+            self._set_lod_data()
+
+        self._set_field_ranges()
+        self._set_sample_ranges()
+        self._update_textures()
+        self.field = field
+
+    def _build_block_index(self, tiles):
+        # Collects the geometry, grid mapping and value range of every block
+        # of a kd-tree in a single traversal, returning the left and right
+        # edges of the blocks in code_length.
+        n_blocks = len(tiles.bricks)
+        node_le = np.empty((n_blocks, 3), dtype="f8")
+        node_re = np.empty((n_blocks, 3), dtype="f8")
+        grid_ids = np.empty(n_blocks, dtype="i8")
+        self._node_blocks = {}
+        bricks = []
+        for i, node in enumerate(tiles.tree.trunk.kd_traverse()):
+            node_le[i] = node.get_left_edge()
+            node_re[i] = node.get_right_edge()
+            grid_ids[i] = node.grid - tiles._id_offset
+            bricks.append(tiles.get_brick_data(node))
+            self._node_blocks[node.node_id] = i
+        self._block_data = (
+            [_field_data(block) for block in bricks],
+            [block.source_mask for block in bricks],
+        )
+
+        # the slices of each block into its grid, following
+        # AMRKDTree.slice_traverse
+        index = self.data_source.ds.index
+        gle = index.grid_left_edge.d[grid_ids]
+        gre = index.grid_right_edge.d[grid_ids]
+        gdds = (gre - gle) / index.grid_dimensions[grid_ids]
+        li = np.rint((node_le - gle) / gdds).astype("i8")
+        ri = np.rint((node_re - gle) / gdds).astype("i8")
+
+        self.block_dims = ri - li
+        self.block_levels = index.grid_levels[grid_ids, 0].astype("i8")
+        self.grids_by_block = grid_ids
+        self.block_slices = np.stack([li, ri], axis=-1)
+        self.blocks_by_grid = np.argsort(grid_ids, kind="stable")
+
+        self._set_block_ranges(bricks)
+        return node_le, node_re
+
+    def _set_block_ranges(self, bricks):
+        block_ranges = _ordered_map(_block_range, bricks, self._n_workers)
+        ranges = np.array(list(block_ranges), dtype="f8")
+        self.block_min_vals = ranges[:, 0]
+        self.block_max_vals = ranges[:, 1]
+
+    def _add_lod_blocks(self, le, re):
+        # Appends the blocks standing in for finer ones at each level, returning
+        # the left and right edges of all of the blocks. At each level, these
+        # are the largest subtrees of the kd-tree whose blocks are all finer,
+        # or their children for subtrees too large to fit a single block.
+        hierarchy = self._hierarchy
+        n_blocks = self._n_leaf_blocks
+        levels = self.block_levels
+        min_levels = hierarchy.subtree_min_levels(levels)
+        parent = hierarchy.parent
+        ds = self.data_source.ds
+        root_dx = (ds.domain_width / ds.domain_dimensions).to("code_length").d
+        nodes, node_levels, dims = [], [], []
+        for level in range(levels.min(), levels.max()):
+            finer = np.isfinite(min_levels) & (min_levels > level)
+            top = finer & ~np.where(parent >= 0, finer[parent], False)
+            dx = root_dx / ds.refine_by**level
+            stack = np.flatnonzero(top).tolist()
+            while stack:
+                node = stack.pop()
+                width = hierarchy.right_edge[node] - hierarchy.left_edge[node]
+                node_dims = np.maximum(np.rint(width / dx), 1).astype("i8")
+                if node_dims.max() > _MAX_LOD_DIMS and hierarchy.split_dim[node] >= 0:
+                    children = (hierarchy.left[node], hierarchy.right[node])
+                    stack.extend(c for c in children if np.isfinite(min_levels[c]))
+                    continue
+                nodes.append(node)
+                node_levels.append(level)
+                dims.append(node_dims)
+        nodes = np.array(nodes, dtype="i8")
+        node_levels = np.array(node_levels, dtype="i8")
+        self._lod_sources = [hierarchy.blocks_below(node) for node in nodes]
+        self._lod_boxes = (hierarchy.left_edge[nodes], hierarchy.right_edge[nodes])
+        dims = np.array(dims, dtype="i8").reshape(-1, 3)
+        self.block_dims = np.concatenate([self.block_dims, dims])
+        self.block_levels = np.concatenate([levels, node_levels])
+
+        # the kd-tree drawn at each level has the new blocks as its leaves
+        blocks = hierarchy.node_blocks
+        block_levels = np.where(blocks >= 0, levels[blocks], -1)
+        self._lod_hierarchies = {}
+        for level in np.unique(node_levels).tolist():
+            node_blocks = np.where(block_levels > level, -1, blocks)
+            at_level = np.flatnonzero(node_levels == level)
+            node_blocks[nodes[at_level]] = n_blocks + at_level
+            self._lod_hierarchies[level] = hierarchy.pruned(node_blocks)
+
+        self._set_lod_data()
+        masks = self._block_data[1][n_blocks:]
+        unmasked = np.fromiter((mask.all() for mask in masks), dtype="bool")
+        self.block_unmasked = np.concatenate([self.block_unmasked, unmasked])
+        return np.concatenate([le, self._lod_boxes[0]]), np.concatenate(
+            [re, self._lod_boxes[1]]
+        )
+
+    def _set_lod_data(self):
+        # (Re)computes the data, masks and value ranges of the blocks standing
+        # in for finer ones from the data of the blocks they stand in for.
+        n_blocks = self._n_leaf_blocks
+        data, masks = (list(arrays[:n_blocks]) for arrays in self._block_data)
+        le, re = self._node_edges
+        ranges = []
+        for sources, ple, pre, dims in zip(
+            self._lod_sources, *self._lod_boxes, self.block_dims[n_blocks:]
+        ):
+            edges = [(le[i], re[i]) for i in sources]
+            block = _restrict_data([data[i] for i in sources], edges, ple, pre, dims)
+            mask = _restrict_mask([masks[i] for i in sources], edges, ple, pre, dims)
+            fields = block[..., None] if block.ndim == 3 else block
+            ranges.append(
+                [abs_nan_range(fields[..., i]) for i in range(fields.shape[-1])]
+            )
+            data.append(block)
+            masks.append(mask)
+        self._block_data = (data, masks)
+        ranges = np.array(ranges, dtype="f8").reshape(
+            -1, self.block_min_vals.shape[1], 2
+        )
+        self.block_min_vals = np.concatenate(
+            [self.block_min_vals[:n_blocks], ranges[..., 0]]
+        )
+        self.block_max_vals = np.concatenate(
+            [self.block_max_vals[:n_blocks], ranges[..., 1]]
+        )
+
+    @property
+    def level_range(self):
+        """
+        The coarsest and finest levels that can be the finest drawn: the
+        levels of the blocks with ``lod`` set, or only the finest otherwise.
+        """
+        levels = self.block_levels[: self._n_leaf_blocks]
+        if self._lod_hierarchies is None:
+            return levels.max(), levels.max()
+        return levels.min(), levels.max()
+
+    def _level_hierarchy(self, max_level):
+        # the kd-tree of the blocks to draw for a finest level of max_level
+        coarsest, finest = self.level_range
+        if max_level is None or max_level >= finest:
+            return self._hierarchy
+        if self._lod_hierarchies is None:
+            raise ValueError(
+                "Drawing fewer levels than the collection has requires lod=True."
+            )
+        return self._lod_hierarchies[max(max_level, coarsest)]
+
+    def _set_field_ranges(self):
+        if self.compute_min_max:
+            self.field_min_vals = self.block_min_vals.min(axis=0)
+            self.field_max_vals = self.block_max_vals.max(axis=0)
+            self.min_val = self.field_min_vals[0]
+            self.max_val = self.field_max_vals[0]
+            return
+        n_fields = self.block_min_vals.shape[1]
+        self.field_min_vals = np.full(n_fields, self.min_val)
+        self.field_max_vals = np.full(n_fields, self.max_val)
+
+    def _set_sample_ranges(self):
+        # The block ranges go through the same normalization and encoding as
+        # the block data, which are monotonic, so they map to the smallest and
+        # largest values stored for each block; interpolating between stored
+        # values never leaves that range. They are widened slightly to allow
+        # for differences in how the GPU decodes the data.
+        ranges = np.stack([self.block_min_vals, self.block_max_vals])
+        ranges = ranges.astype("float32")
+        if self._normalize:
+            ranges = self._normalize_fields(ranges)
+            ranges[ranges == 0.0] += np.finfo(np.float32).eps
+        ranges = decode_normalized_data(
+            self._encode_data(ranges), self.storage_format, self.field_log_ratios
+        )
+        self.block_sample_min = ranges[0] * (1.0 - _SAMPLE_TOLERANCE)
+        self.block_sample_max = ranges[1] * (1.0 + _SAMPLE_TOLERANCE)
+        # the vertex attributes hold the ranges of up to four fields
+        for attribute, vals in zip(
+            self._sample_range_attributes,
+            (self.block_sample_min, self.block_sample_max),
+        ):
+            data = np.zeros((vals.shape[0], 4), dtype="f4")
+            data[:, : vals.shape[1]] = vals
+            attribute.data = data
+
+    @property
+    def fields(self):
+        """The fields the blocks were populated from."""
+        return [] if self.field is None else _field_list(self.field)
+
+    @property
+    def field_log_ratios(self):
+        """The ``data_log_ratio`` of each field."""
+        ratios = np.zeros(len(self.field_min_vals))
+        if self.storage_format != "unorm8":
+            return ratios
+        mins, maxs = self.field_min_vals, self.field_max_vals
+        is_log = (mins > 0.0) & (maxs > mins)
+        ratios[is_log] = maxs[is_log] / mins[is_log]
+        return ratios
+
+    def _encode_data(self, n_data):
+        return encode_normalized_data(
+            n_data, self.storage_format, log_ratio=self.field_log_ratios
+        )
+
+    def _store_blocks(self, cache_key, data, masks):
+        # only the leaf blocks are cached, as the blocks added with lod are
+        # rebuilt from them
+        le, re = self._node_edges
+        n_blocks = len(data)
+        self.cache.store(
+            cache_key,
+            data,
+            masks,
+            node_ids=np.fromiter(self._node_blocks, dtype="i8"),
+            left_edges=le,
+            right_edges=re,
+            grids_by_block=self.grids_by_block,
+            block_slices=self.block_slices,
+            block_dims=self.block_dims[:n_blocks],
+            block_levels=self.block_levels[:n_blocks],
+            block_min_vals=self.block_min_vals[:n_blocks],
+            block_max_vals=self.block_max_vals[:n_blocks],
+        )
+
+    def _restore_block_index(self, entry):
+        # The cached counterpart of _build_block_index: the kd-tree is only
+        # used to order blocks, so no block data is generated by yt.
+        self._node_blocks = {
+            node_id: i for i, node_id in enumerate(entry["node_ids"].tolist())
+        }
+        self._block_data = (entry["data"], entry["masks"])
+        self.grids_by_block = entry["grids_by_block"]
+        self.block_slices = entry["block_slices"]
+        self.block_dims = entry["block_dims"]
+        self.block_levels = entry["block_levels"]
+        self.block_min_vals = entry["block_min_vals"]
+        self.block_max_vals = entry["block_max_vals"]
+        self.blocks_by_grid = np.argsort(self.grids_by_block, kind="stable")
+        return entry["left_edges"], entry["right_edges"]
+
+    def _block_arrays(self):
+        # (vbo_i, vertex-centered data, mask) for each block, in vbo order,
+        # with a mask of None for unmasked blocks
+        data, masks = self._block_data
+        masks = (
+            None if unmasked else mask
+            for mask, unmasked in zip(masks, self.block_unmasked)
+        )
+        return zip(itertools.count(), data, masks)
 
     def _set_geometry_attributes(self, le, re, dx):
         # set any vertex_array attributes that depend on the yt geometry type
@@ -187,6 +630,8 @@ class BlockCollection(SceneData):
             self.cart_bbox_le = domain_le
             self.cart_bbox_center = (domain_re + domain_le) / 2.0
             self.cart_min_dx = np.min(np.linalg.norm(dx_cart))
+            self._block_centers = (le_cart + re_cart) / 2.0
+            self._cull_boxes = (le_cart, re_cart)
 
             self.vertex_array.attributes.append(
                 VertexAttribute(name="le_cart", data=le_cart.astype("f4"))
@@ -206,52 +651,450 @@ class BlockCollection(SceneData):
                 f"{self.name} does not implement {self._yt_geom_str} geometries."
             )
 
-    def viewpoint_iter(self, camera):
-        for block in self.data_source.tiles.traverse(viewpoint=camera.position):
-            vbo_i, _ = self.blocks[id(block)]
-            yield (vbo_i, self.texture_objects[vbo_i], self.bitmap_objects[vbo_i])
+    def _viewpoint_order(self, camera, mask=None, front_to_back=False, max_level=None):
+        # the blocks to draw, back to front unless front_to_back is set
+        hierarchy = self._level_hierarchy(max_level)
+        order = hierarchy.viewpoint_order(camera.position)
+        if front_to_back:
+            order = order[::-1]
+        if mask is not None:
+            order = order[mask[order]]
+        resident = self.block_resident
+        if resident is not None:
+            order = order[resident[order]]
+        visible = self._visible_blocks(camera)
+        if visible is not None:
+            order = order[visible[order]]
+        self._traversals += 1
+        self._last_drawn[order] = self._traversals
+        if resident is not None and order.size < np.count_nonzero(resident):
+            # some resident blocks went unused, e.g. were out of view, and can
+            # now be evicted
+            self._budget_full = False
+        return order
+
+    def viewpoint_iter(self, camera, mask=None, front_to_back=False, max_level=None):
+        """
+        Yield ``(block_index, data_texture, bitmap_texture)`` for each block to
+        draw, back to front, or front to back if ``front_to_back`` is set. If
+        given, only blocks flagged in the boolean array ``mask`` are drawn,
+        and no level finer than ``max_level`` is, which needs ``lod``.
+        """
+        order = self._viewpoint_order(camera, mask, front_to_back, max_level)
+        for vbo_i in order.tolist():
+            if self.use_atlas:
+                page = self.block_atlas_pages[vbo_i]
+                yield (vbo_i, self.atlas_textures[page], self.atlas_bitmaps[page])
+            else:
+                yield (
+                    vbo_i,
+                    self.texture_objects[vbo_i],
+                    self.bitmap_objects[vbo_i],
+                )
+
+    def viewpoint_batches(self, camera, mask=None, front_to_back=False, max_level=None):
+        """
+        Yield ``(data_texture, bitmap_texture, block_indices)`` for each run of
+        blocks that are consecutive in the viewpoint ordering and share an
+        atlas page, so that each run can be drawn with a single call. The
+        arguments are as for `viewpoint_iter`.
+        """
+        if not self.use_atlas:
+            blocks = self.viewpoint_iter(camera, mask, front_to_back, max_level)
+            for vbo_i, tex, bitmap_tex in blocks:
+                yield tex, bitmap_tex, np.array([vbo_i], dtype="i4")
+            return
+        order = self._viewpoint_order(camera, mask, front_to_back, max_level)
+        order = order.astype("i4")
+        if order.size == 0:
+            return
+        pages = self.block_atlas_pages[order]
+        starts = np.flatnonzero(pages[1:] != pages[:-1]) + 1
+        for run in np.split(order, starts):
+            page = self.block_atlas_pages[run[0]]
+            yield self.atlas_textures[page], self.atlas_bitmaps[page], run
 
     def filter_callback(self, callback):
-        # This is not efficient.  It calls it once for each node in a grid.
-        # We do this the slow way because of the problem of ordering the way we
-        # iterate over the grids and nodes.  This can be fixed at some point.
-        for g_ind in self.blocks_by_grid:
-            blocks = self.blocks_by_grid[g_ind]
+        # This calls the callback once for each grid, and then updates the
+        # bitmaps of all of the blocks that came from that grid.
+        masks = self._block_data[1]
+        unmasked = self.block_unmasked.copy()
+
+        def _update_mask(vbo_i, mask):
+            # keep the host copy current for blocks uploaded later
+            masks[vbo_i] = mask
+            unmasked[vbo_i] = mask.all()
+            if self.use_atlas:
+                bitmap_tex = self.atlas_bitmaps[self.block_atlas_pages[vbo_i]]
+                bitmap_tex.update_region(mask, self.block_atlas_offsets[vbo_i])
+            elif vbo_i in self.bitmap_objects:
+                self._set_bitmap(vbo_i, None if unmasked[vbo_i] else mask)
+
+        block_inds = self.blocks_by_grid
+        grid_ids, starts = np.unique(self.grids_by_block[block_inds], return_index=True)
+        for g_ind, grid_blocks in zip(grid_ids, np.split(block_inds, starts[1:])):
             # Does this need an offset?
             grid = self.data_source.index.grids[g_ind]
             new_bitmap = callback(grid).astype("uint8")
-            for b_id, _ in blocks:
-                _, sl = self.grids_by_block[b_id]
-                vbo_i, _ = self.blocks[b_id]
-                self.bitmap_objects[vbo_i].data = new_bitmap[sl]
+            for vbo_i in grid_blocks:
+                sl = tuple(slice(*lr) for lr in self.block_slices[vbo_i])
+                _update_mask(vbo_i, new_bitmap[sl])
+        if self._lod_hierarchies is not None:
+            # the blocks standing in for finer ones follow their masks
+            le, re = self._node_edges
+            lod_blocks = zip(self._lod_sources, *self._lod_boxes)
+            for vbo_i, (sources, ple, pre) in enumerate(
+                lod_blocks, self._n_leaf_blocks
+            ):
+                edges = [(le[i], re[i]) for i in sources]
+                sources = [masks[i] for i in sources]
+                dims = self.block_dims[vbo_i]
+                _update_mask(vbo_i, _restrict_mask(sources, edges, ple, pre, dims))
+        self.block_unmasked = unmasked
+        self._unmasked_attribute.data = unmasked.astype("f4")[:, None]
+
+    @property
+    def _n_workers(self):
+        if self.n_workers is None:
+            return os.cpu_count() or 1
+        return max(self.n_workers, 1)
+
+    def _prepare_block(self, data, mask, normalize):
+        # Host-side preparation of a single block: this only touches numpy
+        # arrays, so it is safe to call from a worker thread. The bitmap is
+        # None for unmasked blocks, as are the macro-cell ranges and the
+        # downsampled levels when they are not used.
+        # The absolute values are converted to float32 in a single pass, into
+        # an array laid out the way textures are uploaded, and everything up
+        # to encoding happens in place, so that the data is copied only once.
+        data = np.asarray(data)
+        n_data = empty_texture_data(data.shape, "float32")
+        np.abs(data, out=n_data, casting="same_kind")
+        # Avoid setting to NaNs
+        if normalize:
+            self._normalize_fields(n_data, out=n_data)
+            # blocks filled with identically 0 values will be
+            # skipped by the shader, so offset by a tiny value.
+            # see https://github.com/yt-project/yt_idv/issues/171
+            n_data[n_data == 0.0] += np.finfo(np.float32).eps
+        bitmap = None
+        if mask is not None:
+            bitmap = empty_texture_data(mask.shape, "u1")
+            np.multiply(mask, 255, out=bitmap, casting="unsafe")
+        mipmaps = None
+        if self._use_mipmaps:
+            levels = _brick_pyramid(n_data, self.mipmap_levels)
+            mipmaps = [self._encode_data(level) for level in levels]
+        n_data = self._encode_data(n_data)
+        return n_data, bitmap, self._macrocell_data(n_data), mipmaps
+
+    @property
+    def _use_macrocells(self):
+        return self.macrocell_size > 0 and not self.use_atlas
+
+    @property
+    def _use_mipmaps(self):
+        return self.mipmap_levels > 0 and not self.use_atlas
+
+    def _macrocell_data(self, n_data):
+        # The range of values that can be sampled in each macro-cell of a
+        # block, from its encoded data, as a two-channel (min, max) array with
+        # the macro-cells of each field stacked along z. Encoding is monotonic,
+        # so only the ranges need decoding.
+        if not self._use_macrocells:
+            return None
+        if n_data.ndim == 3:
+            n_data = n_data[..., None]
+        mins, maxs = _macrocell_ranges(n_data, self.macrocell_size)
+        ranges = decode_normalized_data(
+            np.stack([mins, maxs], axis=-1),
+            self.storage_format,
+            self.field_log_ratios[:, None],
+        )
+        ranges[..., 0] *= 1.0 - _SAMPLE_TOLERANCE
+        ranges[..., 1] *= 1.0 + _SAMPLE_TOLERANCE
+        nx, ny, nz, n_fields, _ = ranges.shape
+        # stacked in the layout textures are uploaded in, x varying fastest
+        ranges = np.ascontiguousarray(ranges.transpose(3, 2, 1, 0, 4), dtype="float32")
+        return ranges.reshape(n_fields * nz, ny, nx, 2).transpose(2, 1, 0, 3)
+
+    def _normalize_fields(self, data, out=None):
+        # _normalize_by_min_max, with each field (along the last axis of
+        # multi-field data) normalized by its own range, into out if given
+        mins = self.field_min_vals.astype("float32")
+        val_range = (self.field_max_vals - self.field_min_vals).astype("float32")
+        val_range[val_range == 0.0] = 1.0
+        n_data = np.subtract(data, mins, out=out)
+        n_data /= val_range
+        np.clip(n_data, 0.0, 1.0, out=n_data)
+        return n_data
+
+    @property
+    def _normalize(self):
+        changing = np.any(self.field_max_vals != self.field_min_vals)
+        return changing or self.always_normalize
 
     def _load_textures(self):
-        for block_id in sorted(self.blocks):
-            vbo_i, block = self.blocks[block_id]
-            n_data = np.abs(block.my_data[0]).copy(order="F").astype("float32").d
-            # Avoid setting to NaNs
-            if self.max_val != self.min_val or self.always_normalize:
-                n_data = self._normalize_by_min_max(n_data)
-                # blocks filled with identically 0 values will be
-                # skipped by the shader, so offset by a tiny value.
-                # see https://github.com/yt-project/yt_idv/issues/171
-                n_data[n_data == 0.0] += np.finfo(np.float32).eps
-
-            data_tex = Texture3D(data=n_data)
-            bitmap_tex = Texture3D(
-                data=block.source_mask * 255, min_filter="nearest", mag_filter="nearest"
+        n_blocks = len(self.block_dims)
+        self.resident_bytes = 0
+        self._traversals = 0
+        self._last_drawn = np.zeros(n_blocks, dtype="i8")
+        self._budget_full = False
+        itemsize = np.dtype(STORAGE_FORMATS[self.storage_format]).itemsize
+        itemsize *= len(self.field_min_vals)
+        self._block_nbytes = np.prod(self.block_dims + 1, axis=1) * itemsize
+        self._block_nbytes += np.prod(self.block_dims, axis=1) * ~self.block_unmasked
+        if self._use_macrocells:
+            n_macro = -(-self.block_dims // self.macrocell_size)
+            self._block_nbytes += np.prod(n_macro, axis=1) * 8 * len(self.fields)
+        if self._use_mipmaps:
+            dims = self.block_dims + 1
+            n_levels = _n_pyramid_levels(dims, self.mipmap_levels)
+            for level in range(1, self.mipmap_levels + 1):
+                level_dims = np.maximum(dims >> level, 1)
+                level_nbytes = np.prod(level_dims, axis=1) * itemsize
+                self._block_nbytes += level_nbytes * (level <= n_levels)
+        self._unmasked_bitmap = Texture3D(
+            data=np.full((1, 1, 1), 255, dtype="u1"),
+            min_filter="nearest",
+            mag_filter="nearest",
+        )
+        if self.progressive or self.gpu_budget_mb is not None:
+            # uploads happen in upload_pending; atlas pages start out empty
+            self._upload_queue = np.arange(n_blocks)
+            self.block_resident = np.zeros(n_blocks, dtype="bool")
+            if self.use_atlas:
+                self._load_atlas(())
+            if not self.progressive:
+                # fill the budget now, coarsest levels first
+                self._upload_queue = np.argsort(self.block_levels, kind="stable")
+                self._upload_blocks()
+            return
+        self._upload_queue = None
+        self.block_resident = None
+
+        normalize = self._normalize
+
+        def _prepare(item):
+            vbo_i, data, mask = item
+            return (vbo_i,) + self._prepare_block(data, mask, normalize)
+
+        # The worker pool prepares upload-ready buffers while this thread,
+        # which owns the OpenGL context, creates the textures.
+        prepared = _ordered_map(_prepare, self._block_arrays(), self._n_workers)
+        if self.use_atlas:
+            self._load_atlas(prepared)
+            return
+        for vbo_i, n_data, bitmap, macrocells, mipmaps in prepared:
+            self._upload_block(vbo_i, n_data, bitmap, macrocells, mipmaps)
+
+    def _update_textures(self):
+        # Re-uploads the data of the resident blocks into their existing
+        # textures; blocks that are not resident yet pick up the new data
+        # when they are uploaded.
+        if self.block_resident is None:
+            resident = np.arange(len(self.block_dims))
+        else:
+            resident = np.flatnonzero(self.block_resident)
+        data = self._block_data[0]
+        normalize = self._normalize
+
+        def _prepare(vbo_i):
+            n_data, _, macrocells, mipmaps = self._prepare_block(
+                data[vbo_i], None, normalize
+            )
+            return vbo_i, n_data, macrocells, mipmaps
+
+        for vbo_i, n_data, macrocells, mipmaps in _ordered_map(
+            _prepare, resident, self._n_workers
+        ):
+            if self.use_atlas:
+                page = self.block_atlas_pages[vbo_i]
+                offset = self.block_atlas_offsets[vbo_i]
+                self.atlas_textures[page].update_region(n_data, offset)
+            else:
+                self.texture_objects[vbo_i].update_region(n_data, mipmaps=mipmaps)
+            if macrocells is not None:
+                self.macrocell_objects[vbo_i].update_region(macrocells)
+
+    def _upload_block(self, vbo_i, n_data, bitmap, macrocells, mipmaps):
+        if self.use_atlas:
+            page = self.block_atlas_pages[vbo_i]
+            offset = self.block_atlas_offsets[vbo_i]
+            if bitmap is None:
+                bitmap = empty_texture_data(self.block_dims[vbo_i], "u1")
+                bitmap.fill(255)
+            self.atlas_textures[page].update_region(n_data, offset)
+            self.atlas_bitmaps[page].update_region(bitmap, offset)
+            return
+        if mipmaps:
+            self.texture_objects[vbo_i] = Texture3D(
+                data=n_data, mipmaps=mipmaps, min_filter="linear mipmap nearest"
+            )
+        else:
+            self.texture_objects[vbo_i] = Texture3D(data=n_data)
+        self.resident_bytes += _texture_nbytes(self.texture_objects[vbo_i])
+        self._set_bitmap(vbo_i, bitmap)
+        if macrocells is not None:
+            self.macrocell_objects[vbo_i] = Texture3D(
+                data=macrocells, min_filter="nearest", mag_filter="nearest"
+            )
+            self.resident_bytes += macrocells.nbytes
+
+    def _set_bitmap(self, vbo_i, bitmap):
+        # points a block at its own bitmap texture, or at the shared one if
+        # bitmap is None
+        old = self.bitmap_objects.get(vbo_i, self._unmasked_bitmap)
+        if old is not self._unmasked_bitmap:
+            self.resident_bytes -= old.data.nbytes
+            if bitmap is not None:
+                old.data = bitmap
+                self.resident_bytes += bitmap.nbytes
+                return
+            old.delete()
+        if bitmap is None:
+            self.bitmap_objects[vbo_i] = self._unmasked_bitmap
+            return
+        self.bitmap_objects[vbo_i] = Texture3D(
+            data=bitmap, min_filter="nearest", mag_filter="nearest"
+        )
+        self.resident_bytes += bitmap.nbytes
+
+    def _evict_block(self, vbo_i):
+        tex = self.texture_objects.pop(vbo_i)
+        self.resident_bytes -= _texture_nbytes(tex)
+        tex.delete()
+        self._set_bitmap(vbo_i, None)
+        del self.bitmap_objects[vbo_i]
+        macrocells = self.macrocell_objects.pop(vbo_i, None)
+        if macrocells is not None:
+            self.resident_bytes -= macrocells.data.nbytes
+            macrocells.delete()
+        self.block_resident[vbo_i] = False
+
+    def _make_room(self, n_bytes, evicted):
+        # evicts the least recently drawn blocks until n_bytes more fit in the
+        # budget, returning False if that is not possible
+        if self.gpu_budget_mb is None or self.use_atlas:
+            return True
+        excess = self.resident_bytes + n_bytes - self.gpu_budget_mb * 1024**2
+        if excess <= 0:
+            return True
+        resident = np.flatnonzero(self.block_resident)
+        candidates = resident[self._last_drawn[resident] < self._traversals]
+        candidates = candidates[np.argsort(self._last_drawn[candidates], kind="stable")]
+        freed = np.cumsum(self._block_nbytes[candidates])
+        if freed.size == 0 or freed[-1] < excess:
+            return False
+        for vbo_i in candidates[: np.searchsorted(freed, excess) + 1]:
+            self._evict_block(vbo_i)
+            evicted.append(vbo_i)
+        return True
+
+    @property
+    def has_pending_uploads(self):
+        if self._upload_queue is None or self._budget_full:
+            return False
+        return self._upload_queue.size > 0
+
+    def upload_pending(self, camera):
+        """
+        Upload the next blocks waiting in progressive mode, within the
+        per-frame budget. At least one block is uploaded on every call.
+        """
+        if not self.has_pending_uploads:
+            return
+        queue = self._upload_queue
+        dist = np.linalg.norm(self._block_centers[queue] - camera.position, axis=1)
+        self._upload_queue = queue[np.lexsort((dist, self.block_levels[queue]))]
+        if self.progressive:
+            self._upload_blocks(
+                max_bytes=self.upload_budget_mb * 1024**2,
+                deadline=time.perf_counter() + self.upload_budget_ms / 1000.0,
+            )
+        else:
+            self._upload_blocks()
+
+    def _upload_blocks(self, max_bytes=np.inf, deadline=np.inf):
+        # uploads blocks from the front of the queue until either max_bytes
+        # have been uploaded or the deadline has passed, staying within the
+        # GPU budget
+        queue = self._upload_queue
+        n_bytes = n_uploaded = 0
+        data, masks = self._block_data
+        evicted = []
+        for vbo_i in queue:
+            if n_uploaded and (n_bytes >= max_bytes or time.perf_counter() > deadline):
+                break
+            if not self._make_room(self._block_nbytes[vbo_i], evicted):
+                self._budget_full = True
+                break
+            mask = None if self.block_unmasked[vbo_i] else masks[vbo_i]
+            prepared = self._prepare_block(data[vbo_i], mask, self._normalize)
+            self._upload_block(vbo_i, *prepared)
+            self.block_resident[vbo_i] = True
+            # uploads count as uses, so they are not evicted right away
+            self._last_drawn[vbo_i] = self._traversals
+            n_bytes += self._block_nbytes[vbo_i]
+            n_uploaded += 1
+        self._upload_queue = np.concatenate(
+            [queue[n_uploaded:], np.array(evicted, dtype=queue.dtype)]
+        )
+
+    def _load_atlas(self, prepared):
+        dtype = STORAGE_FORMATS[self.storage_format]
+        # multi-field data has its fields along a trailing axis
+        n_fields = len(self.field_min_vals)
+        channels = (n_fields,) if n_fields > 1 else ()
+        pages = [
+            empty_texture_data(tuple(shape) + channels, dtype)
+            for shape in self._atlas_shapes
+        ]
+        bitmaps = [empty_texture_data(shape, "u1") for shape in self._atlas_shapes]
+        for page in pages + bitmaps:
+            page.fill(0)
+        for vbo_i, n_data, bitmap, *_ in prepared:
+            page = self.block_atlas_pages[vbo_i]
+            x, y, z = self.block_atlas_offsets[vbo_i]
+            nx, ny, nz = n_data.shape[:3]
+            pages[page][x : x + nx, y : y + ny, z : z + nz] = n_data
+            nx, ny, nz = self.block_dims[vbo_i]
+            bitmaps[page][x : x + nx, y : y + ny, z : z + nz] = (
+                255 if bitmap is None else bitmap
             )
-            self.texture_objects[vbo_i] = data_tex
-            self.bitmap_objects[vbo_i] = bitmap_tex
+        self.atlas_textures = [Texture3D(data=data) for data in pages]
+        self.atlas_bitmaps = [
+            Texture3D(data=bitmap, min_filter="nearest", mag_filter="nearest")
+            for bitmap in bitmaps
+        ]
+        self.resident_bytes = sum(page.nbytes for page in pages + bitmaps)
 
+    _atlas_shapes = None
+    _node_blocks = None
+    _hierarchy = None
+    _n_leaf_blocks = None
+    _lod_hierarchies = None
+    _lod_sources = None
+    _lod_boxes = None
+    _block_data = None
+    _block_centers = None
+    _upload_queue = None
+    _budget_full = False
+    _traversals = 0
+    _last_drawn = None
+    _block_nbytes = None
+    _unmasked_bitmap = None
+    _unmasked_attribute = None
+    _sample_range_attributes = None
+    _node_edges = None
+    _no_ghost = False
     _grid_id_list = None
 
     @property
     def grid_id_list(self):
         """the 0-indexed grid ids that contain all the blocks"""
         if self._grid_id_list is None:
-            gl = [gid for gid, _ in self.grids_by_block.values()]
-            self._grid_id_list = np.unique(gl).tolist()
+            self._grid_id_list = np.unique(self.grids_by_block).tolist()
         return self._grid_id_list
 
     @property
@@ -259,6 +1102,222 @@ class BlockCollection(SceneData):
         return [self.data_source.ds.index.grids[gid] for gid in self.grid_id_list]
 
 
+# the relative amount by which the ranges of values that can be sampled from a
+# block are widened, to allow for differences in how the GPU decodes data
+_SAMPLE_TOLERANCE = 1e-4
+
+
+# the largest number of cells along each axis of a block standing in for finer
+# blocks, beyond which subtrees are split between several blocks
+_MAX_LOD_DIMS = 128
+
+
+def _restrict_data(data, edges, le, re, dims):
+    # The vertex-centered data of a block of dims cells between le and re,
+    # from the finer data of the blocks with the given edges: each vertex
+    # averages the finer vertices within half a cell of it along each axis,
+    # much like the parents of AMR cells average their children. Vertices
+    # away from any finer values are NaN.
+    dx = (re - le) / dims
+    vertices = [le[axis] + dx[axis] * np.arange(dims[axis] + 1) for axis in range(3)]
+    shape = tuple(dims + 1) + np.shape(data[0])[3:]
+    total = np.zeros(shape)
+    weight = np.zeros(shape)
+    for block, (ble, bre) in zip(data, edges):
+        block = np.asarray(block, dtype="f8")
+        weights = []
+        for axis, verts in enumerate(vertices):
+            n_cells = block.shape[axis] - 1
+            x = ble[axis] + (bre[axis] - ble[axis]) * np.arange(n_cells + 1) / n_cells
+            near = np.abs(x[None, :] - verts[:, None]) <= 0.5 * dx[axis] * (1 + 1e-6)
+            weights.append(near.astype("f8"))
+        valid = np.isfinite(block)
+        for out, values in ((total, np.where(valid, block, 0.0)), (weight, valid)):
+            out += np.einsum("ia,jb,kc,abc...->ijk...", *weights, values, optimize=True)
+    return np.divide(total, weight, out=np.full(shape, np.nan), where=weight > 0)
+
+
+def _restrict_mask(masks, edges, le, re, dims):
+    # The mask of each cell of a block of dims cells between le and re, from
+    # the finer cell its center falls in, masked out away from finer blocks.
+    dx = (re - le) / dims
+    centers = [le[axis] + dx[axis] * (np.arange(dims[axis]) + 0.5) for axis in range(3)]
+    out = np.zeros(tuple(dims), dtype="u1")
+    for mask, (ble, bre) in zip(masks, edges):
+        mask = np.asarray(mask)
+        inside, index = [], []
+        for axis, x in enumerate(centers):
+            n_cells = mask.shape[axis]
+            i = np.floor((x - ble[axis]) / (bre[axis] - ble[axis]) * n_cells)
+            in_block = (i >= 0) & (i < n_cells)
+            inside.append(np.flatnonzero(in_block))
+            index.append(i[in_block].astype("i8"))
+        out[np.ix_(*inside)] = mask[np.ix_(*index)]
+    return out
+
+
+def _n_pyramid_levels(dims, max_levels):
+    # the number of downsampled levels below data of the given dims (along
+    # the last axis), up to max_levels: halving stops at 1 along every axis
+    n_levels = np.floor(np.log2(np.max(dims, axis=-1))).astype("i8")
+    return np.minimum(n_levels, max_levels)
+
+
+def _box_filter_weights(n_in, n_out):
+    # The (n_out, n_in) weights averaging n_in evenly spaced vertices down to
+    # n_out vertices spanning the same extent: each output vertex averages
+    # the input vertices over a box one output spacing wide centered on it,
+    # weighting each by how much of its own spacing falls in the box.
+    if n_out == 1:
+        return np.full((1, n_in), 1.0 / n_in)
+    width = (n_in - 1) / (n_out - 1)
+    centers = np.arange(n_out) * width
+    lower = np.maximum(centers[:, None] - width / 2, np.arange(n_in) - 0.5)
+    upper = np.minimum(centers[:, None] + width / 2, np.arange(n_in) + 0.5)
+    weights = np.maximum(upper - lower, 0.0)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def _brick_pyramid(data, max_levels):
+    # Successively box-filtered copies of vertex-centered data, with fields
+    # along a trailing axis, with the sizes of the OpenGL mipmap levels below
+    # it: half as many vertices along each axis as the level above, rounding
+    # down, to at least 1. Values are resampled so that the first and last
+    # vertices of every level still lie on the faces of the block. NaNs are
+    # left out of the averages.
+    levels = []
+    level = np.asarray(data, dtype="float32")
+    dims = np.array(data.shape[:3])
+    for k in range(1, _n_pyramid_levels(dims, max_levels) + 1):
+        weights = [
+            _box_filter_weights(n_in, max(n >> k, 1))
+            for n_in, n in zip(level.shape[:3], dims)
+        ]
+        valid = np.isfinite(level)
+        total, weight = (
+            np.einsum("ia,jb,kc,abc...->ijk...", *weights, values, optimize=True)
+            for values in (np.where(valid, level, 0.0), valid)
+        )
+        level = empty_texture_data(total.shape, "float32")
+        level.fill(np.nan)
+        np.divide(total, weight, out=level, where=weight > 0)
+        levels.append(level)
+    return levels
+
+
+def _texture_nbytes(texture):
+    return texture.data.nbytes + sum(level.nbytes for level in texture.mipmaps)
+
+
+def _macrocell_ranges(data, size):
+    # The minimum and maximum of vertex-centered data, with fields along a
+    # trailing axis, over each macro-cell of size cells along each axis,
+    # including the vertices on its faces. Partial macro-cells at the upper
+    # edges cover the remaining cells. Each axis is reduced in turn, so that
+    # the arrays made along the way are a factor of size smaller than the
+    # data.
+    mins = maxs = data
+    for axis in range(3):
+        n_cells = data.shape[axis] - 1
+        starts = np.arange(0, n_cells, size)
+        # the runs of vertices from each start up to the next, to which the
+        # vertex on the upper face of each macro-cell is added, other than
+        # for the last run, which ends on it
+        head = (slice(None),) * axis + (slice(None, -1),)
+        faces = (slice(None),) * axis + (starts[1:],)
+        new_mins = np.minimum.reduceat(mins, starts, axis=axis)
+        new_maxs = np.maximum.reduceat(maxs, starts, axis=axis)
+        np.minimum(new_mins[head], mins[faces], out=new_mins[head])
+        np.maximum(new_maxs[head], maxs[faces], out=new_maxs[head])
+        mins, maxs = new_mins, new_maxs
+    return mins, maxs
+
+
+def _block_range(block):
+    # the nan-aware ranges of the absolute values of a block's fields, as
+    # [[min, ...], [max, ...]]
+    return np.array([abs_nan_range(data) for data in block.my_data]).T
+
+
+def _field_data(block):
+    # the vertex-centered data of a block, with several fields stacked along
+    # a trailing axis
+    if len(block.my_data) == 1:
+        return block.my_data[0]
+    return np.stack([np.asarray(data) for data in block.my_data], axis=-1)
+
+
+def _field_list(field):
+    # a list of fields is packed into texture channels; anything else,
+    # including a (field type, field name) tuple, is a single field
+    fields = list(field) if isinstance(field, list) else [field]
+    if not 0 < len(fields) <= 4:
+        raise ValueError(f"Expected between 1 and 4 fields, got {len(fields)}.")
+    return fields
+
+
+def _pack_blocks(dims, width, max_depth):
+    """
+    Shelf-pack boxes of shape ``dims`` (n, 3) into atlas pages.
+
+    Boxes are laid out in rows along x, rows are stacked along y into slabs
+    no larger than ``width`` and slabs are stacked along z, starting a new
+    page once a page would exceed ``max_depth``.
+
+    Returns the page of each box, the offset of each box within its page and
+    the shape of each page.
+    """
+    dims = np.asarray(dims, dtype="i8")
+    if dims[:, 2].max() > max_depth:
+        raise ValueError(f"Blocks are deeper than the maximum depth of {max_depth}")
+    width = max(width, dims[:, :2].max())
+    pages = np.zeros(len(dims), dtype="i8")
+    offsets = np.zeros_like(dims)
+
+    # packing the deepest and tallest boxes first keeps the slabs and rows
+    # tightly filled
+    page = x = y = z = row_height = slab_depth = 0
+    for i in np.lexsort((dims[:, 1], dims[:, 2]))[::-1]:
+        nx, ny, nz = dims[i]
+        if x + nx > width:
+            x, y, row_height = 0, y + row_height, 0
+        if y + ny > width:
+            x, y, z, row_height, slab_depth = 0, 0, z + slab_depth, 0, 0
+        if z + nz > max_depth:
+            page += 1
+            x = y = z = row_height = slab_depth = 0
+        pages[i] = page
+        offsets[i] = x, y, z
+        x += nx
+        row_height = max(row_height, ny)
+        slab_depth = max(slab_depth, nz)
+
+    extents = offsets + dims
+    shapes = [tuple(extents[pages == p].max(axis=0)) for p in range(page + 1)]
+    return pages, offsets, shapes
+
+
+def _ordered_map(func, items, n_workers):
+    """
+    Apply ``func`` to each of ``items`` using a pool of ``n_workers`` threads,
+    yielding the results in order.
+
+    At most ``2 * n_workers`` items are in flight at any time, so the memory
+    used by results that have not been consumed yet stays bounded.
+    """
+    if n_workers <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
 def _block_collection_outlines(
     block_collection: BlockCollection,
     display_name: str = "block outlines",
@@ -285,14 +1344,18 @@ def _block_collection_outlines(
     data_collection = CurveCollection()
 
     if outline_type == "blocks":
-        block_iterator = block_collection.data_source.tiles.traverse()
+        trunk = block_collection.data_source.tiles.tree.trunk
+        block_edges = [
+            (node.get_left_edge(), node.get_right_edge())
+            for node in trunk.kd_traverse()
+        ]
     else:
         # note this can be simplified after
         # https://github.com/yt-project/yt_idv/pull/179
-        gids = [gid for gid, _ in block_collection.grids_by_block.values()]
-        gids = np.unique(gids)
+        gids = np.unique(block_collection.grids_by_block)
         ds = block_collection.data_source.ds
-        block_iterator = [ds.index.grids[gid] for gid in gids]
+        grids = [ds.index.grids[gid] for gid in gids]
+        block_edges = [(grid.LeftEdge, grid.RightEdge) for grid in grids]
 
     if block_collection._yt_geom_str == "spherical":
         from yt_idv.utilities.coordinate_utilities import spherical_to_cartesian
@@ -304,9 +1367,7 @@ def _block_collection_outlines(
         rad_index = axis_id["r"]
         max_r = block_collection.data_source.ds.domain_right_edge[rad_index]
 
-        for block in block_iterator:
-            le_i = block.LeftEdge
-            re_i = block.RightEdge
+        for le_i, re_i in block_edges:
 
             r_min = le_i[axis_id["r"]] / max_r
             r_max = re_i[axis_id["r"]] / max_r
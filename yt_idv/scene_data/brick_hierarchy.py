@@ -0,0 +1,173 @@
+import numpy as np
+import traitlets
+import traittypes
+
+from yt_idv.utilities.block_utilities import kd_viewpoint_order
+
+
+class BrickHierarchy(traitlets.HasTraits):
+    """
+    A kd-tree of bricks flattened into arrays, for ordering bricks by their
+    distance from a viewpoint without walking the tree in Python.
+
+    Nodes are stored depth-first, with the root at index 0. ``left`` and
+    ``right`` hold the indices of the children of each node and
+    ``split_dim``/``split_pos`` its split plane, with -1 for missing
+    children and for the split dimension of leaves, which are the nodes
+    missing either child. ``node_blocks`` holds the
+    index of the block at each leaf, or -1. ``left_edge`` and ``right_edge``
+    hold the bounds of each node.
+
+    The ordering only depends on which side of each split plane the
+    viewpoint is on, so it is cached and reused for as long as the viewpoint
+    stays within the same cell of the split planes.
+
+    Examples
+    --------
+
+    >>> hierarchy = BrickHierarchy.from_kd_tree(tiles.tree.trunk, node_blocks)
+    >>> back_to_front = hierarchy.viewpoint_order(camera.position)
+    """
+
+    left = traittypes.Array(None, allow_none=True)
+    right = traittypes.Array(None, allow_none=True)
+    split_dim = traittypes.Array(None, allow_none=True)
+    split_pos = traittypes.Array(None, allow_none=True)
+    node_blocks = traittypes.Array(None, allow_none=True)
+    left_edge = traittypes.Array(None, allow_none=True)
+    right_edge = traittypes.Array(None, allow_none=True)
+
+    _cell = None
+    _order = None
+    _planes = None
+
+    @classmethod
+    def from_kd_tree(cls, trunk, node_blocks):
+        """
+        Flatten the kd-tree rooted at ``trunk``, where ``node_blocks`` maps
+        the ``node_id`` of each leaf with data to the index of its block.
+        """
+        nodes = list(trunk.depth_first_touch())
+        index = {node.node_id: i for i, node in enumerate(nodes)}
+
+        def _child_index(node):
+            return -1 if node is None else index[node.node_id]
+
+        left = np.fromiter((_child_index(n.left) for n in nodes), dtype="i8")
+        right = np.fromiter((_child_index(n.right) for n in nodes), dtype="i8")
+        split_dim = np.fromiter((n.get_split_dim() for n in nodes), dtype="i4")
+        split_pos = np.fromiter((n.get_split_pos() for n in nodes), dtype="f8")
+        # as in Node._kd_is_leaf
+        leaves = (left < 0) | (right < 0)
+        split_dim[leaves] = -1
+        blocks = np.fromiter(
+            (node_blocks.get(n.node_id, -1) for n in nodes), dtype="i8"
+        )
+        blocks[~leaves] = -1
+        return cls(
+            left=left,
+            right=right,
+            split_dim=split_dim,
+            split_pos=split_pos,
+            node_blocks=blocks,
+            left_edge=np.array([n.get_left_edge() for n in nodes], dtype="f8"),
+            right_edge=np.array([n.get_right_edge() for n in nodes], dtype="f8"),
+        )
+
+    @property
+    def parent(self):
+        """The index of the parent of each node, -1 for the root."""
+        parent = np.full(self.left.size, -1, dtype="i8")
+        for children in (self.left, self.right):
+            has_child = children >= 0
+            parent[children[has_child]] = np.flatnonzero(has_child)
+        return parent
+
+    def subtree_min_levels(self, block_levels):
+        """
+        The coarsest of the ``block_levels`` of the blocks below each node,
+        or inf for nodes without any blocks below them.
+        """
+        min_levels = np.full(self.left.size, np.inf)
+        has_block = self.node_blocks >= 0
+        min_levels[has_block] = block_levels[self.node_blocks[has_block]]
+        # children always come after their parents in depth-first order
+        internal = np.flatnonzero(self.split_dim >= 0)
+        for node in internal[::-1].tolist():
+            min_levels[node] = min(
+                min_levels[self.left[node]], min_levels[self.right[node]]
+            )
+        return min_levels
+
+    def blocks_below(self, node):
+        """The blocks at the leaves of the subtree rooted at ``node``."""
+        blocks = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if self.split_dim[node] >= 0:
+                stack.extend((self.left[node], self.right[node]))
+            elif self.node_blocks[node] >= 0:
+                blocks.append(self.node_blocks[node])
+        return np.sort(np.array(blocks, dtype="i8"))
+
+    def pruned(self, node_blocks):
+        """
+        A copy of the hierarchy in which each node with a block in
+        ``node_blocks`` is a leaf holding that block, for drawing a single
+        block in place of the blocks below a node.
+        """
+        leaves = node_blocks >= 0
+        return BrickHierarchy(
+            left=np.where(leaves, -1, self.left),
+            right=np.where(leaves, -1, self.right),
+            split_dim=np.where(leaves, -1, self.split_dim).astype("i4"),
+            split_pos=self.split_pos,
+            node_blocks=node_blocks,
+            left_edge=self.left_edge,
+            right_edge=self.right_edge,
+        )
+
+    @traitlets.observe("left", "right", "split_dim", "split_pos", "node_blocks")
+    def _reset_order(self, change):
+        self._cell = self._order = self._planes = None
+
+    @property
+    def _split_planes(self):
+        # the sorted, unique split positions along each axis
+        if self._planes is None:
+            self._planes = [
+                np.unique(self.split_pos[self.split_dim == dim]) for dim in range(3)
+            ]
+        return self._planes
+
+    def viewpoint_order(self, viewpoint):
+        """
+        The indices of the blocks, furthest from ``viewpoint`` first.
+
+        The returned array is shared between calls from the same cell and
+        must not be modified.
+        """
+        viewpoint = np.asarray(viewpoint, dtype="f8").reshape(3)
+        # the number of split planes strictly below the viewpoint along each
+        # axis identifies its cell, as the traversal puts viewpoints lying on
+        # a plane on its lower side
+        cell = tuple(
+            int(np.searchsorted(planes, viewpoint[dim], side="left"))
+            for dim, planes in enumerate(self._split_planes)
+        )
+        if cell != self._cell:
+            order = np.empty(np.count_nonzero(self.node_blocks >= 0), dtype="i8")
+            n = kd_viewpoint_order(
+                self.left,
+                self.right,
+                self.split_dim,
+                self.split_pos,
+                self.node_blocks,
+                viewpoint,
+                order,
+            )
+            self._order = order[:n]
+            self._order.flags.writeable = False
+            self._cell = cell
+        return self._order
@@ -77,7 +77,9 @@ class OctreeBlockCollection(SceneData):
             data = (data - self.min_val) / (
                 self.max_val - self.min_val
             )  # * self.diagonal)
+        data = self._encode_data(data)
 
+        self._cull_boxes = (left_edges, right_edges)
         self.vertex_array.attributes.append(
             VertexAttribute(name="model_vertex", data=aabb_triangle_strip, divisor=0)
         )
@@ -7,6 +7,7 @@ from yt.data_objects.static_output import Dataset
 from yt_idv.cameras.base_camera import BaseCamera
 from yt_idv.cameras.trackball_camera import TrackballCamera
 from yt_idv.opengl_support import Framebuffer
+from yt_idv.quality_controller import QualityController
 from yt_idv.scene_annotations.base_annotation import SceneAnnotation
 from yt_idv.scene_annotations.box import BoxAnnotation
 from yt_idv.scene_annotations.text import TextAnnotation
@@ -37,8 +38,11 @@ class SceneGraph(traitlets.HasTraits):
     fb = traitlets.Instance(Framebuffer, allow_none=True)
     input_captured_mouse = traitlets.Bool(False)
     input_captured_keyboard = traitlets.Bool(False)
+    quality_controller = traitlets.Instance(QualityController, allow_none=True)
+    # the elements, viewport and target of the last frame rendered
+    _frame_key = None
 
-    def add_volume(self, data_source, field_name, no_ghost=False):
+    def add_volume(self, data_source, field_name, no_ghost=False, cache=None):
         """
         Add a BlockRendering component to volume render.
 
@@ -48,8 +52,11 @@ class SceneGraph(traitlets.HasTraits):
         Parameters
         ----------
         data_source: yt data container such as a sphere, region, etc
-        field_name: The field to volume render
+        field_name: The field to volume render, or a list of up to four fields
+            to choose from with the component's field_index
         no_ghost: Should we save time by skipping ghost zone generation
+        cache: An optional BlockCache to load processed blocks from, or store
+            them in
 
         Returns
         -------
@@ -57,7 +64,7 @@ class SceneGraph(traitlets.HasTraits):
         component: BlockRendering
 
         """
-        self.data_objects.append(BlockCollection(data_source=data_source))
+        self.data_objects.append(BlockCollection(data_source=data_source, cache=cache))
         self.data_objects[-1].add_data(field_name, no_ghost=no_ghost)
         self.components.append(BlockRendering(data=self.data_objects[-1]))
         return self.components[-1]  # Only the rendering object
@@ -127,40 +134,107 @@ class SceneGraph(traitlets.HasTraits):
         for c in self:
             c.fb = Framebuffer()
 
-    def render(self):
+    def render(self, redraw=False):
         """
-        Render the scene into its local framebuffer.
+        Render the scene into its local framebuffer, or the current one if it
+        has none.
+
+        Frames in which no element has changed since the last one are not
+        drawn at all, as the target still holds the last frame.
+
+        Parameters
+        ----------
+        redraw : bool
+            Draw every element regardless, for targets that may not hold the
+            last frame any more, such as a window that was just cleared.
 
         Returns
         -------
         Nothing, but the new image can be accessed.
 
         """
-        origin_x, origin_y, width, height = GL.glGetIntegerv(GL.GL_VIEWPORT)
+        if self.quality_controller is not None:
+            self.quality_controller.start_frame()
+        for data in self.data_objects:
+            if data.has_pending_uploads:
+                data.upload_pending(self.camera)
+                # colormap bounds follow the data as it streams in
+                for component in self.components:
+                    if component.data is data:
+                        component._cmap_bounds_invalid = True
+                        component._invalidate_first_pass()
+        viewport = tuple(GL.glGetIntegerv(GL.GL_VIEWPORT))
+        elements = list(self)
+        viewports = [self._element_viewport(element, viewport) for element in elements]
+        # the target still holds the last frame, which only needs drawing
+        # again once something in it has changed
+        key = (
+            tuple(id(element) for element in elements),
+            viewport,
+            None if self.fb is None else id(self.fb),
+        )
+        if (
+            not redraw
+            and key == self._frame_key
+            and not any(
+                element._needs_render(self, element_viewport)
+                for element, element_viewport in zip(elements, viewports)
+            )
+        ):
+            if self.quality_controller is not None:
+                self.quality_controller.cancel_frame()
+            return
+        self._frame_key = key
+        if self.quality_controller is not None:
+            self.quality_controller.begin_timing()
         with self.bind_buffer():
             GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
-        for element in self:
+        for element, element_viewport in zip(elements, viewports):
+            GL.glViewport(*element_viewport)
             # If we need to clear the region, we need to use the scissor test
-            db = element.display_bounds
-            new_origin_x = origin_x + width * db[0]
-            new_origin_y = origin_y + height * db[2]
-            new_width = (db[1] - db[0]) * width
-            new_height = (db[3] - db[2]) * height
-            GL.glViewport(
-                int(new_origin_x), int(new_origin_y), int(new_width), int(new_height)
-            )
             if element.clear_region:
                 GL.glEnable(GL.GL_SCISSOR_TEST)
-                GL.glScissor(
-                    int(new_origin_x),
-                    int(new_origin_y),
-                    int(new_width),
-                    int(new_height),
-                )
+                GL.glScissor(*element_viewport)
                 GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
                 GL.glDisable(GL.GL_SCISSOR_TEST)
             element.run_program(self)
-        GL.glViewport(origin_x, origin_y, width, height)
+        GL.glViewport(*viewport)
+        if self.quality_controller is not None:
+            self.quality_controller.end_frame()
+
+    @staticmethod
+    def _element_viewport(element, viewport):
+        # the part of viewport that element is drawn into, its display_bounds
+        origin_x, origin_y, width, height = viewport
+        db = element.display_bounds
+        return (
+            int(origin_x + width * db[0]),
+            int(origin_y + height * db[2]),
+            int((db[1] - db[0]) * width),
+            int((db[3] - db[2]) * height),
+        )
+
+    @property
+    def render_scale(self):
+        """The fraction of the full resolution that components render at."""
+        if self.quality_controller is None:
+            return 1.0
+        return self.quality_controller.render_scale
+
+    @property
+    def sample_scale(self):
+        """The factor that the sampling rate of components is scaled by."""
+        if self.quality_controller is None:
+            return 1.0
+        return self.quality_controller.sample_scale
+
+    @property
+    def has_pending_uploads(self):
+        """
+        Whether any of the data objects still has data to upload, in which
+        case rendering again will show more of the scene.
+        """
+        return any(data.has_pending_uploads for data in self.data_objects)
 
     @contextlib.contextmanager
     def bind_buffer(self):
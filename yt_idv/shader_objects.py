@@ -6,6 +6,7 @@ in Interactive Data Visualization
 import contextlib
 import ctypes
 import os
+import weakref
 from collections import OrderedDict
 from typing import List, Optional, Tuple
 
@@ -62,6 +63,19 @@ void main() {
 }
 
 
+def _same_value(old, new, mask=None):
+    # whether a cached uniform value is identical to a new one, for scalars and
+    # arrays alike; arrays are compared into mask, which has their shape, so
+    # as not to allocate
+    if isinstance(old, np.ndarray) or isinstance(new, np.ndarray):
+        if not (isinstance(old, np.ndarray) and isinstance(new, np.ndarray)):
+            return False
+        if old.shape != new.shape or old.dtype != new.dtype:
+            return False
+        return bool(np.equal(old, new, out=mask).all())
+    return type(old) is type(new) and old == new
+
+
 class ShaderProgram:
     """
     Wrapper class that compiles and links vertex and fragment shaders
@@ -95,6 +109,14 @@ class ShaderProgram:
         geometry_shader=None,
         preprocessor_defs=None,
     ):
+        self._uniform_locations = {}
+        self._uniform_values = {}
+        self._uniform_masks = {}
+        self._attribute_locations = {}
+        # the vertex arrays that recorded their layout for this program, which
+        # goes stale once it is relinked or deleted
+        self._vertex_arrays = weakref.WeakSet()
+        self.program = None
         # Don't allow just one.  Either neither or both.
         if vertex_shader is None and fragment_shader is None:
             pass
@@ -120,6 +142,7 @@ class ShaderProgram:
         if preprocessor_defs is None:
             preprocessor_defs = PreprocessorDefinitionState()
 
+        self._release_vertex_arrays()
         # We allow an optional geometry shader, but not tesselation (yet?)
         self.program = GL.glCreateProgram()
         if not isinstance(vertex_shader, Shader):
@@ -160,6 +183,14 @@ class ShaderProgram:
         # First get all of the uniforms
         self.uniforms = {}
         self.attributes = {}
+        # the location of each uniform, by name and, for arrays, by the name
+        # of the array; -1 for uniforms the program does not use. The last
+        # value set for each uniform is kept as well, as the program holds on
+        # to it until it is set again.
+        self._uniform_locations = {}
+        self._uniform_values = {}
+        self._uniform_masks = {}
+        self._attribute_locations = {}
 
         if not bool(GL.glGetProgramInterfaceiv):
             return
@@ -174,7 +205,12 @@ class ShaderProgram:
                 # until an upstream fix is in.
                 name = name.tobytes().rstrip(b"\000")
             gl_type = num_to_const[gl_type]
-            self.uniforms[name.decode("utf-8")] = (size, gl_type)
+            name = name.decode("utf-8")
+            self.uniforms[name] = (size, gl_type)
+            location = GL.glGetUniformLocation(self.program, name)
+            self._uniform_locations[name] = location
+            if name.endswith("[0]"):
+                self._uniform_locations[name[:-3]] = location
 
         n_attrib = GL.glGetProgramInterfaceiv(
             self.program, GL.GL_PROGRAM_INPUT, GL.GL_ACTIVE_RESOURCES
@@ -188,10 +224,20 @@ class ShaderProgram:
             gl_const = num_to_const[gl_type[0]]
             self.attributes[name[: length[0]].decode("utf-8")] = (size[0], gl_const)
 
+    def _release_vertex_arrays(self):
+        for vertex_array in list(self._vertex_arrays):
+            vertex_array._release_program(self.program)
+        self._vertex_arrays.clear()
+
     def delete_program(self):
         if self.program is not None:
+            self._release_vertex_arrays()
             GL.glDeleteProgram(self.program)
             self.program = None
+            self._uniform_locations = {}
+            self._uniform_values = {}
+            self._uniform_masks = {}
+            self._attribute_locations = {}
 
     def _guess_uniform_func(self, value):
         # We make a best-effort guess.
@@ -250,14 +296,54 @@ class ShaderProgram:
 
         return _func
 
+    def _attribute_location(self, name):
+        loc = self._attribute_locations.get(name)
+        if loc is None:
+            loc = GL.glGetAttribLocation(self.program, name)
+            self._attribute_locations[name] = loc
+        return loc
+
+    def _uniform_location(self, name):
+        loc = self._uniform_locations.get(name)
+        if loc is None:
+            # not found by introspection, so ask the driver once
+            loc = GL.glGetUniformLocation(self.program, name)
+            self._uniform_locations[name] = loc
+        return loc
+
     def _set_uniform(self, name, value):
+        """Set a uniform, returning its location, which is -1 for uniforms
+        the program does not use. Values the program already holds are not
+        set again."""
+        loc = self._uniform_location(name)
+        if loc < 0:
+            return loc
+        # skip values the program already holds
+        old = self._uniform_values.get(name)
+        if old is not None and _same_value(old, value, self._uniform_masks[name]):
+            return loc
         # We need to figure out how to pass it in.
         if name not in self._uniform_funcs:
             self._uniform_funcs[name] = self._guess_uniform_func(value)
-        loc = GL.glGetUniformLocation(self.program, name)
-        if loc < 0:
-            return -1
-        return self._uniform_funcs[name](loc, value)
+        self._uniform_funcs[name](loc, value)
+        self._cache_uniform(name, old, value)
+        return loc
+
+    def _cache_uniform(self, name, old, value):
+        # arrays are copied, as callers may reuse their buffers, into a buffer
+        # kept for each uniform and only reallocated when its shape changes
+        if not isinstance(value, np.ndarray):
+            self._uniform_values[name] = value
+            self._uniform_masks[name] = None
+        elif (
+            isinstance(old, np.ndarray)
+            and old.shape == value.shape
+            and old.dtype == value.dtype
+        ):
+            np.copyto(old, value)
+        else:
+            self._uniform_values[name] = np.array(value)
+            self._uniform_masks[name] = np.empty(value.shape, dtype="bool")
 
     @contextlib.contextmanager
     def enable(self):
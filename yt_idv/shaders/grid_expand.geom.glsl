@@ -4,6 +4,10 @@ layout ( triangle_strip, max_vertices = 14 ) out;
 flat in vec3 vdx[];
 flat in vec3 vleft_edge[];
 flat in vec3 vright_edge[];
+flat in ivec3 vtexture_offset[];
+flat in ivec3 vtexture_dims[];
+flat in int vunmasked[];
+flat in vec2 vsample_range[];
 
 #ifdef SPHERICAL_GEOM
 flat in vec3 vleft_edge_cart[];
@@ -29,6 +33,8 @@ flat in mat4 vinverse_pmvm[];
 flat in vec4 vv_model[];
 
 flat out ivec3 texture_offset;
+flat out ivec3 texture_dims;
+flat out int unmasked;
 
 // https://stackoverflow.com/questions/28375338/cube-using-single-gl-triangle-strip
 // suggests that the triangle strip we want for the cube is
@@ -49,6 +55,10 @@ uniform int aindex[14] = int[](6, 7, 4, 5, 1, 7, 3, 6, 2, 4, 0, 1, 2, 3);
 
 void main() {
 
+    // blocks without any values in the visible range are empty space
+    if (skip_empty == 1 && (vsample_range[0].y < visible_min ||
+                            vsample_range[0].x > visible_max)) return;
+
     vec4 center = gl_in[0].gl_Position;
     vec3 width, le;
     vec4 newPos;
@@ -82,7 +92,9 @@ void main() {
 
         dx = vdx[0];
         v_model = newPos;
-        texture_offset = ivec3(0);
+        texture_offset = vtexture_offset[0];
+        texture_dims = vtexture_dims[0];
+        unmasked = vunmasked[0];
         EmitVertex();
     }
 
@@ -5,7 +5,15 @@ in vec4 model_vertex;
 in vec3 in_dx;
 in vec3 in_left_edge;
 in vec3 in_right_edge;
-
+// the offset and dimensions of this block's data within its texture, which
+// may be an atlas shared with other blocks
+in vec3 in_texture_offset;
+in vec3 in_texture_dims;
+// 1.0 if none of this block's cells are masked out
+in float in_unmasked;
+// the range of values that can be sampled from each field of this block
+in vec4 in_sample_min;
+in vec4 in_sample_max;
 
 
 flat out vec4 vv_model;
@@ -15,6 +23,10 @@ flat out mat4 vinverse_pmvm;
 flat out vec3 vdx;
 flat out vec3 vleft_edge;
 flat out vec3 vright_edge;
+flat out ivec3 vtexture_offset;
+flat out ivec3 vtexture_dims;
+flat out int vunmasked;
+flat out vec2 vsample_range;
 
 #ifdef NONCARTESIAN_GEOM
 // pre-computed cartesian le, re
@@ -43,6 +55,10 @@ void main()
     vdx = vec3(in_dx);
     vleft_edge = vec3(in_left_edge);
     vright_edge = vec3(in_right_edge);
+    vtexture_offset = ivec3(in_texture_offset);
+    vtexture_dims = ivec3(in_texture_dims);
+    vunmasked = int(in_unmasked);
+    vsample_range = vec2(in_sample_min[field_index], in_sample_max[field_index]);
 
     #ifdef NONCARTESIAN_GEOM
     // cartesian bounding boxes
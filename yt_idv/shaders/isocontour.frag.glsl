@@ -6,6 +6,8 @@ flat in mat4 inverse_proj;
 flat in mat4 inverse_mvm;
 flat in mat4 inverse_pmvm;
 flat in ivec3 texture_offset;
+flat in ivec3 texture_dims;
+flat in int unmasked;
 out vec4 output_color;
 
 bool within_bb(vec3 pos)
@@ -17,17 +19,45 @@ bool within_bb(vec3 pos)
 
 vec3 get_offset_texture_position(sampler3D tex, vec3 tex_curr_pos)
 {
+    // texture_dims are the dimensions of this block's data, which start at
+    // texture_offset within the (possibly shared) texture
     ivec3 texsize = textureSize(tex, 0); // lod (mipmap level) always 0?
-    return (tex_curr_pos * texsize + texture_offset) / texsize;
+    return (tex_curr_pos * texture_dims + texture_offset) / texsize;
+}
+
+vec3 get_offset_bitmap_position(sampler3D tex, vec3 tex_curr_pos)
+{
+    // the bitmap is cell-centered, so has one fewer value along each axis
+    ivec3 texsize = textureSize(tex, 0);
+    return (tex_curr_pos * (texture_dims - 1) + texture_offset) / texsize;
+}
+
+float sample_bitmap(vec3 tex_curr_pos)
+{
+    // blocks without any masked cells skip the bitmap lookup entirely
+    if (unmasked == 1) return 1.0;
+    vec3 offset_bmap_pos = get_offset_bitmap_position(bitmap_tex, tex_curr_pos);
+    return texture(bitmap_tex, offset_bmap_pos).r;
+}
+
+vec3 sample_data_texture(vec3 offset_pos)
+{
+    // multi-field textures hold one field per channel, see field_index, and
+    // data textures may be stored log-scaled, see ds_log_ratio. Isocontours
+    // are always sampled from the full resolution data.
+    float value = textureLod(ds_tex[0], offset_pos, 0.0)[field_index];
+    if (ds_log_ratio > 1.0) {
+        value = (pow(ds_log_ratio, value) - 1.0) / (ds_log_ratio - 1.0);
+    }
+    return vec3(value, 0.0, 0.0);
 }
 
 bool sample_texture(vec3 tex_curr_pos, inout vec4 curr_color, float tdelta,
                     float t, vec3 dir)
 {
     vec3 offset_pos = get_offset_texture_position(ds_tex[0], tex_curr_pos);
-    vec3 tex_sample = texture(ds_tex[0], offset_pos).rgb;
-    vec3 offset_bmap_pos = get_offset_texture_position(bitmap_tex, tex_curr_pos);
-    float map_sample = texture(bitmap_tex, offset_bmap_pos).r;
+    vec3 tex_sample = sample_data_texture(offset_pos);
+    float map_sample = sample_bitmap(tex_curr_pos);
     if ((map_sample > 0.0) && (length(curr_color.rgb) < length(tex_sample))) {
         curr_color = vec4(tex_sample, 1.0);
     }
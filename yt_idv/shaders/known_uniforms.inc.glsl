@@ -21,6 +21,14 @@ uniform float tf_log;
 uniform float tf_max;
 uniform float tf_min;
 
+// Min/max reduction of a framebuffer: the texture of the previous level and
+// its size in texels, whether this is the first level, reading the first pass
+// framebuffer, and whether to reduce its depth rather than its red channel
+uniform sampler2D reduce_tex;
+uniform ivec2 reduce_size;
+uniform int reduce_first;
+uniform int reduce_depth;
+
 // Control of RGB channel information
 uniform int channel;
 
@@ -47,9 +55,30 @@ uniform sampler2D fb_tex;
 uniform sampler2D tf_tex;
 uniform sampler3D bitmap_tex;
 uniform sampler3D ds_tex[6];
+// ratio of the max to min value of log-scaled data textures, 0 if linear
+uniform float ds_log_ratio;
+// the channel of ds_tex holding the field being drawn
+uniform int field_index;
+// blocks with no values in (visible_min, visible_max) are skipped if
+// skip_empty is 1
+uniform int skip_empty;
+uniform float visible_min;
+uniform float visible_max;
+// the (min, max) of the values in each macro-cell of macrocell_size cells
+// along each axis of a block, with the macro-cells of each field stacked
+// along z; macro-cells are not used if macrocell_size is 0
+uniform sampler3D macrocell_tex;
+uniform int macrocell_size;
+// the number of downsampled levels below the data of each block, 0 if none,
+// and the number of levels by which rays sample coarser than the projected
+// size of a block calls for
+uniform int mipmap_levels;
+uniform float mipmap_bias;
 
 // ray tracing control
 uniform float sample_factor;
+// rays stop once their accumulated alpha reaches this, unless it is 0
+uniform float termination_alpha;
 
 // curve drawing control
 uniform vec4 curve_rgba;
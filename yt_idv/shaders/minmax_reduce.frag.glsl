@@ -0,0 +1,31 @@
+// Reduces blocks of REDUCE_FACTOR x REDUCE_FACTOR texels of the previous
+// level to their (min, max, number of covered pixels).  The first level reads
+// the first pass framebuffer, where pixels with an alpha of zero are not
+// covered, and the value of each pixel is either its red channel or its depth.
+
+#define REDUCE_FACTOR 4
+
+out vec4 color;
+
+void main(){
+   ivec2 start = ivec2(gl_FragCoord.xy) * REDUCE_FACTOR;
+   ivec2 end = min(start + REDUCE_FACTOR, reduce_size);
+   vec3 reduced = vec3(INFINITY, -INFINITY, 0.0);
+   for (int j = start.y; j < end.y; j++) {
+      for (int i = start.x; i < end.x; i++) {
+         ivec2 texel = ivec2(i, j);
+         if (reduce_first == 1) {
+            if (texelFetch(fb_tex, texel, 0).a <= 0.0) continue;
+            float value = texelFetch(fb_tex, texel, 0).r;
+            if (reduce_depth == 1) value = texelFetch(db_tex, texel, 0).r;
+            reduced = vec3(min(reduced.x, value), max(reduced.y, value),
+                           reduced.z + 1.0);
+         } else {
+            vec4 previous = texelFetch(reduce_tex, texel, 0);
+            reduced = vec3(min(reduced.x, previous.r), max(reduced.y, previous.g),
+                           reduced.z + previous.b);
+         }
+      }
+   }
+   color = vec4(reduced, 1.0);
+}
@@ -2,6 +2,8 @@ in vec4 model_vertex; // The location of the vertex in model space
 in vec3 in_dx;
 in vec3 in_left_edge;
 in vec3 in_right_edge;
+// the position of the first instance of a draw call within the texture
+uniform int instance_offset;
 out vec4 v_model;
 flat out mat4 inverse_proj;
 flat out mat4 inverse_mvm;
@@ -10,6 +12,8 @@ flat out vec3 dx;
 flat out vec3 left_edge;
 flat out vec3 right_edge;
 flat out ivec3 texture_offset;
+flat out ivec3 texture_dims;
+flat out int unmasked;
 
 void main()
 {
@@ -23,5 +27,7 @@ void main()
     dx = vec3(in_dx);
     left_edge = vec3(in_left_edge);
     right_edge = vec3(in_right_edge);
-    texture_offset = ivec3(0, 0, gl_InstanceID);
+    texture_offset = ivec3(0, 0, instance_offset + gl_InstanceID);
+    texture_dims = textureSize(ds_tex[0], 0);
+    unmasked = 0;
 }
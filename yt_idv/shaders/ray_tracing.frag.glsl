@@ -6,6 +6,8 @@ flat in mat4 inverse_proj;
 flat in mat4 inverse_mvm;
 flat in mat4 inverse_pmvm;
 flat in ivec3 texture_offset;
+flat in ivec3 texture_dims;
+flat in int unmasked;
 
 #ifdef NONCARTESIAN_GEOM
 flat in vec3 left_edge_cart;
@@ -15,6 +17,9 @@ flat in vec3 dx_cart;
 
 out vec4 output_color;
 
+// the mipmap level the data texture is sampled from, see block_sample_lod
+int sample_lod = 0;
+
 bool within_bb(vec3 pos)
 {
     bvec3 left =  greaterThanEqual(pos, left_edge);
@@ -46,8 +51,90 @@ vec3 cart_to_sphere_vec3(vec3 v) {
 
 vec3 get_offset_texture_position(sampler3D tex, vec3 tex_curr_pos)
 {
-    ivec3 texsize = textureSize(tex, 0); // lod (mipmap level) always 0?
-    return (tex_curr_pos * texsize + texture_offset) / texsize;
+    // texture_dims are the dimensions of this block's data, which start at
+    // texture_offset within the (possibly shared) texture
+    if (sample_lod > 0) {
+        // the same position on a downsampled level, whose first and last
+        // vertices also lie on the faces of the block
+        vec3 dims = vec3(texture_dims);
+        vec3 level_dims = vec3(textureSize(tex, sample_lod));
+        vec3 frac = (tex_curr_pos * dims - 0.5) / (dims - 1.0);
+        return (frac * (level_dims - 1.0) + 0.5) / level_dims;
+    }
+    ivec3 texsize = textureSize(tex, 0);
+    return (tex_curr_pos * texture_dims + texture_offset) / texsize;
+}
+
+int block_sample_lod(vec3 le, vec3 re, vec3 cell_width)
+{
+    // The mipmap level whose vertex spacing best matches the width of a
+    // pixel at the point of the block nearest the camera, offset by
+    // mipmap_bias, within the levels this block has.
+    if (mipmap_levels == 0) return 0;
+    float distance = length(clamp(camera_pos, le, re) - camera_pos);
+    // clip-space w at that distance, for perspective and orthographic
+    // projections alike
+    float w = distance * abs(projection[2][3]) + projection[3][3];
+    float pixel = 2.0 * w / (projection[1][1] * viewport.w);
+    float min_width = min(min(cell_width.x, cell_width.y), cell_width.z);
+    int lod = int(floor(log2(max(pixel / min_width, 1e-30)) + mipmap_bias));
+    // levels stop once the block is a single vertex along every axis
+    int max_dim = max(max(texture_dims.x, texture_dims.y), texture_dims.z);
+    int n_levels = 0;
+    while (n_levels < mipmap_levels && (max_dim >> (n_levels + 1)) > 0) {
+        n_levels++;
+    }
+    return clamp(lod, 0, n_levels);
+}
+
+vec3 get_offset_bitmap_position(sampler3D tex, vec3 tex_curr_pos)
+{
+    // the bitmap is cell-centered, so has one fewer value along each axis
+    ivec3 texsize = textureSize(tex, 0);
+    return (tex_curr_pos * (texture_dims - 1) + texture_offset) / texsize;
+}
+
+float sample_bitmap(vec3 tex_curr_pos)
+{
+    // blocks without any masked cells skip the bitmap lookup entirely
+    if (unmasked == 1) return 1.0;
+    vec3 offset_bmap_pos = get_offset_bitmap_position(bitmap_tex, tex_curr_pos);
+    return texture(bitmap_tex, offset_bmap_pos).r;
+}
+
+vec3 sample_data_texture(vec3 offset_pos)
+{
+    // multi-field textures hold one field per channel, see field_index, and
+    // data textures may be stored log-scaled, see ds_log_ratio
+    float value = textureLod(ds_tex[0], offset_pos, float(sample_lod))[field_index];
+    if (ds_log_ratio > 1.0) {
+        value = (pow(ds_log_ratio, value) - 1.0) / (ds_log_ratio - 1.0);
+    }
+    return vec3(value, 0.0, 0.0);
+}
+
+float empty_macrocell_exit(vec3 pos, vec3 dir)
+{
+    // The distance along the ray from pos to where it leaves the macro-cell
+    // containing pos if none of that macro-cell's values are within
+    // (visible_min, visible_max), and -1 otherwise.
+    ivec3 n_cells = texture_dims - 1;
+    int n_macro_z = (n_cells.z + macrocell_size - 1) / macrocell_size;
+    // positions in units of cells, as the data texture is sampled in main()
+    vec3 scale = vec3(n_cells) / (vec3(texture_dims) * dx);
+    ivec3 cell = clamp(ivec3(floor((pos - left_edge) * scale)), ivec3(0),
+                       n_cells - 1);
+    ivec3 macrocell = cell / macrocell_size;
+    ivec3 texel = ivec3(macrocell.xy, macrocell.z + field_index * n_macro_z);
+    vec2 value_range = texelFetch(macrocell_tex, texel, 0).rg;
+    if (value_range.y >= visible_min && value_range.x <= visible_max) {
+        return -1.0;
+    }
+    vec3 lower = left_edge + vec3(macrocell * macrocell_size) / scale;
+    vec3 upper = left_edge + vec3(min((macrocell + 1) * macrocell_size,
+                                      n_cells)) / scale;
+    vec3 t_exit = (mix(lower, upper, greaterThan(dir, vec3(0.0))) - pos) / dir;
+    return max(min(min(t_exit.x, t_exit.y), t_exit.z), 0.0);
 }
 
 bool sample_texture(vec3 tex_curr_pos, inout vec4 curr_color, float tdelta,
@@ -83,12 +170,19 @@ void main()
     tl = (left_edge_cart - camera_pos)*idir;
     tr = (right_edge_cart - camera_pos)*idir;
     dx_effective = dx_cart;
+    sample_lod = block_sample_lod(left_edge_cart, right_edge_cart, dx_cart);
     #else
     tl = (left_edge - camera_pos)*idir;
     tr = (right_edge - camera_pos)*idir;
     dx_effective = dx;
+    sample_lod = block_sample_lod(left_edge, right_edge, dx);
     #endif
     vec3 step_size = dx_effective/ sample_factor;
+    if (sample_lod > 0) {
+        // steps span the vertex spacing of the level sampled from
+        vec3 level_dims = vec3(textureSize(ds_tex[0], sample_lod));
+        step_size *= vec3(texture_dims - 1) / max(level_dims - 1.0, 1.0);
+    }
 
     vec3 tmin, tmax;
     bvec3 temp_x, temp_y;
@@ -136,6 +230,22 @@ void main()
 
     while(t <= t1) {
 
+        #ifndef NONCARTESIAN_GEOM
+        if (skip_empty == 1 && macrocell_size > 0 && sample_lod == 0) {
+            // leap over empty macro-cells, stepping as below so that the
+            // ray lands on exactly the same samples
+            float leap = empty_macrocell_exit(ray_position, dir);
+            if (leap >= 0.0) {
+                int n_steps = max(int(ceil(leap / tdelta)), 1);
+                for (int i = 0; i < n_steps; i++) {
+                    t += tdelta;
+                    ray_position += tdelta * dir;
+                }
+                continue;
+            }
+        }
+        #endif
+
         // texture position
         #ifdef SPHERICAL_GEOM
         ray_position_native = cart_to_sphere_vec3(ray_position);
@@ -161,6 +271,9 @@ void main()
         t += tdelta;
         ray_position += tdelta * dir;
 
+        // with front-to-back compositing, nothing further along the ray
+        // shows through once it is nearly opaque
+        if (termination_alpha > 0.0 && curr_color.a >= termination_alpha) break;
     }
 
     output_color = cleanup_phase(curr_color, dir, t0, t1);
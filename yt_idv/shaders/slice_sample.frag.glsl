@@ -5,6 +5,9 @@ flat in vec3 right_edge;
 flat in mat4 inverse_proj;
 flat in mat4 inverse_mvm;
 flat in mat4 inverse_pmvm;
+flat in ivec3 texture_offset;
+flat in ivec3 texture_dims;
+flat in int unmasked;
 out vec4 output_color;
 
 bool within_bb(vec3 pos)
@@ -59,8 +62,19 @@ void main()
     // But, we actually need it to be 0 + normalized dx/2 to 1 - normalized dx/2
     tex_curr_pos = (tex_curr_pos * (1.0 - ndx)) + ndx/2.0;
 
-    float map_sample = texture(bitmap_tex, tex_curr_pos).r;
-    if (!(map_sample > 0.0)) discard;
+    // offset into the (possibly shared) textures holding this block
+    if (unmasked != 1) {
+        vec3 bmap_pos = (tex_curr_pos * (texture_dims - 1) + texture_offset)
+                        / textureSize(bitmap_tex, 0);
+        float map_sample = texture(bitmap_tex, bmap_pos).r;
+        if (!(map_sample > 0.0)) discard;
+    }
 
-    output_color = texture(ds_tex[0], tex_curr_pos);
+    vec3 data_pos = (tex_curr_pos * texture_dims + texture_offset)
+                    / textureSize(ds_tex[0], 0);
+    float value = textureLod(ds_tex[0], data_pos, 0.0)[field_index];
+    if (ds_log_ratio > 1.0) {
+        value = (pow(ds_log_ratio, value) - 1.0) / (ds_log_ratio - 1.0);
+    }
+    output_color = vec4(value, 0.0, 0.0, 1.0);
 }
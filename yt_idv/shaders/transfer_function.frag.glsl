@@ -1,28 +1,8 @@
 bool sample_texture(vec3 tex_curr_pos, inout vec4 curr_color, float tdelta,
                     float t, vec3 dir)
 {
-    float tm = tf_min;
-    float tp = tf_max;
     vec4 tf_sample;
-
-    vec3 offset_bmap_pos = get_offset_texture_position(bitmap_tex, tex_curr_pos);
-    float map_sample = texture(bitmap_tex, offset_bmap_pos).r;
-    if (!(map_sample > 0.0)) return false;
-
-    vec3 offset_pos = get_offset_texture_position(ds_tex[0], tex_curr_pos);
-    float tex_sample = texture(ds_tex[0], offset_pos).r;
-
-    if (tf_log > 0.5) {
-       if(tex_sample <= 0.0) return false;
-       tex_sample = log(tex_sample);
-       tm = log(tm);
-       tp = log(tp);
-    }
-
-    if(tex_sample < tm) return false;
-    if(tex_sample > tp) return false;
-    vec2 tex_sample_norm = vec2((tex_sample - tm)/(tp - tm), 0.5);
-    tf_sample = texture(tf_tex, tex_sample_norm);
+    if (!sample_transfer_function(tex_curr_pos, tf_sample)) return false;
     float dt = length(tdelta * dir);
     float ta = max((1.0f - dt * tf_sample.a), 0.0);
 
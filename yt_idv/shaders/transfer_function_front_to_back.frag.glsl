@@ -0,0 +1,17 @@
+bool sample_texture(vec3 tex_curr_pos, inout vec4 curr_color, float tdelta,
+                    float t, vec3 dir)
+{
+    vec4 tf_sample;
+    if (!sample_transfer_function(tex_curr_pos, tf_sample)) return false;
+    float dt = length(tdelta * dir);
+
+    // samples are composited front to back: each one lies behind, and is
+    // attenuated by, everything accumulated along the ray so far
+    curr_color += max(1.0 - curr_color.a, 0.0) * dt * tf_sample;
+    return true;
+}
+
+vec4 cleanup_phase(in vec4 curr_color, in vec3 dir, in float t0, in float t1)
+{
+  return curr_color;
+}
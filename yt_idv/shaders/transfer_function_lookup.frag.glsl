@@ -0,0 +1,26 @@
+bool sample_transfer_function(vec3 tex_curr_pos, out vec4 tf_sample)
+{
+    // Looks up the transfer function at a sample, returning false for
+    // samples that are masked out or outside of (tf_min, tf_max).
+    float tm = tf_min;
+    float tp = tf_max;
+
+    float map_sample = sample_bitmap(tex_curr_pos);
+    if (!(map_sample > 0.0)) return false;
+
+    vec3 offset_pos = get_offset_texture_position(ds_tex[0], tex_curr_pos);
+    float tex_sample = sample_data_texture(offset_pos).r;
+
+    if (tf_log > 0.5) {
+       if(tex_sample <= 0.0) return false;
+       tex_sample = log(tex_sample);
+       tm = log(tm);
+       tp = log(tp);
+    }
+
+    if(tex_sample < tm) return false;
+    if(tex_sample > tp) return false;
+    vec2 tex_sample_norm = vec2((tex_sample - tm)/(tp - tm), 0.5);
+    tf_sample = texture(tf_tex, tex_sample_norm);
+    return true;
+}
@@ -7,6 +7,7 @@ from imgui.integrations.pyglet import create_renderer
 from yt.visualization.image_writer import write_bitmap, write_image
 
 from .opengl_support import Texture2D
+from .quality_controller import QualityController
 
 
 class SimpleGUI:
@@ -43,7 +44,7 @@ class SimpleGUI:
             if imgui.button("Save Snapshot"):
                 # Call render again, since we're in the middle of overlaying
                 # some stuff and we want a clean scene snapshot
-                scene.render()
+                scene.render(redraw=True)
                 write_bitmap(
                     scene.image[:, :, :3],
                     self.snapshot_format.format(count=self.snapshot_count),
@@ -51,7 +52,7 @@ class SimpleGUI:
                 self.snapshot_count += 1
             if imgui.tree_node("Debug"):
                 if imgui.button("Save Depth"):
-                    scene.render()
+                    scene.render(redraw=True)
                     write_image(
                         scene.depth,
                         self.snapshot_format.format(count=self.snapshot_count),
@@ -82,6 +83,21 @@ class SimpleGUI:
         if _:
             scene.camera.scroll_delta = 10**scroll_delta
             changed = True
+        _, adaptive = imgui.checkbox(
+            "Adaptive quality", scene.quality_controller is not None
+        )
+        if _:
+            scene.quality_controller = QualityController() if adaptive else None
+            changed = True
+        if scene.quality_controller is not None:
+            _, target = imgui.slider_float(
+                "Target frame time (ms)",
+                scene.quality_controller.target_frame_ms,
+                5.0,
+                200.0,
+            )
+            if _:
+                scene.quality_controller.target_frame_ms = target
         with scene.camera.hold_trait_notifications():
             for attr in ("position", "up", "focus"):
                 arr = getattr(scene.camera, attr)
@@ -3,6 +3,7 @@ import os
 
 import pytest
 import yt
+import yt.testing
 from pytest_html import extras as html_extras
 
 import yt_idv
@@ -33,3 +34,37 @@ def osmesa_empty_rc():
     rc = yt_idv.render_context("osmesa", width=1024, height=1024)
     yield rc
     rc.osmesa.OSMesaDestroyContext(rc.context)
+
+
+@pytest.fixture()
+def osmesa_block_scene():
+    """Return a function that makes an OSMesa context with a BlockRendering of
+    a "fake" AMR dataset, taking the field, the keyword arguments of the
+    BlockRendering and those of the BlockCollection, and returning the context
+    and the BlockRendering. Each call destroys the context of the previous
+    one, and the last is destroyed after the test.
+    """
+    # imported here, as OpenGL is only set up for OSMesa once pytest starts
+    from yt_idv.scene_components.blocks import BlockRendering
+    from yt_idv.scene_data.block_collection import BlockCollection
+
+    ds = yt.testing.fake_amr_ds()
+    contexts = []
+
+    def _block_scene(field="radius", rendering_kwargs=None, **collection_kwargs):
+        while contexts:
+            rc = contexts.pop()
+            rc.osmesa.OSMesaDestroyContext(rc.context)
+        rc = yt_idv.render_context("osmesa", width=256, height=256)
+        contexts.append(rc)
+        rc.add_scene(ds.all_data(), None)
+        block_coll = BlockCollection(data_source=ds.all_data(), **collection_kwargs)
+        block_coll.add_data(field, no_ghost=True)
+        rc.scene.data_objects.append(block_coll)
+        block_rendering = BlockRendering(data=block_coll, **(rendering_kwargs or {}))
+        rc.scene.components.append(block_rendering)
+        return rc, block_rendering
+
+    yield _block_scene
+    for rc in contexts:
+        rc.osmesa.OSMesaDestroyContext(rc.context)
@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+import pytest
+import yt.testing
+from yt.utilities.amr_kdtree.amr_kdtree import AMRKDTree
+
+from yt_idv.scene_data.block_cache import BlockCache
+from yt_idv.scene_data.block_collection import BlockCollection
+
+
+def _index(n):
+    return {name: np.arange(n) for name in BlockCache.index_arrays}
+
+
+def test_block_cache_roundtrip(tmp_path):
+    cache = BlockCache(directory=str(tmp_path))
+    rng = np.random.default_rng(0)
+    data = [rng.random((3, 4, 5)), rng.random((2, 2, 2))]
+    masks = [np.ones((2, 3, 4), dtype="u1"), np.zeros((1, 1, 1), dtype="u1")]
+
+    assert cache.load("abc") is None
+    cache.store("abc", data, masks, **_index(2))
+    entry = cache.load("abc")
+    for stored, loaded in zip(data + masks, entry["data"] + entry["masks"]):
+        assert isinstance(loaded.base, np.memmap)
+        assert np.array_equal(stored, loaded)
+    assert np.array_equal(entry["block_dims"], np.arange(2))
+
+
+def test_block_cache_eviction(tmp_path):
+    data = [np.zeros((10, 10, 10))]
+    masks = [np.zeros((9, 9, 9), dtype="u1")]
+    cache = BlockCache(directory=str(tmp_path), max_bytes=2**62)
+    cache.store("first", data, masks, **_index(1))
+    entry_size = sum(f.stat().st_size for f in os.scandir(tmp_path / "first"))
+
+    cache.max_bytes = 2 * entry_size
+    os.utime(tmp_path / "first", (0, 0))
+    cache.store("second", data, masks, **_index(1))
+    cache.load("first")
+    cache.store("third", data, masks, **_index(1))
+    assert sorted(os.listdir(tmp_path)) == ["first", "third"]
+
+
+def test_block_collection_cache(osmesa_empty_rc, tmp_path, monkeypatch):
+    ds = yt.testing.fake_amr_ds()
+    cache = BlockCache(directory=str(tmp_path))
+    collections = []
+    for _ in range(2):
+        block_coll = BlockCollection(data_source=ds.all_data(), cache=cache)
+        block_coll.add_data("radius", no_ghost=False)
+        collections.append(block_coll)
+        # the second collection must be built without generating any blocks
+        monkeypatch.setattr(AMRKDTree, "set_fields", pytest.fail)
+
+    fresh, cached = collections
+    assert len(os.listdir(tmp_path)) == 1
+    assert cached.min_val == fresh.min_val
+    assert cached.max_val == fresh.max_val
+    assert np.array_equal(cached.block_slices, fresh.block_slices)
+    for vbo_i, tex in fresh.texture_objects.items():
+        assert np.array_equal(tex.data, cached.texture_objects[vbo_i].data)
+        assert np.array_equal(
+            fresh.bitmap_objects[vbo_i].data, cached.bitmap_objects[vbo_i].data
+        )
+    for fresh_attr, cached_attr in zip(
+        fresh.vertex_array.attributes, cached.vertex_array.attributes
+    ):
+        assert np.array_equal(fresh_attr.data, cached_attr.data)
+
+
+def test_set_field_cache(osmesa_empty_rc, tmp_path, monkeypatch):
+    ds = yt.testing.fake_amr_ds()
+    cache = BlockCache(directory=str(tmp_path))
+    block_coll = BlockCollection(data_source=ds.all_data(), cache=cache)
+    block_coll.add_data("radius", no_ghost=False)
+    block_coll.set_field("Density")
+    assert len(os.listdir(tmp_path)) == 2
+    expected = {i: tex.data.copy() for i, tex in block_coll.texture_objects.items()}
+
+    # switching back and forth only reads from the cache
+    monkeypatch.setattr(AMRKDTree, "set_fields", pytest.fail)
+    block_coll.set_field("radius")
+    block_coll.set_field("Density")
+    for vbo_i, tex in block_coll.texture_objects.items():
+        assert np.array_equal(tex.data, expected[vbo_i])
+
+
+def test_lod_cache_set_field(osmesa_empty_rc, tmp_path):
+    ds = yt.testing.fake_amr_ds()
+    cache = BlockCache(directory=str(tmp_path))
+    block_coll = BlockCollection(data_source=ds.all_data(), cache=cache, lod=True)
+    block_coll.add_data("radius", no_ghost=False)
+    n_leaf_blocks = block_coll._n_leaf_blocks
+    assert block_coll.block_dims.shape[0] > n_leaf_blocks
+    block_coll.set_field("Density")
+
+    # the entry stored by set_field only holds the leaf blocks
+    reloaded = BlockCollection(data_source=ds.all_data(), cache=cache, lod=True)
+    reloaded.add_data("Density", no_ghost=False)
+    assert np.array_equal(reloaded.block_dims, block_coll.block_dims)
+    assert np.array_equal(reloaded.block_levels, block_coll.block_levels)
+    assert np.array_equal(reloaded.block_min_vals, block_coll.block_min_vals)
+    for fresh_attr, cached_attr in zip(
+        block_coll.vertex_array.attributes, reloaded.vertex_array.attributes
+    ):
+        assert np.array_equal(fresh_attr.data, cached_attr.data)
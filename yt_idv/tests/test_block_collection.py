@@ -0,0 +1,665 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+import traitlets
+import yt
+import yt.testing
+
+from yt_idv.cameras.trackball_camera import TrackballCamera
+from yt_idv.scene_data.block_collection import (
+    BlockCollection,
+    _brick_pyramid,
+    _macrocell_ranges,
+    _ordered_map,
+    _pack_blocks,
+    _restrict_data,
+)
+from yt_idv.scene_data.brick_hierarchy import BrickHierarchy
+
+
+@pytest.fixture()
+def ds_fake_amr():
+    return yt.testing.fake_amr_ds()
+
+
+def test_ordered_map_keeps_order():
+    items = list(range(50))
+    for n_workers in (1, 3):
+        result = list(_ordered_map(lambda x: x * x, items, n_workers))
+        assert result == [x * x for x in items]
+
+
+def test_parallel_block_preparation(osmesa_empty_rc, ds_fake_amr):
+    textures = []
+    for n_workers in (1, 4):
+        block_coll = BlockCollection(
+            data_source=ds_fake_amr.all_data(), n_workers=n_workers
+        )
+        block_coll.add_data("radius", no_ghost=True)
+        textures.append(block_coll)
+
+    serial, parallel = textures
+    assert serial.min_val == parallel.min_val
+    assert serial.max_val == parallel.max_val
+    assert set(serial.texture_objects) == set(parallel.texture_objects)
+    for vbo_i, tex in serial.texture_objects.items():
+        assert np.array_equal(tex.data, parallel.texture_objects[vbo_i].data)
+        assert np.array_equal(
+            serial.bitmap_objects[vbo_i].data, parallel.bitmap_objects[vbo_i].data
+        )
+
+
+def test_abs_nan_range():
+    from yt_idv.utilities.block_utilities import abs_nan_range
+
+    data = np.random.default_rng(0).normal(size=(5, 6, 7))
+    data[1, 2, 3] = np.nan
+    expected = np.nanmin(np.abs(data)), np.nanmax(np.abs(data))
+    assert np.allclose(abs_nan_range(data), expected)
+    assert np.allclose(abs_nan_range(np.asfortranarray(data)), expected)
+    assert np.allclose(abs_nan_range(data.astype("f4")), expected)
+    assert abs_nan_range(np.full((2, 2, 2), np.nan)) == (np.inf, -np.inf)
+
+
+def test_block_index_matches_slice_traverse(ds_fake_amr):
+    block_coll = BlockCollection(data_source=ds_fake_amr.all_data())
+    tiles = block_coll.data_source.tiles
+    tiles.set_fields(["radius"], [False], no_ghost=True)
+    le, re = block_coll._build_block_index(tiles)
+
+    for i, (g, node, (sl, dims, _)) in enumerate(tiles.slice_traverse()):
+        assert block_coll._node_blocks[node.node_id] == i
+        assert block_coll.grids_by_block[i] == g.id - g._id_offset
+        assert block_coll.block_levels[i] == g.Level
+        assert tuple(slice(*lr) for lr in block_coll.block_slices[i]) == sl
+        assert np.array_equal(block_coll.block_dims[i], dims)
+        assert np.array_equal(le[i], node.get_left_edge())
+        assert np.array_equal(re[i], node.get_right_edge())
+        vals = np.abs(node.data.my_data[0])
+        assert block_coll.block_min_vals[i] == np.nanmin(vals)
+        assert block_coll.block_max_vals[i] == np.nanmax(vals)
+
+    gids = block_coll.grids_by_block[block_coll.blocks_by_grid]
+    assert np.all(np.diff(gids) >= 0)
+
+
+def test_brick_hierarchy_order(ds_fake_amr):
+    block_coll = BlockCollection(data_source=ds_fake_amr.all_data())
+    tiles = block_coll.data_source.tiles
+    tiles.set_fields(["radius"], [False], no_ghost=True)
+    block_coll._build_block_index(tiles)
+    trunk = tiles.tree.trunk
+    hierarchy = BrickHierarchy.from_kd_tree(trunk, block_coll._node_blocks)
+    # with each node stored once
+    assert hierarchy.left.size == len({n.node_id for n in trunk.depth_traverse()})
+
+    viewpoints = np.random.default_rng(0).uniform(-0.5, 1.5, size=(20, 3))
+    # including viewpoints lying on split planes
+    viewpoints[:3] = hierarchy.split_pos[hierarchy.split_dim >= 0][:3, None]
+    for viewpoint in viewpoints:
+        expected = [
+            block_coll._node_blocks[node.node_id]
+            for node in trunk.kd_traverse(viewpoint=viewpoint)
+        ]
+        assert hierarchy.viewpoint_order(viewpoint).tolist() == expected
+
+    # the order is reused within a cell of the split planes
+    order = hierarchy.viewpoint_order(viewpoints[-1])
+    assert hierarchy.viewpoint_order(viewpoints[-1] + 1e-9) is order
+
+
+def test_pack_blocks():
+    dims = np.random.default_rng(0).integers(1, 20, size=(200, 3))
+    pages, offsets, shapes = _pack_blocks(dims, 64, 40)
+    assert pages.max() > 0
+    for page, shape in enumerate(shapes):
+        in_page = pages == page
+        lo, hi = offsets[in_page], offsets[in_page] + dims[in_page]
+        assert np.all(lo >= 0)
+        assert np.all(hi <= shape)
+        assert shape[0] <= 64 and shape[1] <= 64 and shape[2] <= 40
+        # no two boxes on a page overlap
+        overlap = np.all(
+            (lo[:, None, :] < hi[None, :, :]) & (lo[None, :, :] < hi[:, None, :]),
+            axis=-1,
+        )
+        assert np.array_equal(overlap, np.eye(len(lo), dtype="bool"))
+
+    with pytest.raises(ValueError):
+        _pack_blocks(dims, 64, 10)
+
+
+@pytest.mark.parametrize("render_method", ["max_intensity", "slice"])
+def test_atlas_rendering(osmesa_block_scene, render_method):
+    images = []
+    for use_atlas in (False, True):
+        rc, block_rendering = osmesa_block_scene(
+            use_atlas=use_atlas,
+            atlas_width=64,
+            rendering_kwargs={"render_method": render_method},
+        )
+        images.append(rc.run())
+
+    block_coll = block_rendering.data
+    assert len(block_coll.atlas_textures) < len(block_coll.block_dims)
+    assert np.any(images[0])
+    assert np.allclose(images[0], images[1], atol=1)
+
+
+@pytest.mark.parametrize("use_atlas", [False, True])
+def test_progressive_uploads(osmesa_block_scene, use_atlas):
+    images = []
+    for progressive in (False, True):
+        rc, block_rendering = osmesa_block_scene(
+            use_atlas=use_atlas, progressive=progressive, upload_budget_mb=1e-6
+        )
+        block_coll = block_rendering.data
+        if progressive:
+            assert rc.scene.has_pending_uploads
+            assert not block_coll.block_resident.any()
+            # one block per frame, coarsest levels first
+            levels = []
+            while rc.scene.has_pending_uploads:
+                resident = block_coll.block_resident.copy()
+                rc.run()
+                (new,) = np.flatnonzero(block_coll.block_resident & ~resident)
+                levels.append(block_coll.block_levels[new])
+            assert len(levels) == len(block_coll.block_dims)
+            assert np.all(np.diff(levels) >= 0)
+        images.append(rc.run())
+
+    assert np.array_equal(images[0], images[1])
+
+
+def test_gpu_budget(osmesa_empty_rc, ds_fake_amr):
+    block_coll = BlockCollection(data_source=ds_fake_amr.all_data())
+    block_coll.add_data("radius", no_ghost=True)
+    total = block_coll.resident_bytes
+
+    budget = total / 2.0
+    block_coll = BlockCollection(
+        data_source=ds_fake_amr.all_data(), gpu_budget_mb=budget / 1024**2
+    )
+    block_coll.add_data("radius", no_ghost=True)
+    resident = block_coll.block_resident.copy()
+    assert 0 < resident.sum() < resident.size
+    assert block_coll.resident_bytes <= budget
+    assert set(block_coll.texture_objects) == set(np.flatnonzero(resident))
+    # everything resident is drawn, so nothing can be evicted
+    assert not block_coll.has_pending_uploads
+
+    # only the resident blocks are drawn
+    camera = TrackballCamera.from_dataset(ds_fake_amr)
+    drawn = [vbo_i for vbo_i, _, _ in block_coll.viewpoint_iter(camera)]
+    assert sorted(drawn) == np.flatnonzero(resident).tolist()
+
+    # blocks that went unused since the last traversal are evicted first
+    stale = np.flatnonzero(resident)[::2]
+    block_coll._last_drawn[stale] -= 1
+    block_coll._budget_full = False
+    stale_textures = [block_coll.texture_objects[vbo_i] for vbo_i in stale]
+    block_coll.upload_pending(camera)
+
+    evicted = resident & ~block_coll.block_resident
+    assert evicted.any()
+    assert np.all(np.isin(np.flatnonzero(evicted), stale))
+    assert (block_coll.block_resident & ~resident).any()
+    assert block_coll.resident_bytes <= budget
+    for vbo_i, tex in zip(stale, stale_textures):
+        if evicted[vbo_i]:
+            # the texture was released
+            assert tex.texture_name == 0
+            assert vbo_i in block_coll._upload_queue
+
+
+def test_encode_normalized_data():
+    from yt_idv.opengl_support import encode_normalized_data
+
+    data = np.random.default_rng(0).random((4, 5, 6)).astype("f4")
+    data[0, 0, 0] = 1e-9
+    for storage_format, dtype, atol in [
+        ("float32", "float32", 0.0),
+        ("float16", "float16", 1e-3),
+        ("unorm16", "uint16", 1.0 / 65535),
+        ("unorm8", "uint8", 1.0 / 255),
+    ]:
+        encoded = encode_normalized_data(data, storage_format)
+        assert encoded.dtype == dtype
+        decoded = encoded.astype("f8")
+        if encoded.dtype.kind == "u":
+            decoded /= np.iinfo(encoded.dtype).max
+            assert encoded[0, 0, 0] > 0
+        assert np.allclose(decoded, data, atol=atol, rtol=0)
+
+    # log scaling keeps the relative precision over several decades
+    ratio = 1e6
+    values = np.geomspace(1.0, ratio, 50)
+    data = (values - 1.0) / (ratio - 1.0)
+    encoded = encode_normalized_data(data, "unorm8", log_ratio=ratio)
+    decoded = (ratio ** (encoded / 255.0) - 1.0) / (ratio - 1.0)
+    assert np.allclose(1.0 + decoded * (ratio - 1.0), values, rtol=0.03)
+
+    # with a ratio for each channel, channels are encoded independently
+    stacked = np.stack([data, data], axis=-1)
+    encoded = encode_normalized_data(stacked, "unorm8", log_ratio=[ratio, 0.0])
+    assert np.array_equal(
+        encoded[..., 0], encode_normalized_data(data, "unorm8", log_ratio=ratio)
+    )
+    assert np.array_equal(encoded[..., 1], encode_normalized_data(data, "unorm8"))
+
+
+@pytest.mark.parametrize("storage_format", ["float16", "unorm16", "unorm8"])
+def test_storage_formats(osmesa_block_scene, storage_format):
+    images = []
+    sizes = []
+    for fmt in ("float32", storage_format):
+        rc, block_rendering = osmesa_block_scene(storage_format=fmt)
+        block_coll = block_rendering.data
+        images.append(rc.run())
+        sizes.append(block_coll.resident_bytes)
+
+    assert sizes[1] < sizes[0]
+    assert block_coll.data_log_ratio == (
+        block_coll.max_val / block_coll.min_val if storage_format == "unorm8" else 0
+    )
+    assert np.any(images[0])
+    # quantization mostly shows up at the bottom of the log colormap
+    assert np.abs(images[0] - images[1]).mean() < 0.01
+
+
+def test_unmasked_blocks(osmesa_empty_rc, ds_fake_amr):
+    # kd-tree blocks never overlap, so only a selection leaves cells masked
+    sphere = ds_fake_amr.sphere(ds_fake_amr.domain_center, 0.3)
+    block_coll = BlockCollection(data_source=sphere)
+    block_coll.add_data("radius", no_ghost=True)
+    unmasked = block_coll.block_unmasked
+    assert unmasked.any() and not unmasked.all()
+    shared = {
+        id(block_coll.bitmap_objects[vbo_i]) for vbo_i in np.flatnonzero(unmasked)
+    }
+    assert shared == {id(block_coll._unmasked_bitmap)}
+    textures = list(block_coll.texture_objects.values())
+    textures += list(block_coll.macrocell_objects.values())
+    data_bytes = sum(tex.data.nbytes for tex in textures)
+    mask_bytes = sum(
+        m.size for m, u in zip(block_coll._block_data[1], unmasked) if not u
+    )
+    assert block_coll.resident_bytes == data_bytes + mask_bytes
+
+    # masking out every cell gives each block its own bitmap
+    block_coll.filter_callback(lambda grid: np.zeros(grid.ActiveDimensions))
+    assert not block_coll.block_unmasked.any()
+    assert not block_coll._unmasked_attribute.data.any()
+    bitmaps = list(block_coll.bitmap_objects.values())
+    assert len({id(bitmap) for bitmap in bitmaps}) == len(bitmaps)
+    assert not any(bitmap.data.any() for bitmap in bitmaps)
+
+    # and unmasking them again releases those bitmaps
+    block_coll.filter_callback(lambda grid: np.ones(grid.ActiveDimensions))
+    assert block_coll.block_unmasked.all()
+    assert block_coll._unmasked_attribute.data.all()
+    assert all(tex.texture_name == 0 for tex in bitmaps)
+    assert block_coll.resident_bytes == data_bytes
+
+
+@pytest.mark.parametrize("use_atlas", [False, True])
+def test_set_field(osmesa_empty_rc, ds_fake_amr, use_atlas):
+    fresh = BlockCollection(data_source=ds_fake_amr.all_data(), use_atlas=use_atlas)
+    fresh.add_data("Density", no_ghost=True)
+
+    block_coll = BlockCollection(
+        data_source=ds_fake_amr.all_data(), use_atlas=use_atlas
+    )
+    block_coll.add_data("radius", no_ghost=True)
+    attributes = list(block_coll.vertex_array.attributes)
+    textures = dict(block_coll.texture_objects)
+    pages = list(block_coll.atlas_textures)
+    block_coll.set_field("Density")
+
+    assert block_coll.field == "Density"
+    assert block_coll.min_val == fresh.min_val
+    assert block_coll.max_val == fresh.max_val
+    assert np.array_equal(block_coll.block_max_vals, fresh.block_max_vals)
+    # the geometry and textures are updated in place
+    assert block_coll.vertex_array.attributes == attributes
+    assert block_coll.texture_objects == textures
+    assert block_coll.atlas_textures == pages
+    for tex, fresh_tex in zip(pages, fresh.atlas_textures):
+        assert np.array_equal(tex.data, fresh_tex.data)
+    for vbo_i, tex in textures.items():
+        assert np.array_equal(tex.data, fresh.texture_objects[vbo_i].data)
+
+
+@pytest.mark.parametrize("use_atlas", [False, True])
+def test_multi_field_rendering(osmesa_block_scene, use_atlas):
+    fields = ["radius", "Density"]
+    images = {}
+    for field in fields + [fields]:
+        rc, rendering = osmesa_block_scene(field, use_atlas=use_atlas)
+        block_coll = rendering.data
+        if field is fields:
+            assert block_coll.fields == fields
+            assert block_coll.block_max_vals.shape == (len(block_coll.block_dims), 2)
+            # each field is drawn from its own channel of the same textures
+            for field_index, name in enumerate(fields):
+                rendering.field_index = field_index
+                images[name, "multi"] = rc.run()
+            with pytest.raises(traitlets.TraitError):
+                rendering.field_index = 2
+        else:
+            images[field] = rc.run()
+
+    for name in fields:
+        assert np.any(images[name])
+        assert np.array_equal(images[name], images[name, "multi"])
+
+
+def test_multi_field_isocontours(osmesa_block_scene):
+    images = []
+    for field, field_index in (("Density", 0), (["radius", "Density"], 1)):
+        rc, rendering = osmesa_block_scene(field)
+        block_coll = rendering.data
+        vmin = block_coll.field_min_vals[field_index]
+        vmax = block_coll.field_max_vals[field_index]
+        rendering.field_index = field_index
+        rendering.render_method = "isocontours"
+        rendering.iso_log = False
+        rendering.iso_layers = [0.5 * (vmin + vmax)]
+        rendering.iso_layers_alpha = [1.0]
+        rendering.iso_tolerance = 0.05 * (vmax - vmin)
+        assert rendering._iso_range == (vmin, vmax)
+        images.append(rc.run())
+
+    # the isocontours of the second field are matched against its own range
+    assert block_coll.min_val != block_coll.field_min_vals[1]
+    assert np.any(images[0])
+    assert np.array_equal(images[0], images[1])
+
+
+def test_frustum_culling(osmesa_block_scene):
+    images = []
+    for frustum_culling in (False, True):
+        rc, block_rendering = osmesa_block_scene(frustum_culling=frustum_culling)
+        # from inside the domain, looking along z
+        rc.scene.camera.focus = np.array([0.5, 0.5, 1.0])
+        rc.scene.camera.set_position(np.array([0.5, 0.5, 0.25]))
+        images.append(rc.run())
+
+    block_coll = block_rendering.data
+    stats = block_coll.cull_stats
+    assert stats["blocks"] == len(block_coll.block_dims)
+    assert 0 < stats["culled"] < stats["blocks"]
+    drawn = block_coll._viewpoint_order(rc.scene.camera)
+    assert drawn.size == stats["visible"]
+    # only blocks entirely behind the camera or outside of the view are culled
+    assert np.any(images[0])
+    assert np.array_equal(images[0], images[1])
+
+
+def test_boxes_in_frustum():
+    camera = TrackballCamera(
+        focus=np.array([0.0, 0.0, -1.0]), up=np.array([0.0, 1.0, 0.0])
+    )
+    camera.set_position(np.array([0.0, 0.0, 0.0]))
+    # in front of, behind and to the side of the camera
+    le = np.array([[-0.1, -0.1, -1.1], [-0.1, -0.1, 0.5], [5.0, -0.1, -1.1]])
+    assert camera.boxes_in_frustum(le, le + 0.2).tolist() == [True, False, False]
+
+
+def test_sample_ranges(osmesa_empty_rc, ds_fake_amr):
+    from yt_idv.opengl_support import decode_normalized_data
+
+    block_coll = BlockCollection(
+        data_source=ds_fake_amr.all_data(), storage_format="unorm8"
+    )
+    block_coll.add_data("radius", no_ghost=True)
+    log_ratio = block_coll.field_log_ratios[0]
+    for vbo_i, tex in block_coll.texture_objects.items():
+        values = decode_normalized_data(tex.data, "unorm8", log_ratio)
+        assert values.min() >= block_coll.block_sample_min[vbo_i, 0]
+        assert values.max() <= block_coll.block_sample_max[vbo_i, 0]
+
+
+def test_empty_space_skipping(osmesa_block_scene):
+    images = []
+    for skip_empty_blocks in (False, True):
+        rc, block_rendering = osmesa_block_scene(
+            rendering_kwargs={
+                "render_method": "transfer_function",
+                "tf_min": 0.9,
+                "tf_max": 1.0,
+                "tf_log": False,
+                "skip_empty_blocks": skip_empty_blocks,
+            }
+        )
+        images.append(rc.run())
+
+    nonempty = block_rendering._nonempty_blocks()
+    assert 0 < np.count_nonzero(nonempty) < nonempty.size
+    assert np.any(images[0])
+    assert np.array_equal(images[0], images[1])
+
+    # a transfer function that is zero below 0.95 narrows the visible range
+    tf_data = block_rendering.transfer_function.data.copy()
+    tf_data[:128] = 0
+    block_rendering.transfer_function.data = tf_data
+    low, high = block_rendering._visible_range()
+    assert 0.949 < low < 0.95 and high == 1.0
+    assert np.count_nonzero(block_rendering._nonempty_blocks()) < np.count_nonzero(
+        nonempty
+    )
+    block_rendering.skip_empty_blocks = False
+    assert block_rendering._nonempty_blocks() is None
+
+
+def test_macrocell_ranges():
+    data = np.random.default_rng(0).random((19, 9, 4, 2))
+    mins, maxs = _macrocell_ranges(data, 4)
+    assert mins.shape == maxs.shape == (5, 2, 1, 2)
+    for i, j, k in np.ndindex(*mins.shape[:3]):
+        # each macro-cell includes the vertices on its upper faces
+        cells = data[4 * i : 4 * i + 5, 4 * j : 4 * j + 5, 4 * k : 4 * k + 5]
+        assert np.array_equal(mins[i, j, k], cells.min(axis=(0, 1, 2)))
+        assert np.array_equal(maxs[i, j, k], cells.max(axis=(0, 1, 2)))
+
+
+def test_macrocell_leaping(osmesa_block_scene):
+    images = []
+    for macrocell_size in (0, 4):
+        rc, block_rendering = osmesa_block_scene(
+            macrocell_size=macrocell_size,
+            rendering_kwargs={
+                "render_method": "transfer_function",
+                "tf_min": 0.8,
+                "tf_max": 1.0,
+                "tf_log": False,
+            },
+        )
+        images.append(rc.run())
+
+    block_coll = block_rendering.data
+    assert len(block_coll.macrocell_objects) == len(block_coll.block_dims)
+    for vbo_i, tex in block_coll.macrocell_objects.items():
+        n_macro = -(-block_coll.block_dims[vbo_i] // 4)
+        assert tex.data.shape == tuple(n_macro) + (2,)
+        assert tex.data[..., 0].min() >= block_coll.block_sample_min[vbo_i, 0]
+        assert tex.data[..., 1].max() <= block_coll.block_sample_max[vbo_i, 0]
+    assert np.any(images[0])
+    # leaping over empty macro-cells lands on the same samples along each ray
+    assert np.array_equal(images[0], images[1])
+
+
+def test_front_to_back(osmesa_block_scene):
+    images = []
+    for early_termination_alpha in (None, 0.99, 0.1):
+        rc, block_rendering = osmesa_block_scene(
+            rendering_kwargs={
+                "render_method": "transfer_function_front_to_back",
+                "tf_log": False,
+                "sample_factor": 4.0,
+                "early_termination_alpha": early_termination_alpha,
+            }
+        )
+        images.append(rc.run())
+
+    block_coll = block_rendering.data
+    back_to_front = [i for i, _, _ in block_coll.viewpoint_iter(rc.scene.camera)]
+    front_to_back = block_coll.viewpoint_iter(rc.scene.camera, front_to_back=True)
+    assert [i for i, _, _ in front_to_back] == back_to_front[::-1]
+    assert np.any(images[0])
+    # rays only stop once little more can show through
+    assert np.allclose(images[0], images[1], atol=0.02)
+    # while stopping them early leaves out what is behind
+    assert images[2][..., :3].sum() < images[0][..., :3].sum()
+
+
+def test_restrict_data():
+    # a linear ramp along x, split between two blocks
+    x = np.linspace(0.0, 1.0, 9)
+    ramp = np.broadcast_to(x[:, None, None], (9, 5, 5))
+    data = [ramp[:5], ramp[4:]]
+    edges = [
+        (np.zeros(3), np.array([0.5, 1.0, 1.0])),
+        (np.array([0.5, 0.0, 0.0]), np.ones(3)),
+    ]
+    dims = np.array([4, 2, 2])
+    restricted = _restrict_data(data, edges, np.zeros(3), np.ones(3), dims)
+    assert restricted.shape == (5, 3, 3)
+    # interior vertices average symmetrically about themselves
+    assert np.allclose(restricted[1:-1], np.linspace(0.0, 1.0, 5)[1:-1, None, None])
+    # and vertices outside of the blocks have no data
+    outside = _restrict_data(data[:1], edges[:1], np.zeros(3), np.ones(3), dims)
+    assert np.isnan(outside[-1]).all()
+
+
+def test_level_of_detail(osmesa_block_scene, ds_fake_amr):
+    rc, block_rendering = osmesa_block_scene(
+        lod=True, rendering_kwargs={"sample_factor": 4.0}
+    )
+    block_coll = block_rendering.data
+    coarsest, finest = block_coll.level_range
+    assert (coarsest, finest) == (0, 4)
+    full = rc.run()
+    textures = dict(block_coll.texture_objects)
+
+    n_leaves = block_coll._n_leaf_blocks
+    le, re = block_coll._cull_boxes
+    block_coll.frustum_culling = False
+    n_drawn = []
+    images = []
+    for level in range(finest, coarsest - 1, -1):
+        order = block_coll._viewpoint_order(rc.scene.camera, max_level=level)
+        n_drawn.append(order.size)
+        # the blocks drawn still tile the whole domain
+        assert np.prod(re[order] - le[order], axis=1).sum() == pytest.approx(1.0)
+        assert block_coll.block_levels[order].max() == level
+        assert np.all((order < n_leaves) | (block_coll.block_levels[order] == level))
+        block_rendering.max_level = level
+        images.append(rc.run())
+    assert n_drawn == sorted(n_drawn, reverse=True)
+    assert n_drawn[-1] < n_drawn[0]
+    assert np.array_equal(images[0], full)
+    assert not np.array_equal(images[-1], full)
+    assert np.allclose(images[-1], full, atol=0.05)
+    # switching levels uploads nothing
+    assert block_coll.texture_objects == textures
+
+    block_rendering.max_level = None
+    block_rendering.lod_distance = 0.6 * np.linalg.norm(
+        rc.scene.camera.position - rc.scene.camera.focus
+    )
+    assert block_rendering._max_level(rc.scene) == finest - 1
+
+    plain = BlockCollection(data_source=ds_fake_amr.all_data())
+    plain.add_data("radius", no_ghost=True)
+    assert plain.level_range == (finest, finest)
+    with pytest.raises(ValueError):
+        plain._viewpoint_order(rc.scene.camera, max_level=coarsest)
+
+
+def test_brick_pyramid():
+    data = np.random.default_rng(0).random((9, 5, 17, 2)).astype("float32")
+    levels = _brick_pyramid(data, 8)
+    # with the sizes of the OpenGL mipmap levels, down to a single vertex
+    assert [level.shape[:3] for level in levels] == [
+        (4, 2, 8),
+        (2, 1, 4),
+        (1, 1, 2),
+        (1, 1, 1),
+    ]
+    assert len(_brick_pyramid(data, 2)) == 2
+    for level in levels:
+        # laid out as textures are uploaded, x fastest and fields together
+        assert level.dtype == np.float32
+        assert level.transpose(2, 1, 0, 3).flags.c_contiguous
+        # box filtering keeps values within the range of the data
+        assert level.min() >= data.min() and level.max() <= data.max()
+    assert np.allclose(levels[-1][0, 0, 0], data.mean(axis=(0, 1, 2)), atol=0.02)
+    constant = np.full((9, 9, 9), 0.25, dtype="float32")
+    for level in _brick_pyramid(constant, 3):
+        assert np.allclose(level, 0.25)
+    with_nan = constant.copy()
+    with_nan[:4] = np.nan
+    assert np.allclose(_brick_pyramid(with_nan, 3)[-1], 0.25)
+
+
+def test_mipmaps(osmesa_block_scene):
+    images = []
+    resident_bytes = []
+    for mipmap_levels, mipmap_bias in ((0, 0.0), (2, -10.0), (2, 0.0), (2, 3.0)):
+        rc, block_rendering = osmesa_block_scene(
+            mipmap_levels=mipmap_levels,
+            rendering_kwargs={"mipmap_bias": mipmap_bias},
+        )
+        block_coll = block_rendering.data
+        images.append(rc.run())
+        resident_bytes.append(block_coll.resident_bytes)
+
+    mipmap_bytes = 0
+    for vbo_i, tex in block_coll.texture_objects.items():
+        # small blocks stop once they are a single vertex along every axis
+        dims = block_coll.block_dims[vbo_i] + 1
+        n_levels = min(int(np.log2(dims.max())), 2)
+        assert [m.shape for m in tex.mipmaps] == [
+            tuple(np.maximum(dims >> k, 1)) for k in range(1, n_levels + 1)
+        ]
+        mipmap_bytes += sum(m.nbytes for m in tex.mipmaps)
+    assert resident_bytes[1] - resident_bytes[0] == mipmap_bytes
+    # rays sample the full resolution data unless the blocks are small on
+    # screen, and coarser levels give close but different images
+    assert np.array_equal(images[0], images[1])
+    assert not np.array_equal(images[0], images[2])
+    assert np.abs(images[2] - images[0]).max() < 0.05
+    assert not np.array_equal(images[2], images[3])
+
+
+def test_block_upload_copies(osmesa_empty_rc, ds_fake_amr):
+    block_coll = BlockCollection(data_source=ds_fake_amr.all_data(), macrocell_size=0)
+    block_coll.add_data("radius", no_ghost=True)
+    # yt hands over C-ordered float64 blocks
+    data = np.random.default_rng(0).random((65, 65, 65))
+    mask = np.ones(data.shape, dtype="u1")
+    # leaving out what PyOpenGL allocates the first time around
+    block_coll._upload_block(0, *block_coll._prepare_block(data[:2], None, True))
+
+    tracemalloc.start()
+    prepared = block_coll._prepare_block(data, mask, True)
+    _, prepare_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    block_coll._upload_block(0, *prepared)
+    current, upload_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n_data, bitmap = prepared[:2]
+    nbytes = n_data.nbytes + bitmap.nbytes
+    # the data is converted in a single pass into the layout it is uploaded
+    # in, leaving only a mask over the data for skipping zeros, and uploaded
+    # without copying it again
+    assert prepare_peak < 1.1 * nbytes
+    assert upload_peak - current < 0.05 * nbytes
+    assert block_coll.texture_objects[0].data is n_data
+    assert block_coll.bitmap_objects[0].data is bitmap
+    expected = block_coll._normalize_fields(data.astype("f4"))
+    assert np.allclose(n_data, expected, atol=2 * np.finfo("f4").eps)
+    assert np.all(bitmap == 255)
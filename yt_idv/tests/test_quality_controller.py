@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from yt_idv.quality_controller import QualityController
+
+
+def test_quality_controller():
+    controller = QualityController(target_frame_ms=33.0, idle_delay=60.0)
+    controller.start_frame()
+    assert controller.quality == 1.0
+    assert not controller.refining
+
+    # nothing is known about the cost of a frame before the first one
+    controller.interact()
+    controller.start_frame()
+    assert controller.quality == 1.0
+    controller.record_frame(132.0)
+    controller.start_frame()
+    assert controller.quality == pytest.approx(0.25)
+    assert controller.render_scale == 0.625
+    assert controller.sample_scale == pytest.approx(0.5)
+    assert controller.level_drop == 2
+    # a frame at this quality costs a fraction of a full one
+    controller.record_frame(132.0 * 0.625**2 * 0.5)
+    controller.start_frame()
+    assert controller.quality == pytest.approx(0.25)
+    controller.target_frame_ms = 1.0
+    controller.start_frame()
+    assert controller.quality == controller.min_quality
+
+    controller.end_interaction()
+    qualities = []
+    while controller.refining:
+        controller.start_frame()
+        qualities.append(controller.quality)
+    assert qualities == pytest.approx([0.1, 0.2, 0.4, 0.8, 1.0])
+    assert controller.render_scale == 1.0
+    assert controller.sample_scale == 1.0
+    assert controller.level_drop == 0
+
+
+def test_adaptive_quality(osmesa_block_scene):
+    rc, block_rendering = osmesa_block_scene(rendering_kwargs={"sample_factor": 4.0})
+    full = rc.run()
+
+    controller = QualityController(target_frame_ms=1e-6, idle_delay=60.0)
+    rc.scene.quality_controller = controller
+    controller.interact()
+    # nothing in the scene changed, so frames are only drawn, and timed, if
+    # forced to be; timings are read once the GPU is done with them
+    for _ in range(100):
+        rc.scene.render(redraw=True)
+        if controller.frame_ms is not None:
+            break
+    assert controller.frame_ms > 0
+    preview = rc.run()
+    assert controller.quality == controller.min_quality
+    assert list(block_rendering._scaled_fbs) == [controller.render_scale]
+    assert preview.shape == full.shape
+    assert np.any(preview[..., 3] > 0)
+    assert not np.array_equal(preview, full)
+
+    controller.end_interaction()
+    while controller.refining:
+        image = rc.run()
+    assert np.array_equal(image, full)
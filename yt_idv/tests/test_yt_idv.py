@@ -1,14 +1,24 @@
 """Tests for `yt_idv` package."""
 
+import tracemalloc
+
 import numpy as np
 import pytest
 import yt
 import yt.testing
 from numpy.testing import assert_equal
+from OpenGL import GL
 
 import yt_idv
 from yt_idv import shader_objects
 from yt_idv.cameras.trackball_camera import TrackballCamera
+from yt_idv.framebuffer_reduction import MinMaxReduction
+from yt_idv.opengl_support import (
+    Framebuffer,
+    Texture3D,
+    VertexAttribute,
+    empty_texture_data,
+)
 from yt_idv.scene_components.blocks import BlockRendering
 from yt_idv.scene_components.curves import CurveCollectionRendering, CurveRendering
 from yt_idv.scene_data.block_collection import BlockCollection
@@ -282,3 +292,304 @@ def test_block_collection_min_max(image_store):
 
     image_store(rc)
     rc.osmesa.OSMesaDestroyContext(rc.context)
+
+
+def test_render_cache(osmesa_fake_amr, monkeypatch):
+    rc = osmesa_fake_amr
+    component = rc.scene.components[0]
+    counts = {"draw": 0, "run_program": 0}
+
+    def _counted(name, func):
+        def _wrapper(*args, **kwargs):
+            counts[name] += 1
+            return func(*args, **kwargs)
+
+        return _wrapper
+
+    monkeypatch.setattr(component, "draw", _counted("draw", component.draw))
+    monkeypatch.setattr(
+        component, "run_program", _counted("run_program", component.run_program)
+    )
+    image = rc.run()
+    assert counts == {"draw": 1, "run_program": 1}
+    # nothing changed, so the frame is not drawn at all
+    assert np.array_equal(rc.run(), image)
+    assert counts == {"draw": 1, "run_program": 1}
+    # unless asked to, in which case the first pass is composited as it was
+    rc.scene.render(redraw=True)
+    assert np.array_equal(rc.scene.image, image)
+    assert counts == {"draw": 1, "run_program": 2}
+    # colormaps and annotations only change the composite
+    component.colormap.colormap_name = "viridis"
+    component.cmap_log = False
+    rc.scene.add_box([0.25, 0.25, 0.25], [0.75, 0.75, 0.75])
+    assert not np.array_equal(rc.run(), image)
+    assert counts == {"draw": 1, "run_program": 3}
+    # while the camera, the component's own traits and its data do not
+    rc.scene.camera.offset_position(0.25)
+    rc.run()
+    assert counts["draw"] == 2
+    component.render_method = "transfer_function"
+    rc.run()
+    component.transfer_function.data = component.transfer_function.data // 2
+    rc.run()
+    component.data.filter_callback(lambda grid: grid["index", "x"] < 0.5)
+    rc.run()
+    assert counts == {"draw": 5, "run_program": 7}
+
+    # switching to a local framebuffer draws the frame into it once
+    rc.scene.fb = Framebuffer()
+    image = rc.run()
+    assert counts == {"draw": 5, "run_program": 8}
+    assert np.array_equal(rc.run(), image)
+    assert counts["run_program"] == 8
+    component.tf_max = 0.5
+    rc.run()
+    assert counts == {"draw": 6, "run_program": 9}
+
+
+def test_render_cache_display_bounds(osmesa_fake_amr, monkeypatch):
+    # components drawn into part of the window compare the viewport they
+    # render at, not the window's
+    rc = osmesa_fake_amr
+    component = rc.scene.components[0]
+    component.display_bounds = (0.25, 0.75, 0.0, 0.5)
+    calls = []
+    draw = component.draw
+    monkeypatch.setattr(component, "draw", lambda *args: calls.append(1) or draw(*args))
+    image = rc.run()
+    assert len(calls) == 1
+    assert component._first_pass_key[1] == (0, 0, 512, 512)
+    assert not component._needs_render(rc.scene, (256, 0, 512, 512))
+    assert np.array_equal(rc.run(), image)
+    rc.scene.render(redraw=True)
+    assert len(calls) == 1
+    # resizing the component's part of the window renders it again
+    component.display_bounds = (0.0, 1.0, 0.0, 0.5)
+    rc.run()
+    assert len(calls) == 2
+    assert component._first_pass_key[1] == (0, 0, 1024, 512)
+
+
+def test_uniform_cache(osmesa_fake_amr, monkeypatch):
+    rc = osmesa_fake_amr
+    component = rc.scene.components[0]
+    rc.run()
+    program = component.program1
+    # arrays of uniforms are found by the name of the array
+    assert program._uniform_locations["ds_tex"] >= 0
+    calls = []
+    monkeypatch.setattr(
+        GL, "glGetUniformLocation", lambda *args: calls.append(args) or -1
+    )
+    for name in ("sample_factor", "modelview"):
+        func = program._uniform_funcs[name]
+        monkeypatch.setitem(
+            program._uniform_funcs,
+            name,
+            lambda loc, value, name=name, func=func: calls.append(name)
+            or func(loc, value),
+        )
+    image = rc.run()
+    modelview = program._uniform_values["modelview"]
+    rc.scene.camera.offset_position(0.25)
+    moved = rc.run()
+    # locations are looked up once, and only values that changed are set, into
+    # the buffers already holding them
+    assert calls == ["modelview"]
+    assert not np.array_equal(image, moved)
+    assert program._uniform_values["modelview"] is modelview
+    assert np.array_equal(modelview, rc.scene.camera.view_matrix)
+    component.sample_factor = 2.0
+    rc.run()
+    assert calls == ["modelview", "sample_factor"]
+    # the location is returned whether or not the value is set
+    location = program._uniform_locations["sample_factor"]
+    assert program._set_uniform("sample_factor", 2.0) == location
+    assert program._set_uniform("not_a_uniform", 2.0) == -1
+
+
+def test_iter_frames(osmesa_fake_amr):
+    rc = osmesa_fake_amr
+    camera = rc.scene.camera
+    positions = [camera.position + 0.1 * i for i in range(4)]
+    expected = []
+    for position in positions:
+        camera.set_position(position)
+        expected.append(rc.run().copy())
+
+    def _frames():
+        for i, position in enumerate(positions):
+            camera.set_position(position)
+            yield i
+
+    frames = list(rc.iter_frames(_frames(), n_buffers=2))
+    assert [i for i, _ in frames] == list(range(len(positions)))
+    for (_, image), expected_image in zip(frames, expected):
+        assert np.array_equal(image, expected_image)
+    assert not np.array_equal(frames[0][1], frames[-1][1])
+
+
+def test_cmap_reduction(osmesa_fake_amr):
+    assert MinMaxReduction.level_sizes(1024, 1000) == [
+        (256, 250),
+        (64, 63),
+        (16, 16),
+        (4, 4),
+        (1, 1),
+    ]
+    assert MinMaxReduction.level_sizes(1, 1) == [(1, 1)]
+    rc = osmesa_fake_amr
+    component = rc.scene.components[0]
+    rc.run()
+    data = component.fb.data
+    covered = data[:, :, 3] > 0
+    assert covered.any() and not covered.all()
+    for use_db, values in [
+        (False, data[:, :, 0]),
+        (True, component.fb.depth_data),
+    ]:
+        component.use_db = use_db
+        component._reset_cmap_bounds(print_new_bounds=False)
+        # depths are converted from fixed point on the GPU rather than by
+        # glReadPixels, to within a step of the depth buffer
+        assert component.cmap_min == pytest.approx(values[covered].min(), abs=1e-7)
+        assert component.cmap_max == pytest.approx(values[covered].max(), abs=1e-7)
+
+    # nothing covered falls back to the unit interval
+    with component.fb.bind(clear=True):
+        pass
+    component._reset_cmap_bounds(print_new_bounds=False)
+    assert (component.cmap_min, component.cmap_max) == (0.0, 1.0)
+
+
+def test_vertex_attribute_updates(osmesa_empty, monkeypatch):
+    def _buffer_contents(attribute):
+        with attribute.bind():
+            contents = GL.glGetBufferSubData(
+                GL.GL_ARRAY_BUFFER, 0, attribute.data.nbytes
+            )
+        return np.frombuffer(contents, dtype="f4").reshape(-1, 3)
+
+    data = np.arange(30, dtype="f4").reshape(10, 3)
+    attribute = VertexAttribute(name="position", data=data, usage="stream draw")
+    with attribute.bind():
+        usage = GL.glGetBufferParameteriv(GL.GL_ARRAY_BUFFER, GL.GL_BUFFER_USAGE)
+    assert np.ravel(usage)[0] == GL.GL_STREAM_DRAW
+    assert_equal(_buffer_contents(attribute), data)
+
+    allocations = []
+    buffer_data = GL.glBufferData
+    monkeypatch.setattr(
+        GL,
+        "glBufferData",
+        lambda *args: allocations.append(args[1]) or buffer_data(*args),
+    )
+    attribute.set_range(4, np.ones((3, 3)))
+    # the array data was set to is left as is
+    assert_equal(data, np.arange(30).reshape(10, 3))
+    data[4:7] = 1.0
+    assert_equal(attribute.data, data)
+    assert_equal(_buffer_contents(attribute), data)
+    with pytest.raises(IndexError):
+        attribute.set_range(8, np.ones((3, 3)))
+    with pytest.raises(ValueError):
+        attribute.set_range(0, np.ones((3, 4)))
+
+    # data of the same size is updated in place, orphaning the old storage
+    # if asked to, and reallocated otherwise
+    attribute.data = data * 2
+    assert allocations == []
+    attribute.orphan = True
+    attribute.data = data * 3
+    assert allocations == [data.nbytes]
+    assert_equal(_buffer_contents(attribute), data * 3)
+    attribute.data = np.zeros((4, 3), dtype="f4")
+    assert allocations == [data.nbytes, 48]
+    assert_equal(_buffer_contents(attribute), np.zeros((4, 3)))
+
+    # the usage only applies to new storage, so changing it reallocates
+    attribute.usage = "dynamic draw"
+    assert allocations == [data.nbytes, 48, 48]
+    with attribute.bind():
+        usage = GL.glGetBufferParameteriv(GL.GL_ARRAY_BUFFER, GL.GL_BUFFER_USAGE)
+    assert np.ravel(usage)[0] == GL.GL_DYNAMIC_DRAW
+    assert_equal(_buffer_contents(attribute), np.zeros((4, 3)))
+
+
+def test_vertex_array_layout(osmesa_fake_amr, monkeypatch):
+    rc = osmesa_fake_amr
+    component = rc.scene.components[0]
+    vertex_array = component.data.vertex_array
+    rc.run()
+    calls = []
+    for name in ("glGetAttribLocation", "glVertexAttribPointer"):
+        func = getattr(GL, name)
+        monkeypatch.setattr(
+            GL,
+            name,
+            lambda *args, name=name, func=func: calls.append(name) or func(*args),
+        )
+    image = rc.run()
+    rc.scene.camera.offset_position(0.25)
+    moved = rc.run()
+    # the layout is recorded once, and bound as is for every draw
+    assert calls == []
+    assert not np.array_equal(image, moved)
+    assert list(vertex_array._program_vaos) == [component.program1.program]
+
+    # nor again when attributes are set to data of the same type and shape
+    for attribute in vertex_array.attributes:
+        data = attribute.data
+        attribute.data = data * 2
+        attribute.data = data
+    rc.scene.camera.offset_position(-0.25)
+    back = rc.run()
+    assert calls == []
+
+    # and recorded again for a relinked program, releasing the old one's
+    component._recompile_shader()
+    again = rc.run()
+    assert list(vertex_array._program_vaos) == [component.program1.program]
+    # the nine attributes of the blocks, and the quad of the second pass
+    assert calls.count("glVertexAttribPointer") == 10
+    assert np.array_equal(again, back)
+
+
+def test_texture_upload_layouts(osmesa_empty):
+    def _upload_copies(data):
+        # the peak memory allocated while uploading data, in copies of it
+        tracemalloc.start()
+        texture = Texture3D(data=data)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return texture, peak / data.nbytes
+
+    # leaving out what PyOpenGL allocates the first time around
+    for shape in [(2, 2, 2), (2, 2, 2, 2)]:
+        _upload_copies(np.zeros(shape, dtype="float32"))[0].delete()
+    rng = np.random.default_rng(0)
+    values = rng.random((64, 48, 32, 2), dtype="float32")
+    gl_ordered = empty_texture_data(values.shape, "float32")
+    gl_ordered[:] = values
+    larger = np.asfortranarray(rng.random((80, 60, 40), dtype="float32"))
+    layouts = [
+        # data laid out the way OpenGL reads it is uploaded in place, with
+        # the strides of slices of it described by GL_UNPACK_*
+        (gl_ordered, 0),
+        (np.asfortranarray(values[..., 0]), 0),
+        (larger[5:69, 3:51, 4:36], 0),
+        # and anything else is copied once
+        (values, 1),
+        (values[..., 0], 1),
+    ]
+    for data, n_copies in layouts:
+        texture, copies = _upload_copies(data)
+        assert copies == pytest.approx(n_copies, abs=0.05)
+        with texture.bind():
+            uploaded = GL.glGetTexImage(GL.GL_TEXTURE_3D, 0, GL.GL_RGBA, GL.GL_FLOAT)
+        n_channels = data.shape[3] if data.ndim == 4 else 1
+        uploaded = np.asarray(uploaded).reshape(-1, 4)[:, :n_channels]
+        expected = data.transpose((2, 1, 0) + tuple(range(3, data.ndim)))
+        assert_equal(uploaded.ravel(), expected.ravel())
+        texture.delete()
@@ -0,0 +1,83 @@
+cimport cython
+from cython cimport floating
+
+import numpy as np
+
+cimport numpy as np
+from libc.math cimport INFINITY, fabs, isnan
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def abs_nan_range(floating[:, :, :] data):
+    # single-pass, allocation-free equivalent of
+    #   (np.nanmin(np.abs(data)), np.nanmax(np.abs(data)))
+    # returns (inf, -inf) if every value is NaN, so that the result can
+    # always be reduced with min/max across blocks.
+    cdef Py_ssize_t i, j, k
+    cdef np.float64_t val
+    cdef np.float64_t min_val = INFINITY
+    cdef np.float64_t max_val = -INFINITY
+
+    with nogil:
+        for i in range(data.shape[0]):
+            for j in range(data.shape[1]):
+                for k in range(data.shape[2]):
+                    val = data[i, j, k]
+                    if isnan(val):
+                        continue
+                    val = fabs(val)
+                    if val < min_val:
+                        min_val = val
+                    if val > max_val:
+                        max_val = val
+    return min_val, max_val
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def kd_viewpoint_order(np.int64_t[:] left,
+                       np.int64_t[:] right,
+                       np.int32_t[:] split_dim,
+                       np.float64_t[:] split_pos,
+                       np.int64_t[:] node_blocks,
+                       np.float64_t[:] viewpoint,
+                       np.int64_t[:] order):
+    # Fills order with the blocks at the leaves of a flattened kd-tree (see
+    # BrickHierarchy), furthest from viewpoint first, matching
+    # Node.viewpoint_traverse. Node 0 is the root; children are -1 if
+    # missing, as are split_dim for leaves and node_blocks for nodes
+    # without a block. Returns the number of blocks written to order.
+    cdef Py_ssize_t n_nodes = left.shape[0]
+    cdef np.int64_t[:] stack = np.empty(n_nodes + 1, dtype="i8")
+    cdef Py_ssize_t sp = 0, n = 0
+    cdef np.int64_t node, first, second
+    cdef int dim
+
+    if n_nodes == 0:
+        return 0
+    with nogil:
+        stack[0] = 0
+        sp = 1
+        while sp > 0:
+            sp -= 1
+            node = stack[sp]
+            if node_blocks[node] >= 0:
+                order[n] = node_blocks[node]
+                n += 1
+                continue
+            dim = split_dim[node]
+            if dim < 0:
+                continue
+            # the far side of the split plane is visited first
+            if viewpoint[dim] <= split_pos[node]:
+                first, second = right[node], left[node]
+            else:
+                first, second = left[node], right[node]
+            if second >= 0:
+                stack[sp] = second
+                sp += 1
+            if first >= 0:
+                stack[sp] = first
+                sp += 1
+    return n